@@ -0,0 +1,506 @@
+"""
+Almacenamiento de archivos fuera de la colección `documentos`.
+
+Los documentos guardan solo metadatos y una referencia (`blob_id`) al archivo.
+Cada contenido distinto se guarda una sola vez: la colección `blobs` lo registra
+por su SHA-256 y cuenta cuántos documentos lo referencian. Los archivos
+comprimibles se guardan comprimidos (ver compresion.py); `tamaño_bytes` es
+siempre el tamaño original y `tamaño_almacenado` el que ocupa realmente.
+El campo `almacenamiento` indica qué backend contiene el archivo:
+
+- "gridfs": GridFS en la misma base de datos (por defecto)
+- "local": sistema de archivos local
+- "base_datos": formato antiguo, archivo en línea en `contenido_binario`
+
+Uso como comando para migrar documentos antiguos:
+
+    python almacenamiento.py migrar --uri "mongodb+srv://..." [--backend gridfs|local]
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import sys
+import uuid
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+
+import gridfs
+from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+import compresion
+from base_datos import NOMBRE_BD
+
+# Tamaño de cada bloque leído/escrito al subir o descargar (1 MB)
+TAMAÑO_CHUNK = 1024 * 1024
+
+BACKEND_POR_DEFECTO = os.environ.get("DOCS_ALMACENAMIENTO", "gridfs")
+DIRECTORIO_LOCAL = os.environ.get("DOCS_DIRECTORIO_LOCAL", "almacen_archivos")
+BUCKET_GRIDFS = "archivos"
+
+# Documentos antiguos con el archivo dentro del propio registro
+EN_LINEA = "base_datos"
+
+
+class AlmacenGridFS:
+    """Guarda los archivos en GridFS, por bloques de TAMAÑO_CHUNK"""
+
+    nombre = "gridfs"
+
+    def __init__(self, db, bucket=BUCKET_GRIDFS):
+        self.bucket = gridfs.GridFSBucket(db, bucket_name=bucket, chunk_size_bytes=TAMAÑO_CHUNK)
+
+    def guardar(self, flujo, nombre_archivo, metadatos=None):
+        """
+        Sube el contenido de un objeto file-like sin cargarlo entero en memoria.
+        Devuelve (referencia, tamaño_bytes)
+        """
+        destino = self.bucket.open_upload_stream(nombre_archivo, metadata=metadatos)
+        try:
+            tamaño = _copiar_por_partes(flujo, destino)
+            destino.close()
+        except BaseException:
+            # GridIn no aborta solo al salir con una excepción: sin esto los
+            # bloques ya escritos quedarían huérfanos en `archivos.chunks`
+            destino.abort()
+            raise
+        return str(destino._id), tamaño
+
+    def abrir(self, referencia):
+        return self.bucket.open_download_stream(ObjectId(referencia))
+
+    def tamaño(self, referencia):
+        with self.abrir(referencia) as origen:
+            return origen.length
+
+    def eliminar(self, referencia):
+        try:
+            self.bucket.delete(ObjectId(referencia))
+        except gridfs.errors.NoFile:
+            pass
+
+
+class AlmacenLocal:
+    """Guarda los archivos en un directorio local (útil en desarrollo o con un volumen compartido)"""
+
+    nombre = "local"
+
+    def __init__(self, directorio=DIRECTORIO_LOCAL):
+        self.directorio = Path(directorio)
+
+    def _ruta(self, referencia):
+        ruta = (self.directorio / referencia).resolve()
+        if self.directorio.resolve() not in ruta.parents:
+            raise ValueError(f"Referencia inválida: {referencia}")
+        return ruta
+
+    def guardar(self, flujo, nombre_archivo, metadatos=None):
+        identificador = uuid.uuid4().hex
+        referencia = f"{identificador[:2]}/{identificador}{Path(nombre_archivo).suffix.lower()}"
+        ruta = self._ruta(referencia)
+        ruta.parent.mkdir(parents=True, exist_ok=True)
+
+        # Escribir en un temporal y renombrar para no dejar archivos a medias
+        temporal = ruta.with_name(ruta.name + ".tmp")
+        try:
+            with open(temporal, "wb") as destino:
+                tamaño = _copiar_por_partes(flujo, destino)
+            os.replace(temporal, ruta)
+        finally:
+            if temporal.exists():
+                temporal.unlink()
+        return referencia, tamaño
+
+    def abrir(self, referencia):
+        return open(self._ruta(referencia), "rb")
+
+    def tamaño(self, referencia):
+        return self._ruta(referencia).stat().st_size
+
+    def eliminar(self, referencia):
+        try:
+            self._ruta(referencia).unlink()
+        except FileNotFoundError:
+            pass
+
+
+def _copiar_por_partes(origen, destino, tamaño_chunk=TAMAÑO_CHUNK):
+    """Copia de un file-like a otro por bloques y devuelve los bytes copiados"""
+    total = 0
+    while True:
+        bloque = origen.read(tamaño_chunk)
+        if not bloque:
+            return total
+        destino.write(bloque)
+        total += len(bloque)
+
+
+class LectorConHash:
+    """Envuelve un file-like y calcula el SHA-256 de lo que se va leyendo"""
+
+    def __init__(self, flujo):
+        self.flujo = flujo
+        self.sha256 = hashlib.sha256()
+        self.tamaño = 0
+
+    def read(self, tamaño=-1):
+        bloque = self.flujo.read(tamaño)
+        self.sha256.update(bloque)
+        self.tamaño += len(bloque)
+        return bloque
+
+    def hexdigest(self):
+        return self.sha256.hexdigest()
+
+
+def obtener_almacen(db, nombre=None):
+    """Devuelve el backend de almacenamiento indicado (o el configurado por defecto)"""
+    nombre = nombre or BACKEND_POR_DEFECTO
+    if nombre == AlmacenGridFS.nombre:
+        return AlmacenGridFS(db)
+    if nombre == AlmacenLocal.nombre:
+        return AlmacenLocal()
+    raise ValueError(f"Backend de almacenamiento desconocido: {nombre}")
+
+
+def tiene_contenido(doc):
+    """Indica si el documento tiene un archivo descargable"""
+    return bool(doc.get("blob_id") or doc.get("contenido_binario") or doc.get("contenido_en_linea"))
+
+
+def abrir_contenido(db, doc):
+    """Abre el archivo de un documento como file-like, sea cual sea su backend"""
+    if doc.get("almacenamiento", EN_LINEA) == EN_LINEA or not doc.get("blob_id"):
+        contenido = doc.get("contenido_binario")
+        if contenido is None:
+            completo = db.documentos.find_one({"_id": doc["_id"]}, {"contenido_binario": 1}) or {}
+            contenido = completo.get("contenido_binario")
+        if contenido is None:
+            raise FileNotFoundError("El documento no tiene archivo asociado")
+        return io.BytesIO(bytes(contenido))
+
+    origen = obtener_almacen(db, doc["almacenamiento"]).abrir(doc["blob_id"])
+    if doc.get("compresion"):
+        return compresion.FlujoDescomprimido(origen, doc["compresion"], TAMAÑO_CHUNK)
+    return origen
+
+
+def leer_por_partes(db, doc, tamaño_chunk=TAMAÑO_CHUNK):
+    """Generador que devuelve el archivo de un documento por bloques"""
+    with abrir_contenido(db, doc) as origen:
+        while True:
+            bloque = origen.read(tamaño_chunk)
+            if not bloque:
+                break
+            yield bloque
+
+
+def leer_contenido(db, doc):
+    """Devuelve el archivo completo de un documento en bytes"""
+    return b"".join(leer_por_partes(db, doc))
+
+
+def _reutilizado(blob, sha256):
+    return {
+        "almacenamiento": blob["almacenamiento"], "blob_id": blob["blob_id"],
+        "tamaño_bytes": blob["tamaño_bytes"],
+        "tamaño_almacenado": blob.get("tamaño_almacenado", blob["tamaño_bytes"]),
+        "compresion": blob.get("compresion"), "sha256": sha256, "reutilizado": True
+    }
+
+
+def _hash_previo(db, flujo, tamaño):
+    """
+    SHA-256 de un flujo que se puede rebobinar, dejándolo donde estaba; None si no
+    se puede o no compensa: con `tamaño` conocido y ningún archivo de ese tamaño
+    almacenado, el contenido es nuevo seguro y no hace falta leerlo dos veces
+    """
+    if not getattr(flujo, "seekable", lambda: False)():
+        return None
+    if tamaño is not None and db.blobs.find_one({"tamaño_bytes": tamaño}, {"_id": 1}) is None:
+        return None
+    inicio = flujo.tell()
+    lector = LectorConHash(flujo)
+    while lector.read(TAMAÑO_CHUNK):
+        pass
+    flujo.seek(inicio)
+    return lector.hexdigest()
+
+
+def guardar_deduplicado(db, almacen, flujo, nombre_archivo, metadatos=None, tamaño=None):
+    """
+    Sube un archivo calculando su SHA-256 (comprimiéndolo si compensa) y lo
+    registra en `blobs`. Si el flujo se puede rebobinar, el SHA-256 se calcula
+    antes y un contenido ya almacenado solo suma una referencia, sin subir nada
+    (`tamaño`, si se conoce, evita esa lectura previa cuando ningún archivo
+    almacenado mide lo mismo). Si no, se sube y, si resulta que ya había un
+    archivo con el mismo contenido, se descarta la copia y se suma la referencia.
+    Devuelve un dict con almacenamiento, blob_id, tamaño_bytes, tamaño_almacenado,
+    compresion, sha256 y reutilizado
+    """
+    sha256_previo = _hash_previo(db, flujo, tamaño)
+    if sha256_previo is not None:
+        existente = db.blobs.find_one_and_update(
+            {"_id": sha256_previo},
+            {"$inc": {"referencias": 1}},
+            return_document=ReturnDocument.AFTER
+        )
+        if existente is not None:
+            return _reutilizado(existente, sha256_previo)
+
+    lector = LectorConHash(flujo)
+    primer_bloque = lector.read(TAMAÑO_CHUNK)
+    codec = compresion.elegir_codec(primer_bloque)
+    if codec:
+        datos = compresion.FlujoComprimido(primer_bloque, lector, codec, TAMAÑO_CHUNK)
+    else:
+        datos = compresion.FlujoConPrefijo(primer_bloque, lector)
+
+    referencia, tamaño_almacenado = almacen.guardar(datos, nombre_archivo, metadatos)
+    tamaño = lector.tamaño
+    sha256 = lector.hexdigest()
+
+    try:
+        for intento in range(2):
+            try:
+                anterior = db.blobs.find_one_and_update(
+                    {"_id": sha256},
+                    {
+                        "$inc": {"referencias": 1},
+                        "$setOnInsert": {
+                            "almacenamiento": almacen.nombre,
+                            "blob_id": referencia,
+                            "tamaño_bytes": tamaño,
+                            "tamaño_almacenado": tamaño_almacenado,
+                            "compresion": codec,
+                            "fecha_creacion": datetime.utcnow()
+                        }
+                    },
+                    upsert=True,
+                    return_document=ReturnDocument.BEFORE
+                )
+                break
+            except DuplicateKeyError:
+                # Dos upserts simultáneos del mismo contenido: al reintentar, este ya encuentra el registro
+                if intento:
+                    raise
+    except Exception:
+        almacen.eliminar(referencia)
+        raise
+
+    if anterior is None:
+        return {
+            "almacenamiento": almacen.nombre, "blob_id": referencia,
+            "tamaño_bytes": tamaño, "tamaño_almacenado": tamaño_almacenado,
+            "compresion": codec, "sha256": sha256, "reutilizado": False
+        }
+
+    # Contenido ya almacenado: conservar solo la copia existente
+    almacen.eliminar(referencia)
+    return _reutilizado(anterior, sha256)
+
+
+def eliminar_contenido(db, doc):
+    """
+    Libera el archivo referenciado por un documento (no hace nada si está en línea).
+    Los archivos deduplicados solo se borran cuando se va su última referencia
+    """
+    if not doc.get("blob_id") or doc.get("almacenamiento", EN_LINEA) == EN_LINEA:
+        return
+
+    if doc.get("sha256"):
+        blob = db.blobs.find_one_and_update(
+            {"_id": doc["sha256"]},
+            {"$inc": {"referencias": -1}},
+            return_document=ReturnDocument.AFTER
+        )
+        if blob is not None:
+            # Solo se borra si nadie sumó una referencia mientras tanto
+            if blob["referencias"] <= 0 and db.blobs.delete_one({"_id": blob["_id"], "referencias": {"$lte": 0}}).deleted_count:
+                obtener_almacen(db, blob["almacenamiento"]).eliminar(blob["blob_id"])
+            return
+
+    obtener_almacen(db, doc["almacenamiento"]).eliminar(doc["blob_id"])
+
+
+def liberar_contenidos(db, docs):
+    """
+    Libera en bloque los archivos de varios documentos ya eliminados: un solo
+    bulk_write descuenta las referencias de todos los archivos deduplicados y
+    solo se borran los que se quedan sin ninguna. Devuelve los errores al
+    borrar archivos (el registro en `blobs` ya no existe, el archivo queda huérfano)
+    """
+    errores = []
+    referencias = Counter()
+    sin_registro = []
+    for doc in docs:
+        if not doc.get("blob_id") or doc.get("almacenamiento", EN_LINEA) == EN_LINEA:
+            continue
+        if doc.get("sha256"):
+            referencias[doc["sha256"]] += 1
+        else:
+            sin_registro.append(doc)
+
+    if referencias:
+        db.blobs.bulk_write(
+            [UpdateOne({"_id": sha256}, {"$inc": {"referencias": -cantidad}}) for sha256, cantidad in referencias.items()],
+            ordered=False
+        )
+        blobs = {blob["_id"]: blob for blob in db.blobs.find({"_id": {"$in": list(referencias)}})}
+        # Documentos deduplicados cuyo contenido no está registrado: se borra su archivo directamente
+        sin_registro.extend(doc for doc in docs if doc.get("sha256") in referencias and doc["sha256"] not in blobs)
+        for blob in blobs.values():
+            # Solo se borra si nadie sumó una referencia mientras tanto
+            if blob["referencias"] <= 0 and db.blobs.delete_one({"_id": blob["_id"], "referencias": {"$lte": 0}}).deleted_count:
+                try:
+                    obtener_almacen(db, blob["almacenamiento"]).eliminar(blob["blob_id"])
+                except Exception as e:
+                    errores.append(f"{blob['blob_id']}: {e}")
+
+    for doc in sin_registro:
+        try:
+            obtener_almacen(db, doc["almacenamiento"]).eliminar(doc["blob_id"])
+        except Exception as e:
+            errores.append(f"{doc['blob_id']}: {e}")
+    return errores
+
+
+def reporte_deduplicacion(db):
+    """
+    Resumen de la deduplicación y la compresión: archivos únicos, referencias,
+    bytes originales de los archivos únicos, bytes que ocupan realmente y bytes
+    que ocuparían sin deduplicar
+    """
+    resultado = next(db.blobs.aggregate([
+        {"$group": {
+            "_id": None,
+            "archivos_unicos": {"$sum": 1},
+            "referencias": {"$sum": "$referencias"},
+            "bytes_originales": {"$sum": "$tamaño_bytes"},
+            "bytes_almacenados": {"$sum": {"$ifNull": ["$tamaño_almacenado", "$tamaño_bytes"]}},
+            "bytes_referenciados": {"$sum": {"$multiply": ["$tamaño_bytes", "$referencias"]}}
+        }}
+    ]), None) or {
+        "archivos_unicos": 0, "referencias": 0, "bytes_originales": 0,
+        "bytes_almacenados": 0, "bytes_referenciados": 0
+    }
+
+    resultado.pop("_id", None)
+    resultado["bytes_ahorrados_deduplicacion"] = resultado["bytes_referenciados"] - resultado["bytes_originales"]
+    resultado["bytes_ahorrados_compresion"] = resultado["bytes_originales"] - resultado["bytes_almacenados"]
+    resultado["bytes_ahorrados"] = resultado["bytes_referenciados"] - resultado["bytes_almacenados"]
+    return resultado
+
+
+def migrar_documentos_en_linea(db, almacen, tamaño_lote=20, progreso=None):
+    """
+    Mueve `contenido_binario` de los documentos antiguos al backend indicado.
+    Procesa los documentos de uno en uno para no cargar más de `tamaño_lote`
+    archivos en memoria. Devuelve (migrados, fallidos)
+    """
+    migrados = 0
+    fallidos = 0
+
+    cursor = db.documentos.find(
+        {"contenido_binario": {"$exists": True}},
+        {"contenido_binario": 1, "nombre_archivo": 1, "ci": 1},
+        batch_size=tamaño_lote
+    )
+    for doc in cursor:
+        nombre_archivo = doc.get("nombre_archivo") or str(doc["_id"])
+        guardado = None
+        try:
+            guardado = guardar_deduplicado(
+                db,
+                almacen,
+                io.BytesIO(bytes(doc["contenido_binario"])),
+                nombre_archivo,
+                {"ci": doc.get("ci")}
+            )
+            guardado.pop("reutilizado")
+            result = db.documentos.update_one(
+                {"_id": doc["_id"], "contenido_binario": {"$exists": True}},
+                {
+                    "$set": guardado,
+                    "$unset": {"contenido_binario": ""}
+                }
+            )
+            if result.modified_count == 0:
+                # Otro proceso lo migró o lo eliminó mientras tanto
+                eliminar_contenido(db, guardado)
+            else:
+                migrados += 1
+        except Exception as e:
+            if guardado:
+                eliminar_contenido(db, guardado)
+            fallidos += 1
+            if progreso:
+                progreso(f"Error migrando {doc['_id']}: {e}")
+            continue
+
+        if progreso:
+            progreso(f"Migrado {doc['_id']} ({nombre_archivo})")
+
+    return migrados, fallidos
+
+
+def imprimir_informe_uso(db, ruta_json=None):
+    """Resume en pantalla el informe de uso (ver uso_almacenamiento.py) y lo guarda en JSON si se indica"""
+    import uso_almacenamiento
+
+    informe = uso_almacenamiento.informe_uso(db)
+    total = informe["total"]
+    print(f"{total['documentos']} documentos, {total['bytes'] / (1024 * 1024):.2f} MB originales")
+    for fila in informe["dimensiones"]["lote_carga"]:
+        aviso = "  ⚠️ anómalo" if fila["anomalo"] else ""
+        print(f"  {fila['valor'] or '(sin lote)'}: {fila['documentos']} documentos, {fila['bytes'] / (1024 * 1024):.2f} MB{aviso}")
+    if ruta_json:
+        with open(ruta_json, "w", encoding="utf-8") as archivo:
+            json.dump(informe, archivo, ensure_ascii=False, indent=2, default=str)
+        print(f"Informe guardado en {ruta_json}")
+    return 0
+
+
+def main(argv=None):
+    from dotenv import load_dotenv
+    import pymongo
+
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Gestión del almacenamiento de archivos de documentos")
+    subparsers = parser.add_subparsers(dest="comando", required=True)
+
+    parser_migrar = subparsers.add_parser("migrar", help="Mover archivos en línea (contenido_binario) a GridFS o disco")
+    parser_migrar.add_argument("--uri", default=os.environ.get("MONGODB_URI"), help="URI de MongoDB (o variable MONGODB_URI)")
+    # El backend local usa siempre DOCS_DIRECTORIO_LOCAL: es el directorio en el que la aplicación busca los archivos
+    parser_migrar.add_argument("--backend", choices=[AlmacenGridFS.nombre, AlmacenLocal.nombre], default=BACKEND_POR_DEFECTO,
+                               help="Backend de destino (el local usa DOCS_DIRECTORIO_LOCAL)")
+
+    parser_uso = subparsers.add_parser("uso", help="Informe de uso del almacenamiento por tipo, categoría, lote, CI, usuario y mes")
+    parser_uso.add_argument("--uri", default=os.environ.get("MONGODB_URI"), help="URI de MongoDB (o variable MONGODB_URI)")
+    parser_uso.add_argument("--json", metavar="ARCHIVO", help="Guardar el informe completo en un archivo JSON")
+
+    args = parser.parse_args(argv)
+    if not args.uri:
+        parser.error("Falta la URI de MongoDB (--uri o MONGODB_URI)")
+
+    client = pymongo.MongoClient(args.uri, serverSelectionTimeoutMS=5000)
+    try:
+        db = client[NOMBRE_BD]
+        if args.comando == "uso":
+            return imprimir_informe_uso(db, args.json)
+
+        almacen = obtener_almacen(db, args.backend)
+        migrados, fallidos = migrar_documentos_en_linea(db, almacen, progreso=print)
+        print(f"Migración completada: {migrados} migrados, {fallidos} fallidos")
+        return 1 if fallidos else 0
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -8,7 +8,8 @@ from bson import Binary
 from bson.binary import Binary
 import tempfile
 import pandas as pd
-import time
+import uuid
+import json
 from pathlib import Path
 import re
 from pathlib import Path
@@ -16,6 +17,18 @@ import os
 import sys
 import platform
 import zipfile
+import mimetypes
+import almacenamiento
+import base_datos
+import cache_consultas
+import cambios
+import carga_zip
+import ejecutor_trabajos
+import extraccion_ci
+import operaciones_masivas
+import rendimiento
+import trabajos
+import uso_almacenamiento
 
 # Configuración de la página
 st.set_page_config(
@@ -41,7 +54,31 @@ if 'mongo_username' not in st.session_state:
 if 'df_metadatos_local' not in st.session_state:
     st.session_state.df_metadatos_local = None
 if 'archivos_zip_procesados' not in st.session_state:
-    st.session_state.archivos_zip_procesados = {}
+    st.session_state.archivos_zip_procesados = []
+if 'sesion_id' not in st.session_state:
+    st.session_state.sesion_id = uuid.uuid4().hex
+if 'mongo_uri_conexion' not in st.session_state:
+    st.session_state.mongo_uri_conexion = None
+if 'trabajo_seguido' not in st.session_state:
+    st.session_state.trabajo_seguido = None
+if 'trabajo_seguido_activo' not in st.session_state:
+    st.session_state.trabajo_seguido_activo = False
+if 'plan_carga' not in st.session_state:
+    st.session_state.plan_carga = None
+if 'resultados_busqueda' not in st.session_state:
+    st.session_state.resultados_busqueda = None
+if 'operacion_masiva' not in st.session_state:
+    st.session_state.operacion_masiva = None
+
+# Usuarios de MongoDB que ven la pestaña de rendimiento (separados por comas)
+ADMINISTRADORES = {usuario.strip() for usuario in os.environ.get("DOCS_ADMINISTRADORES", "").split(",") if usuario.strip()}
+
+# La sesión solo guarda la URI; el cliente es compartido por todo el proceso.
+# Se pide en cada rerun para marcar la sesión como activa (y recrearlo si se cerró por inactividad)
+if st.session_state.db_connected and st.session_state.mongo_uri_conexion:
+    st.session_state.db_connection = base_datos.REGISTRO_CLIENTES.obtener(
+        st.session_state.mongo_uri_conexion, st.session_state.sesion_id
+    )[base_datos.NOMBRE_BD]
 
 # CSS personalizado para mejorar la apariencia
 st.markdown("""
@@ -148,11 +185,13 @@ st.markdown('<h1 class="main-header">📚 Sistema de Gestión Documental</h1>',
 st.markdown('<p class="subheader">Gestión centralizada de documentos con búsqueda avanzada y control de versiones</p>', unsafe_allow_html=True)
 
 # Función de conexión mejorada
-def connect_mongodb(uri):
+def connect_mongodb(uri, sesion_id):
     try:
-        client = pymongo.MongoClient(uri, serverSelectionTimeoutMS=5000)
-        client.admin.command('ping')
-        db = client.documentation_db
+        # Cliente compartido por todas las sesiones con la misma URI (un solo pool de conexiones)
+        client = base_datos.REGISTRO_CLIENTES.obtener(uri, sesion_id)
+        with rendimiento.medir("conexion.ping"):
+            client.admin.command('ping')
+        db = client[base_datos.NOMBRE_BD]
         
         # Extraer nombre de usuario de la URI
         username = "Desconocido"
@@ -172,352 +211,449 @@ def connect_mongodb(uri):
         except:
             username = "Usuario BD"
         
+        # Crear los índices que falten (operación idempotente)
+        with rendimiento.medir("conexion.indices"):
+            errores_indices = base_datos.asegurar_indices(db)
+        if errores_indices:
+            return db, True, f"Conexión exitosa (no se pudieron crear {len(errores_indices)} índices: {errores_indices[0]})", username
+        
         return db, True, "Conexión exitosa", username
     except pymongo.errors.ServerSelectionTimeoutError:
+        base_datos.REGISTRO_CLIENTES.liberar(uri, sesion_id)
         return None, False, "Error: Timeout de conexión", "Desconocido"
     except pymongo.errors.ConnectionFailure:
+        base_datos.REGISTRO_CLIENTES.liberar(uri, sesion_id)
         return None, False, "Error: No se pudo conectar al servidor", "Desconocido"
     except Exception as e:
+        base_datos.REGISTRO_CLIENTES.liberar(uri, sesion_id)
         return None, False, f"Error: {str(e)}", "Desconocido"
 
+def desconectar_mongodb():
+    """Libera el cliente compartido de esta sesión (se cierra si ninguna otra lo usa)"""
+    if st.session_state.mongo_uri_conexion:
+        base_datos.REGISTRO_CLIENTES.liberar(st.session_state.mongo_uri_conexion, st.session_state.sesion_id)
+    st.session_state.mongo_uri_conexion = None
+    st.session_state.db_connection = None
+    st.session_state.db_connected = False
+
 # --- FUNCIONES PARA CARGA DESDE ZIP ---
 
-def extraer_ci_desde_nombre(nombre_archivo, patron_busqueda):
+@st.cache_data(max_entries=16, show_spinner=False)
+def obtener_manifiesto_zip(hash_zip, _archivo_zip):
     """
-    Extrae el CI del nombre del archivo según el patrón especificado
+    Manifiesto del ZIP (archivos, tamaños, CRC y conteo por tipo). Se calcula una
+    sola vez por contenido: la clave de caché es el hash del ZIP
     """
-    try:
-        nombre_sin_extension = Path(nombre_archivo).stem
-        
-        if patron_busqueda == "CI al inicio":
-            match = re.match(r'^(\d{8,10})', nombre_sin_extension)
-            if match:
-                return match.group(1)
-        
-        elif patron_busqueda == "CI en cualquier parte":
-            matches = re.findall(r'\d{8,10}', nombre_sin_extension)
-            if matches:
-                return matches[0]
-        
-        elif patron_busqueda == "CI específico en nombre":
-            patterns = [
-                r'CI[_\-\s]*(\d{8,10})',
-                r'(\d{8,10})[_\-\s]',
-                r'cedula[_\-\s]*(\d{8,10})',
-                r'identificacion[_\-\s]*(\d{8,10})'
-            ]
-            for pattern in patterns:
-                match = re.search(pattern, nombre_sin_extension, re.IGNORECASE)
-                if match:
-                    return match.group(1)
-        
-        return None
-    except Exception as e:
-        return None
+    archivos = carga_zip.leer_manifiesto(_archivo_zip)
+    return {
+        "hash": hash_zip,
+        "archivos": archivos,
+        "contadores": carga_zip.contar_por_tipo(archivos),
+        "tamaño_total": sum(entrada["tamaño"] for entrada in archivos)
+    }
 
 def extraer_archivos_desde_zip(archivo_zip):
     """
-    Extrae todos los archivos de un ZIP y los devuelve en memoria
+    Lee el índice del ZIP (nombres, tamaños y CRC) sin descomprimir los archivos.
+    El resultado se reutiliza en los siguientes reruns mientras no cambie la subida
     """
     try:
-        archivos_extraidos = {}
-        
-        with zipfile.ZipFile(archivo_zip, 'r') as zip_ref:
-            # Obtener lista de archivos
-            lista_archivos = zip_ref.namelist()
-            
-            for archivo_nombre in lista_archivos:
-                # Ignorar carpetas
-                if not archivo_nombre.endswith('/'):
-                    # Leer archivo en memoria
-                    with zip_ref.open(archivo_nombre) as archivo:
-                        contenido = archivo.read()
-                        
-                        # Crear objeto file-like en memoria
-                        archivo_memoria = io.BytesIO(contenido)
-                        archivo_memoria.name = Path(archivo_nombre).name
-                        
-                        archivos_extraidos[archivo_nombre] = archivo_memoria
-        
-        return archivos_extraidos, None
+        id_subida = getattr(archivo_zip, 'file_id', None) or f"{archivo_zip.name}:{archivo_zip.size}"
+        manifiesto_sesion = st.session_state.get('zip_manifiesto')
+        if manifiesto_sesion and manifiesto_sesion['id_subida'] == id_subida:
+            return manifiesto_sesion['manifiesto'], None
+        
+        with rendimiento.medir("zip.hash"):
+            hash_zip = carga_zip.calcular_hash(archivo_zip)
+        with rendimiento.medir("zip.manifiesto"):
+            manifiesto = obtener_manifiesto_zip(hash_zip, archivo_zip)
+        st.session_state.zip_manifiesto = {"id_subida": id_subida, "manifiesto": manifiesto}
+        return manifiesto, None
         
     except Exception as e:
-        return None, f"Error extrayendo ZIP: {str(e)}"
+        return None, f"Error leyendo ZIP: {str(e)}"
 
-def buscar_archivos_en_zip(archivos_zip, tipos_archivo, max_documentos):
+def mostrar_extraccion_ci(manifiesto, tipos_archivo, max_documentos, extractor_ci, df_metadatos=None):
     """
-    Busca archivos en el ZIP extraído según los tipos especificados
+    Estadísticas de la extracción de CI sobre los archivos que se van a cargar,
+    calculadas de una sola pasada antes de iniciar la carga
     """
-    try:
-        archivos_encontrados = []
-        
-        for nombre_archivo, archivo_memoria in archivos_zip.items():
-            extension = Path(nombre_archivo).suffix.lower()
-            if extension in tipos_archivo:
-                archivos_encontrados.append((nombre_archivo, archivo_memoria))
-            
-            if len(archivos_encontrados) >= max_documentos:
-                break
-        
-        return archivos_encontrados
+    archivos = carga_zip.filtrar_manifiesto(manifiesto, tipos_archivo, max_documentos)
+    cis_por_archivo, estadisticas = extractor_ci.extraer_lote(entrada["nombre"] for entrada in archivos)
     
-    except Exception as e:
-        st.error(f"❌ Error buscando archivos en ZIP: {str(e)}")
-        return []
+    with st.expander(f"🔎 Extracción de CI: {estadisticas['con_ci']} de {estadisticas['total']} archivos con CI", expanded=False):
+        col_e1, col_e2, col_e3, col_e4 = st.columns(4)
+        with col_e1:
+            st.metric("Con CI", estadisticas['con_ci'])
+        with col_e2:
+            st.metric("Sin CI", estadisticas['sin_ci'])
+        with col_e3:
+            st.metric("CIs distintos", estadisticas['cis_distintos'])
+        with col_e4:
+            st.metric("Descartados por verificador", estadisticas['descartados_por_verificador'])
+        
+        if df_metadatos is not None:
+            mapeo_metadatos = carga_zip.mapear_metadatos(df_metadatos)
+            sin_metadatos = {ci for ci in cis_por_archivo.values() if ci not in mapeo_metadatos}
+            st.write(f"**CIs sin metadatos en el CSV:** {len(sin_metadatos)}")
+        
+        st.write("**Coincidencias por patrón:**")
+        st.dataframe(
+            pd.DataFrame({"Patrón": list(estadisticas['por_patron']), "Archivos": list(estadisticas['por_patron'].values())}),
+            use_container_width=True,
+            hide_index=True
+        )
+        if estadisticas['ejemplos_sin_ci']:
+            st.write("**Ejemplos de archivos sin CI:**")
+            for nombre in estadisticas['ejemplos_sin_ci'][:10]:
+                st.write(f"- `{nombre}`")
 
-def procesar_archivo_desde_zip(archivo_nombre, archivo_memoria, ci, metadatos_ci, config):
-    """
-    Procesa un archivo desde ZIP y lo guarda en la base de datos
-    """
-    try:
-        # Leer contenido binario desde el archivo en memoria
-        contenido_binario = Binary(archivo_memoria.getvalue())
-        
-        # Determinar tipo de archivo
-        extension = Path(archivo_nombre).suffix.lower()
-        if extension == '.pdf':
-            tipo_archivo = 'pdf'
-        elif extension in ['.docx', '.doc']:
-            tipo_archivo = 'word'
-        elif extension in ['.jpg', '.jpeg', '.png']:
-            tipo_archivo = 'imagen'
-        elif extension == '.txt':
-            tipo_archivo = 'texto'
-        else:
-            tipo_archivo = 'documento'
-        
-        # Generar título automático si no está en metadatos
-        titulo = metadatos_ci.get('titulo')
-        if not titulo:
-            nombre_archivo = Path(archivo_nombre).stem
-            titulo = f"{nombre_archivo} - {metadatos_ci['nombre']}"
-        
-        # Procesar etiquetas
-        etiquetas = []
-        if 'etiquetas' in metadatos_ci and pd.notna(metadatos_ci['etiquetas']):
-            etiquetas = [tag.strip() for tag in str(metadatos_ci['etiquetas']).split(',')]
-        
-        # Agregar etiquetas automáticas
-        etiquetas.extend([str(ci), 'carga_zip', 'automático', tipo_archivo])
-        
-        # Crear documento COMPLETO (con contenido binario)
-        documento = {
-            "titulo": titulo,
-            "categoria": metadatos_ci.get('categoria', 'Personal'),
-            "autor": metadatos_ci.get('autor', metadatos_ci['nombre']),
-            "ci": str(ci),
-            "nombre_completo": metadatos_ci['nombre'],
-            "version": metadatos_ci.get('version', '1.0'),
-            "tags": etiquetas,
-            "prioridad": metadatos_ci.get('prioridad', 'Media'),
-            "tipo": tipo_archivo,
-            "nombre_archivo": Path(archivo_nombre).name,
-            "contenido_binario": contenido_binario,  # ✅ SE GUARDA EL ARCHIVO
-            "tamaño_bytes": len(contenido_binario),
-            "ruta_origen_zip": f"zip://{archivo_nombre}",
-            "fecha_creacion": datetime.utcnow(),
-            "fecha_actualizacion": datetime.utcnow(),
-            "usuario_creacion": st.session_state.mongo_username,
-            "usuario_actualizacion": st.session_state.mongo_username,
-            "procesado_desde_zip": True,
-            "lote_carga": config.get('lote_id'),
-            "almacenamiento": "base_datos"  # ✅ EN BASE DE DATOS
-        }
-        
-        return documento, None
-        
-    except Exception as e:
-        return None, f"Error procesando {archivo_nombre}: {str(e)}"
+ETIQUETAS_ACCION_PLAN = {
+    carga_zip.INSERTAR: "➕ Insertar",
+    carga_zip.REEMPLAZAR: "🔁 Reemplazar",
+    carga_zip.DUPLICADO_EN_ZIP: "⏭️ Repetido en el ZIP",
+    carga_zip.DUPLICADO_EN_BD: "⏭️ Ya existe en la base",
+    carga_zip.SIN_CI: "⚠️ Sin CI",
+    carga_zip.SIN_METADATOS: "⚠️ CI sin metadatos"
+}
 
-def procesar_carga_desde_zip(db, archivos_zip, df_metadatos, tipos_archivo, max_documentos, 
-                           tamaño_lote, patron_busqueda, sobrescribir_existentes):
+def mostrar_plan_carga(plan):
+    """Resultado de la simulación de una carga desde ZIP, con el plan descargable en CSV"""
+    resumen = plan["resumen"]
+    st.markdown("#### 🧭 Simulación de la carga")
+    st.caption(f"Calculada en {resumen['segundos']} s sin escribir nada en la base de datos")
+    
+    col_p1, col_p2, col_p3, col_p4 = st.columns(4)
+    with col_p1:
+        st.metric("Archivos", resumen['total_archivos'])
+    with col_p2:
+        st.metric("Se cargarán", resumen['por_accion'][carga_zip.INSERTAR]['archivos'] + resumen['por_accion'][carga_zip.REEMPLAZAR]['archivos'])
+    with col_p3:
+        st.metric("Tamaño total", f"{resumen['bytes_totales'] / (1024 * 1024):.2f} MB")
+    with col_p4:
+        st.metric("Crecimiento estimado", f"{resumen['crecimiento_estimado'] / (1024 * 1024):.2f} MB")
+    
+    st.dataframe(
+        pd.DataFrame([
+            {"Acción": etiqueta, "Archivos": resumen['por_accion'][accion]['archivos'],
+             "Tamaño": f"{resumen['por_accion'][accion]['bytes'] / (1024 * 1024):.2f} MB"}
+            for accion, etiqueta in ETIQUETAS_ACCION_PLAN.items()
+        ]),
+        use_container_width=True,
+        hide_index=True
+    )
+    
+    if resumen['cis_sin_metadatos']:
+        st.warning(f"⚠️ {len(resumen['cis_sin_metadatos'])} CIs de los archivos no están en el CSV: "
+                   f"{', '.join(resumen['cis_sin_metadatos'][:20])}{'...' if len(resumen['cis_sin_metadatos']) > 20 else ''}")
+    if resumen['cis_csv_sin_archivos']:
+        st.info(f"ℹ️ {len(resumen['cis_csv_sin_archivos'])} CIs del CSV no tienen ningún archivo en el ZIP")
+    
+    st.download_button(
+        "📥 Descargar plan (CSV)",
+        data=carga_zip.plan_a_csv(plan["filas"]),
+        file_name=f"plan_carga_{plan['nombre_zip'].rsplit('.', 1)[0]}.csv",
+        mime="text/csv",
+        key="descargar_plan_tab6"
+    )
+
+def encolar_carga_desde_zip(db, archivo_zip, hash_zip, manifiesto, df_metadatos, tipos_archivo, max_documentos,
+                            tamaño_lote, patron_busqueda, sobrescribir_existentes,
+                            hilos_lectura=4, hilos_escritura=2, patrones_usuario=(), validar_cedula=False):
     """
-    Función principal para procesar carga desde ZIP
+    Encola la carga desde ZIP para que la ejecute un ejecutor en segundo plano
+    (ver ejecutor_trabajos.py). Devuelve el id del trabajo, o None si no hay nada que cargar
     """
     try:
-        # Configuración
-        config = {
-            'lote_id': f"zip_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-        }
-        
-        # Contadores
-        total_archivos = 0
-        archivos_procesados = 0
-        documentos_exitosos = 0
-        documentos_fallidos = 0
-        documentos_duplicados = 0
-        documentos_sin_ci = 0
-        cis_encontrados = set()
-        
         # Buscar archivos en el ZIP
-        st.info("🔍 Buscando archivos en el ZIP...")
-        archivos_encontrados = buscar_archivos_en_zip(archivos_zip, tipos_archivo, max_documentos)
+        archivos_encontrados = carga_zip.filtrar_manifiesto(manifiesto, tipos_archivo, max_documentos)
         
         if not archivos_encontrados:
             st.warning("⚠️ No se encontraron archivos para procesar en el ZIP")
-            return
-        
-        st.success(f"🎯 Encontrados {len(archivos_encontrados)} archivos en el ZIP")
-        
-        # Crear mapeo CI -> metadatos para búsqueda rápida
-        mapeo_metadatos = {}
-        for _, fila in df_metadatos.iterrows():
-            ci_str = str(fila['ci']).strip()
-            mapeo_metadatos[ci_str] = fila.to_dict()
-        
-        # Configurar interfaz de progreso
-        progress_bar = st.progress(0)
-        status_text = st.empty()
-        resultados_container = st.container()
+            return None
+        
+        lote_id = f"zip_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+        
+        # El ZIP y los metadatos se copian a disco: la carga no depende de esta sesión
+        with st.spinner("📦 Preparando archivos para la carga en segundo plano..."):
+            rutas = ejecutor_trabajos.preparar_archivos(lote_id, archivo_zip, df_metadatos)
+        
+        trabajos.crear_trabajo(
+            db, lote_id, hash_zip, archivo_zip.name,
+            {
+                'tipos_archivo': list(tipos_archivo),
+                'max_documentos': int(max_documentos),
+                'tamaño_lote': int(tamaño_lote),
+                'patron_busqueda': patron_busqueda,
+                'patrones_usuario': list(patrones_usuario),
+                'validar_cedula': bool(validar_cedula),
+                'sobrescribir': bool(sobrescribir_existentes),
+                'hilos_lectura': int(hilos_lectura),
+                'hilos_escritura': int(hilos_escritura)
+            },
+            st.session_state.mongo_username,
+            rutas
+        )
+        ejecutor_trabajos.EJECUTOR.iniciar(st.session_state.mongo_uri_conexion)
         
-        # Procesar archivos por lotes
-        for i in range(0, len(archivos_encontrados), tamaño_lote):
-            lote_actual = archivos_encontrados[i:i + tamaño_lote]
-            documentos_a_insertar = []
-            
-            for archivo_nombre, archivo_memoria in lote_actual:
-                # Extraer CI del nombre del archivo
-                ci_extraido = extraer_ci_desde_nombre(archivo_nombre, patron_busqueda)
-                
-                if not ci_extraido:
-                    documentos_sin_ci += 1
-                    continue
-                
-                # Buscar metadatos para este CI
-                metadatos_ci = mapeo_metadatos.get(ci_extraido)
-                if not metadatos_ci:
-                    documentos_sin_ci += 1
-                    continue
-                
-                cis_encontrados.add(ci_extraido)
-                
-                # Verificar duplicados si no se permite sobrescribir
-                if not sobrescribir_existentes:
-                    existe = db.documentos.count_documents({
-                        "nombre_archivo": Path(archivo_nombre).name,
-                        "ci": ci_extraido
-                    }) > 0
-                    
-                    if existe:
-                        documentos_duplicados += 1
-                        continue
-                
-                # Procesar archivo (GUARDANDO CONTENIDO BINARIO)
-                documento, error = procesar_archivo_desde_zip(archivo_nombre, archivo_memoria, ci_extraido, metadatos_ci, config)
+        st.success(f"🎯 {len(archivos_encontrados)} archivos encolados en la carga {lote_id}. "
+                   "Puedes seguir usando la aplicación mientras se procesa.")
+        return lote_id
                 
-                if error:
-                    documentos_fallidos += 1
-                    st.error(error)
-                else:
-                    documentos_a_insertar.append(documento)
-            
-            # Insertar lote en MongoDB
-            if documentos_a_insertar:
-                try:
-                    result = db.documentos.insert_many(documentos_a_insertar, ordered=False)
-                    documentos_exitosos += len(result.inserted_ids)
-                except Exception as e:
-                    documentos_fallidos += len(documentos_a_insertar)
-                    st.error(f"Error insertando lote: {str(e)}")
-            
-            archivos_procesados += len(lote_actual)
-            
-            # Actualizar progreso
-            progreso = archivos_procesados / len(archivos_encontrados)
-            progress_bar.progress(progreso)
-            status_text.text(
-                f"📊 Progreso: {archivos_procesados}/{len(archivos_encontrados)} | "
-                f"✅ Exitosos: {documentos_exitosos} | "
-                f"❌ Fallidos: {documentos_fallidos} | "
-                f"⚡ Duplicados: {documentos_duplicados} | "
-                f"🔍 Sin CI: {documentos_sin_ci}"
+    except Exception as e:
+        st.error(f"❌ Error encolando la carga desde ZIP: {str(e)}")
+        return None
+
+def mostrar_trabajo_carga(db, lote_id):
+    """
+    Progreso y resultados de una carga desde ZIP, leídos del registro del trabajo
+    """
+    trabajo = trabajos.obtener_trabajo(db, lote_id)
+    if not trabajo:
+        st.warning(f"⚠️ No se encontró la carga {lote_id}")
+        return False
+    
+    contadores = trabajo.get('contadores', {})
+    progreso = trabajo.get('progreso', {})
+    total = trabajo.get('total') or 0
+    terminados = sum(contadores.values())
+    documentos_exitosos = contadores.get('insertados', 0) + contadores.get('reemplazados', 0)
+    documentos_duplicados = contadores.get('duplicados', 0)
+    documentos_sin_ci = contadores.get('sin_ci', 0)
+    documentos_fallidos = contadores.get('fallidos', 0)
+    activo = trabajo['estado'] in (trabajos.PENDIENTE, trabajos.EN_CURSO) and not trabajos.esta_interrumpido(trabajo)
+    
+    st.markdown(f"### 📈 Carga {lote_id}")
+    
+    if trabajo['estado'] == trabajos.PENDIENTE:
+        st.info("⏳ En cola, esperando un ejecutor libre...")
+        return True
+    elif activo:
+        st.progress(min(terminados / total, 1.0) if total else 0.0)
+        st.text(
+            f"📊 Progreso: {terminados}/{total} | "
+            f"✅ Insertados: {contadores.get('insertados', 0)} | "
+            f"♻️ Reemplazados: {contadores.get('reemplazados', 0)} | "
+            f"❌ Fallidos: {documentos_fallidos} | "
+            f"⚡ Duplicados: {documentos_duplicados} | "
+            f"🔍 Sin CI: {documentos_sin_ci} | "
+            f"🚀 {progreso.get('archivos_por_segundo', 0):.1f} archivos/s, {progreso.get('mb_por_segundo', 0):.2f} MB/s"
+        )
+        return True
+    elif trabajos.esta_interrumpido(trabajo):
+        st.warning("⚠️ La carga se interrumpió (el proceso que la ejecutaba dejó de responder). "
+                   "Se reanudará sola cuando un ejecutor la reclame, o puedes reencolarla ahora.")
+    elif trabajo['estado'] == trabajos.FALLIDO:
+        st.error(f"❌ La carga terminó con errores{': ' + trabajo['error'] if trabajo.get('error') else ''}. "
+                 "Al reencolarla se reintentan solo los archivos que fallaron.")
+    else:
+        st.success(f"🎉 Carga desde ZIP completada por {trabajo.get('usuario')}! {documentos_exitosos} documentos procesados exitosamente.")
+    
+    for error in trabajo.get('errores', []):
+        st.error(error)
+    
+    # Métricas principales
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Archivos en ZIP", total)
+    with col2:
+        st.metric("Procesados Exitosos", documentos_exitosos)
+    with col3:
+        st.metric("Fallidos/Sin CI", documentos_fallidos + documentos_sin_ci)
+    with col4:
+        st.metric("Omitidos al reanudar", progreso.get('omitidos', 0))
+    
+    with st.expander("📋 Detalles del procesamiento", expanded=trabajo['estado'] == trabajos.COMPLETADO):
+        col_d1, col_d2, col_d3, col_d4, col_d5 = st.columns(5)
+        with col_d1:
+            st.metric("Documentos nuevos", contadores.get('insertados', 0))
+        with col_d2:
+            st.metric("Documentos reemplazados", contadores.get('reemplazados', 0))
+        with col_d3:
+            st.metric("Duplicados omitidos", documentos_duplicados)
+        with col_d4:
+            st.metric("Archivos sin CI", documentos_sin_ci)
+        with col_d5:
+            st.metric("Fallidos en procesamiento", documentos_fallidos)
+    
+    if documentos_duplicados > 0:
+        st.info(f"💡 {documentos_duplicados} documentos no se procesaron por duplicados. "
+               "Marca 'Sobrescribir documentos existentes' para forzar el reprocesamiento.")
+    
+    if documentos_sin_ci > 0:
+        st.warning(f"⚠️ {documentos_sin_ci} archivos no se procesaron porque no se pudo extraer el CI o no había metadatos. "
+                  "Verifica que los nombres de archivo contengan el CI y que el CSV tenga los metadatos correspondientes.")
+    
+    if trabajo['estado'] != trabajos.COMPLETADO:
+        col_a1, col_a2 = st.columns(2)
+        with col_a1:
+            if st.button("🔁 Reencolar carga", key=f"reencolar_{lote_id}"):
+                trabajos.reencolar_trabajo(db, lote_id)
+                ejecutor_trabajos.EJECUTOR.iniciar(st.session_state.mongo_uri_conexion)
+                st.rerun()
+        with col_a2:
+            confirmado = st.checkbox(
+                "Confirmo que quiero descartar esta carga (los documentos ya cargados se conservan)",
+                key=f"confirmar_descartar_{lote_id}"
             )
+            if st.button("🗑️ Descartar carga", disabled=not confirmado, key=f"descartar_{lote_id}"):
+                if ejecutor_trabajos.descartar_trabajo(db, lote_id):
+                    st.session_state.trabajo_seguido = None
+                    st.session_state.trabajo_seguido_activo = False
+                    st.rerun()
+                st.warning("⚠️ No se puede descartar: la carga está en curso o ya terminó")
+    return False
+
+def panel_trabajo_seguido(db):
+    """
+    Progreso de la carga que sigue esta sesión. Se dibuja como fragmento: mientras
+    la carga avanza solo se vuelve a ejecutar este panel, no toda la página
+    """
+    trabajo_activo = mostrar_trabajo_carga(db, st.session_state.trabajo_seguido)
+    if trabajo_activo != st.session_state.trabajo_seguido_activo:
+        if not trabajo_activo:
+            # La carga acaba de terminar: refrescar las estadísticas
+            st.session_state.last_delete_time = datetime.now().timestamp()
+        st.session_state.trabajo_seguido_activo = trabajo_activo
+        # Toda la página: estadísticas de la barra lateral y empezar o dejar de sondear
+        st.rerun()
+    if not trabajo_activo and st.button("✖️ Dejar de seguir esta carga", key="dejar_seguir_tab6"):
+        st.session_state.trabajo_seguido = None
+        st.rerun()
+
+def mostrar_trabajos_sin_terminar(db):
+    """
+    Lista las cargas desde ZIP pendientes, en curso o con errores y permite
+    seguir el progreso de cualquiera de ellas
+    """
+    pendientes = trabajos.trabajos_sin_terminar(db)
+    if not pendientes:
+        return
+    
+    with st.expander(f"⏸️ Cargas sin terminar ({len(pendientes)})", expanded=False):
+        for trabajo in pendientes:
+            contadores = trabajo.get('contadores', {})
+            if trabajos.esta_interrumpido(trabajo):
+                estado_trabajo = "⚠️ Interrumpida"
+            else:
+                estado_trabajo = {
+                    trabajos.PENDIENTE: "⏳ En cola",
+                    trabajos.EN_CURSO: "🔄 En curso",
+                    trabajos.FALLIDO: "❌ Con errores"
+                }.get(trabajo['estado'], trabajo['estado'])
             
-            # Pequeña pausa para no sobrecargar
-            time.sleep(0.1)
-        
-        # Mostrar resultados finales
-        progress_bar.progress(1.0)
-        status_text.text("✅ Procesamiento completado!")
-        
-        with resultados_container:
-            st.markdown("### 📈 Resultados Finales - Carga desde ZIP")
-            
-            # Métricas principales
-            col1, col2, col3, col4 = st.columns(4)
-            with col1:
-                st.metric("Archivos en ZIP", len(archivos_encontrados))
-            with col2:
-                st.metric("Procesados Exitosos", documentos_exitosos)
-            with col3:
-                st.metric("Fallidos/Sin CI", documentos_fallidos + documentos_sin_ci)
-            with col4:
-                st.metric("CIs Encontrados", len(cis_encontrados))
-            
-            if documentos_exitosos > 0:
-                st.success(f"🎉 Carga desde ZIP completada por {st.session_state.mongo_username}! {documentos_exitosos} documentos procesados exitosamente.")
-                st.balloons()
-                
-                # Mostrar detalles adicionales
-                with st.expander("📋 Detalles del procesamiento", expanded=True):
-                    col_d1, col_d2, col_d3 = st.columns(3)
-                    with col_d1:
-                        st.metric("Documentos duplicados", documentos_duplicados)
-                    with col_d2:
-                        st.metric("Archivos sin CI", documentos_sin_ci)
-                    with col_d3:
-                        st.metric("Fallidos en procesamiento", documentos_fallidos)
-                
-                # Actualizar estadísticas
-                st.session_state.last_delete_time = datetime.now().timestamp()
-            
-            if documentos_duplicados > 0:
-                st.info(f"💡 {documentos_duplicados} documentos no se procesaron por duplicados. "
-                       "Marca 'Sobrescribir documentos existentes' para forzar el reprocesamiento.")
-            
-            if documentos_sin_ci > 0:
-                st.warning(f"⚠️ {documentos_sin_ci} archivos no se procesaron porque no se pudo extraer el CI o no había metadatos. "
-                          "Verifica que los nombres de archivo contengan el CI y que el CSV tenga los metadatos correspondientes.")
-                
-    except Exception as e:
-        st.error(f"❌ Error en el procesamiento desde ZIP: {str(e)}")
+            col_t1, col_t2 = st.columns([5, 1])
+            with col_t1:
+                st.write(
+                    f"**{trabajo['_id']}** · `{trabajo.get('nombre_zip', '')}` · {estado_trabajo} · "
+                    f"{sum(contadores.values())}/{trabajo.get('total') or '?'} archivos · "
+                    f"❌ {contadores.get('fallidos', 0)} con error · "
+                    f"🕒 {trabajo['fecha_actualizacion'].strftime('%Y-%m-%d %H:%M')} · 👤 {trabajo.get('usuario', '')}"
+                )
+            with col_t2:
+                if st.button("👁️ Seguir", key=f"seguir_{trabajo['_id']}"):
+                    st.session_state.trabajo_seguido = trabajo['_id']
 
 # ... (MANTENER TODAS LAS FUNCIONES ORIGINALES DE PROCESAMIENTO DE ARCHIVOS, BÚSQUEDA, ETC.)
 
-def procesar_archivo(archivo, tipo_archivo):
+def procesar_archivo(archivo, tipo_archivo, db, almacen):
     try:
-        contenido_binario = archivo.read()
-        return Binary(contenido_binario), len(contenido_binario), None
+        archivo.seek(0)
+        guardado = almacenamiento.guardar_deduplicado(db, almacen, archivo, archivo.name, {"tipo": tipo_archivo})
+        return guardado, None
     except Exception as e:
-        return None, 0, f"Error procesando {tipo_archivo}: {e}"
+        return None, f"Error procesando {tipo_archivo}: {e}"
 
-def crear_boton_descarga(contenido_binario, nombre_archivo, tipo_archivo):
+def obtener_tipo_mime(nombre_archivo, tipo_archivo=None):
+    """Determina el tipo MIME a partir de la extensión del archivo"""
+    mime_por_extension = {
+        ".pdf": "application/pdf",
+        ".docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+        ".doc": "application/msword",
+        ".jpg": "image/jpeg",
+        ".jpeg": "image/jpeg",
+        ".png": "image/png",
+        ".txt": "text/plain"
+    }
+    mime_por_tipo = {
+        "pdf": "application/pdf",
+        "word": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+        "imagen": "image/jpeg",
+        "texto": "text/plain"
+    }
+    
+    extension = Path(nombre_archivo or "").suffix.lower()
+    if extension in mime_por_extension:
+        return mime_por_extension[extension]
+    
+    mime_type, _ = mimetypes.guess_type(nombre_archivo or "")
+    return mime_type or mime_por_tipo.get(tipo_archivo, "application/octet-stream")
+
+def crear_boton_descarga(doc, key_suffix=""):
+    """
+    Muestra el botón de descarga de un documento. El archivo solo se lee del
+    almacenamiento cuando el usuario pulsa el botón: Streamlit llama a `data` al
+    servir la descarga, fuera del script, y no queda nada guardado en la sesión.
+    """
+    db = st.session_state.db_connection
+    st.download_button(
+        "📥 Descargar",
+        data=lambda: almacenamiento.leer_contenido(db, doc),
+        file_name=doc.get('nombre_archivo', f"{doc['_id']}"),
+        mime=obtener_tipo_mime(doc.get('nombre_archivo'), doc.get('tipo')),
+        on_click="ignore",
+        key=f"descarga_{doc['_id']}_{key_suffix}"
+    )
+
+# Campos necesarios para listar documentos (sin archivos ni textos largos)
+CAMPOS_LISTADO = {
+    "titulo": 1, "categoria": 1, "autor": 1, "ci": 1, "version": 1, "tags": 1,
+    "prioridad": 1, "tipo": 1, "nombre_archivo": 1, "tamaño_bytes": 1,
+    "almacenamiento": 1, "blob_id": 1, "compresion": 1, "procesado_desde_zip": 1, "lote_carga": 1,
+    "fecha_creacion": 1, "fecha_actualizacion": 1,
+    "usuario_creacion": 1, "usuario_actualizacion": 1,
+    "contenido_preview": {"$substrCP": [{"$ifNull": ["$contenido", ""]}, 0, 100]},
+    "contenido_en_linea": {"$ne": [{"$type": "$contenido_binario"}, "missing"]}
+}
+
+def obtener_pagina_documentos(db, query, tamaño_pagina, despues_de=None):
+    """
+    Devuelve una página de documentos, más recientes primero, usando paginación
+    por cursor sobre (fecha_creacion, _id) en lugar de skip.
+    `despues_de` es la clave (fecha_creacion, _id) del último documento de la página anterior.
+    Devuelve (documentos, hay_mas, error)
+    """
     try:
-        b64 = base64.b64encode(contenido_binario).decode()
-        
-        mime_types = {
-            "pdf": "application/pdf",
-            "word": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-            "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-            "doc": "application/msword",
-            "imagen": "image/jpeg"
-        }
+        if despues_de:
+            fecha, doc_id = despues_de
+            query = {"$and": [query, {"$or": [
+                {"fecha_creacion": {"$lt": fecha}},
+                {"fecha_creacion": fecha, "_id": {"$lt": doc_id}}
+            ]}]}
+        
+        with rendimiento.medir("biblioteca.pagina"):
+            documentos = cache_consultas.buscar(
+                db, query, CAMPOS_LISTADO, [("fecha_creacion", -1), ("_id", -1)], tamaño_pagina + 1
+            )
+        hay_mas = len(documentos) > tamaño_pagina
+        return documentos[:tamaño_pagina], hay_mas, None
         
-        mime_type = mime_types.get(tipo_archivo, "application/octet-stream")
-        
-        href = f'''
-        <a href="data:{mime_type};base64,{b64}" download="{nombre_archivo}" 
-           style="background-color: #4CAF50; color: white; padding: 8px 12px; 
-                  text-decoration: none; border-radius: 5px; display: inline-block;
-                  font-weight: bold; font-size: 0.8rem;">
-           📥 Descargar
-        </a>
-        '''
-        return href
     except Exception as e:
-        return f"❌ Error: {e}"
+        return [], False, str(e)
+
+# Resultados que devuelve como mucho una búsqueda
+LIMITE_BUSQUEDA = 200
+
+# Campos del índice de texto: se buscan con $text y el patrón solo filtra los candidatos
+CAMPOS_BUSQUEDA_TEXTO = {"titulo", "autor", "contenido", "descripcion", "usuario_creacion"}
 
 def buscar_documentos(db, criterio_busqueda, tipo_busqueda, filtros_adicionales=None):
+    """
+    Busca documentos usando siempre un índice: el de texto completo para los
+    campos de texto, y prefijos anclados o valores exactos para los demás.
+    El término se escapa (nunca se interpreta como expresión regular) y se
+    devuelven como mucho LIMITE_BUSQUEDA documentos
+    """
     try:
         query = {}
         
@@ -532,17 +668,37 @@ def buscar_documentos(db, criterio_busqueda, tipo_busqueda, filtros_adicionales=
             "usuario": "usuario_creacion"
         }
         
+        proyeccion = CAMPOS_LISTADO
+        orden = [("fecha_creacion", -1)]
+        
         campo = busqueda_map.get(tipo_busqueda)
-        if campo:
+        if tipo_busqueda == "texto_completo":
+            # Índice de texto: stemming en español, sin acentos, ordenado por relevancia
+            query.update(base_datos.consulta_texto(criterio_busqueda))
+            proyeccion = {**CAMPOS_LISTADO, "relevancia": {"$meta": "textScore"}}
+            orden = [("relevancia", {"$meta": "textScore"}), ("fecha_creacion", -1)]
+        elif campo:
+            termino = criterio_busqueda.strip()
             if tipo_busqueda == "tags":
-                query[campo] = {"$in": [criterio_busqueda.strip()]}
+                query[campo] = {"$in": [termino]}
+            elif tipo_busqueda == "ci":
+                # Prefijo anclado y sensible a mayúsculas para poder usar el índice de CI
+                query[campo] = {"$regex": f"^{re.escape(termino)}"}
+            elif campo in CAMPOS_BUSQUEDA_TEXTO:
+                # $text acota los candidatos con el índice y el patrón exige que el término esté en ese campo.
+                # Entre comillas: frase literal, sin negaciones ("-palabra") ni otras frases dentro
+                query.update(base_datos.consulta_texto('"' + termino.replace('"', ' ') + '"'))
+                query[campo] = {"$regex": re.escape(termino), "$options": "i"}
             else:
-                query[campo] = {"$regex": criterio_busqueda, "$options": "i"}
+                # Categoría: prefijo anclado sobre el índice categoria_fecha
+                query[campo] = {"$regex": f"^{re.escape(termino)}", "$options": "i"}
         
         if filtros_adicionales:
             query.update(filtros_adicionales)
         
-        documentos = list(db.documentos.find(query).sort("fecha_creacion", -1))
+        with rendimiento.medir("busqueda.consulta"):
+            documentos = cache_consultas.buscar(db, query, proyeccion, orden, LIMITE_BUSQUEDA)
+        rendimiento.contar("busqueda.resultados", len(documentos))
         return documentos, None
         
     except Exception as e:
@@ -551,6 +707,7 @@ def buscar_documentos(db, criterio_busqueda, tipo_busqueda, filtros_adicionales=
 def mostrar_documento_compacto(doc, key_suffix=""):
     """Muestra un documento en formato compacto y profesional"""
     
+    rendimiento.contar("render.documentos")
     iconos = {
         "pdf": "📄",
         "word": "📝", 
@@ -580,8 +737,13 @@ def mostrar_documento_compacto(doc, key_suffix=""):
                 st.markdown(f'<div class="compact-metadata">📅 **Creado:** {doc["fecha_creacion"].strftime("%d/%m/%Y")}</div>', unsafe_allow_html=True)
                 st.markdown(f'<div class="compact-metadata">👥 **Por:** {doc.get("usuario_creacion", "N/A")}</div>', unsafe_allow_html=True)
             
-            if doc.get('almacenamiento') == 'base_datos':
-                st.markdown(f'<div class="compact-metadata">💾 **Almacenamiento:** Base de datos</div>', unsafe_allow_html=True)
+            almacenamiento_etiquetas = {
+                "base_datos": "Base de datos",
+                "gridfs": "GridFS",
+                "local": "Disco local"
+            }
+            if doc.get('almacenamiento') in almacenamiento_etiquetas:
+                st.markdown(f'<div class="compact-metadata">💾 **Almacenamiento:** {almacenamiento_etiquetas[doc["almacenamiento"]]}</div>', unsafe_allow_html=True)
             
             if doc.get('procesado_desde_zip'):
                 st.markdown(f'<div class="compact-metadata">📦 **Origen:** Archivo ZIP</div>', unsafe_allow_html=True)
@@ -594,7 +756,8 @@ def mostrar_documento_compacto(doc, key_suffix=""):
                 st.markdown(f'<div class="compact-metadata">🏷️ **Tags:** {tags_html}</div>', unsafe_allow_html=True)
             
             if doc.get('tipo') == 'texto':
-                contenido_preview = doc['contenido'][:100] + "..." if len(doc['contenido']) > 100 else doc['contenido']
+                contenido = doc.get('contenido_preview', doc.get('contenido', ''))
+                contenido_preview = contenido[:100] + "..." if len(contenido) >= 100 else contenido
                 st.markdown(f'<div class="compact-metadata">📝 **Contenido:** {contenido_preview}</div>', unsafe_allow_html=True)
             elif doc.get('tipo') in ['pdf', 'word']:
                 st.markdown(f'<div class="compact-metadata">📋 **Archivo:** {doc.get("nombre_archivo", "N/A")}</div>', unsafe_allow_html=True)
@@ -602,14 +765,9 @@ def mostrar_documento_compacto(doc, key_suffix=""):
                     tamaño_mb = doc['tamaño_bytes'] / (1024 * 1024)
                     st.markdown(f'<div class="compact-metadata">💾 **Tamaño:** {tamaño_mb:.2f} MB</div>', unsafe_allow_html=True)
                 
-                # ✅ BOTÓN DE DESCARGA DISPONIBLE (porque se guardó contenido_binario)
-                if doc.get('contenido_binario'):
-                    boton_descarga = crear_boton_descarga(
-                        doc['contenido_binario'],
-                        doc['nombre_archivo'],
-                        doc['tipo']
-                    )
-                    st.markdown(boton_descarga, unsafe_allow_html=True)
+                # ✅ BOTÓN DE DESCARGA DISPONIBLE (contenido en línea o en el almacenamiento de archivos)
+                if almacenamiento.tiene_contenido(doc):
+                    crear_boton_descarga(doc, key_suffix)
             
             st.markdown(f'<div class="compact-metadata" style="font-size: 0.7rem; color: #999;">🆔 **ID:** {doc_id[:12]}...</div>', unsafe_allow_html=True)
         
@@ -618,18 +776,25 @@ def mostrar_documento_compacto(doc, key_suffix=""):
             if st.button("🗑️", key=f"delete_{doc_id}_{key_suffix}", help="Eliminar documento", use_container_width=True):
                 with st.spinner("Eliminando..."):
                     try:
-                        doc_existente = st.session_state.db_connection.documentos.find_one({"_id": doc["_id"]})
+                        with rendimiento.medir("eliminar.consulta"):
+                            doc_existente = st.session_state.db_connection.documentos.find_one(
+                                {"_id": doc["_id"]}, {"almacenamiento": 1, "blob_id": 1, "sha256": 1}
+                            )
                         if not doc_existente:
                             st.error("❌ El documento ya no existe")
                             return
                         
-                        result = st.session_state.db_connection.documentos.delete_one({"_id": doc["_id"]})
+                        with rendimiento.medir("eliminar.borrado"):
+                            result = st.session_state.db_connection.documentos.delete_one({"_id": doc["_id"]})
+                            cambios.documentos_modificados(st.session_state.db_connection)
                         
                         if result.deleted_count > 0:
-                            st.success("✅ Documento eliminado")
+                            with rendimiento.medir("eliminar.archivo"):
+                                almacenamiento.eliminar_contenido(st.session_state.db_connection, doc_existente)
+                            # El toast sigue visible tras el rerun, sin hacer esperar a la sesión
+                            st.toast("✅ Documento eliminado")
                             st.session_state.last_delete_time = datetime.now().timestamp()
                             st.session_state.refresh_counter += 1
-                            time.sleep(1.5)
                             st.rerun()
                         else:
                             st.error("❌ No se pudo eliminar")
@@ -639,6 +804,69 @@ def mostrar_documento_compacto(doc, key_suffix=""):
         
         st.markdown('</div>', unsafe_allow_html=True)
 
+# Con más resultados que estos, la vista automática usa la tabla en lugar de tarjetas
+MAX_TARJETAS = 50
+# Documentos marcados en la tabla que se muestran con todos sus detalles
+MAX_DETALLES = 5
+
+def documentos_a_tabla(documentos):
+    """Metadatos de los documentos como DataFrame, columna a columna (sin crear un widget por documento)"""
+    return pd.DataFrame({
+        "Ver": [False] * len(documentos),
+        "Título": [doc.get('titulo', '') for doc in documentos],
+        "CI": [doc.get('ci', '') for doc in documentos],
+        "Autor": [doc.get('autor', '') for doc in documentos],
+        "Categoría": [doc.get('categoria', '') for doc in documentos],
+        "Tipo": [doc.get('tipo', '') for doc in documentos],
+        "Versión": [doc.get('version', '') for doc in documentos],
+        "Prioridad": [doc.get('prioridad', '') for doc in documentos],
+        "Creado": [doc.get('fecha_creacion') for doc in documentos],
+        "Por": [doc.get('usuario_creacion', '') for doc in documentos],
+        "Archivo": [doc.get('nombre_archivo', '') for doc in documentos],
+        "Tamaño (MB)": [(doc.get('tamaño_bytes') or 0) / (1024 * 1024) for doc in documentos],
+        "Tags": [", ".join(doc.get('tags') or []) for doc in documentos]
+    })
+
+def mostrar_resultados(documentos, clave, id_resultados=""):
+    """
+    Muestra una lista de documentos como tarjetas o, si son muchos, en una sola
+    tabla. En la tabla, los documentos marcados en la columna "Ver" se muestran
+    debajo con sus detalles, la descarga y el borrado.
+    `id_resultados` identifica la lista para no arrastrar las marcas a otra
+    """
+    vista = st.radio(
+        "Vista de resultados",
+        ["Automática", "Tabla", "Tarjetas"],
+        horizontal=True,
+        help=f"La vista automática usa tarjetas hasta {MAX_TARJETAS} documentos y una tabla a partir de ahí",
+        key=f"vista_{clave}"
+    )
+    if vista == "Tarjetas" or (vista == "Automática" and len(documentos) <= MAX_TARJETAS):
+        for i, doc in enumerate(documentos):
+            mostrar_documento_compacto(doc, f"{clave}_{i}")
+        return
+    
+    with rendimiento.medir("render.tabla_documentos"):
+        tabla = st.data_editor(
+            documentos_a_tabla(documentos),
+            column_config={
+                "Ver": st.column_config.CheckboxColumn("Ver", help="Mostrar los detalles debajo de la tabla"),
+                "Creado": st.column_config.DatetimeColumn("Creado", format="DD/MM/YYYY"),
+                "Tamaño (MB)": st.column_config.NumberColumn("Tamaño (MB)", format="%.2f")
+            },
+            disabled=["Título", "CI", "Autor", "Categoría", "Tipo", "Versión", "Prioridad", "Creado", "Por", "Archivo", "Tamaño (MB)", "Tags"],
+            hide_index=True,
+            use_container_width=True,
+            height=min(35 * (len(documentos) + 1) + 3, 600),
+            key=f"tabla_{clave}_{id_resultados}"
+        )
+    
+    seleccionados = [documentos[posicion] for posicion in tabla.index[tabla["Ver"]]]
+    if len(seleccionados) > MAX_DETALLES:
+        st.info(f"ℹ️ Se muestran los detalles de los primeros {MAX_DETALLES} documentos marcados")
+    for i, doc in enumerate(seleccionados[:MAX_DETALLES]):
+        mostrar_documento_compacto(doc, f"{clave}_detalle_{i}")
+
 def crear_formulario_documento(tipo_documento, tab_key):
     """Crea un formulario reutilizable para diferentes tipos de documentos"""
     
@@ -767,11 +995,13 @@ def validar_y_guardar_documento(tipo_documento, variables_locales):
         "almacenamiento": "base_datos"
     }
     
+    almacen = almacenamiento.obtener_almacen(st.session_state.db_connection)
+    
     if tipo_documento == "texto":
         documento["contenido"] = variables_locales['contenido']
     else:
         archivo = variables_locales['archivo']
-        contenido_binario, tamaño, error = procesar_archivo(archivo, tipo_documento)
+        guardado, error = procesar_archivo(archivo, tipo_documento, st.session_state.db_connection, almacen)
         
         if error:
             st.error(f"❌ {error}")
@@ -780,107 +1010,370 @@ def validar_y_guardar_documento(tipo_documento, variables_locales):
         documento.update({
             "descripcion": variables_locales['descripcion'],
             "nombre_archivo": archivo.name,
-            "contenido_binario": contenido_binario,
-            "tamaño_bytes": tamaño
+            "blob_id": guardado["blob_id"],
+            "tamaño_bytes": guardado["tamaño_bytes"],
+            "tamaño_almacenado": guardado["tamaño_almacenado"],
+            "compresion": guardado["compresion"],
+            "sha256": guardado["sha256"],
+            "almacenamiento": guardado["almacenamiento"]
         })
     
     try:
         result = st.session_state.db_connection.documentos.insert_one(documento)
+        cambios.documentos_modificados(st.session_state.db_connection, recalcular=False)
         st.success(f"✅ Documento '{titulo}' guardado exitosamente por {st.session_state.mongo_username}!")
         st.balloons()
         
         st.session_state.last_delete_time = datetime.now().timestamp()
         return True
     except Exception as e:
+        almacenamiento.eliminar_contenido(st.session_state.db_connection, documento)
         st.error(f"❌ Error al guardar: {str(e)}")
         return False
 
-def validar_csv_metadatos(df):
-    """Valida la estructura del CSV de metadatos"""
-    errores = []
-    
-    if df.empty:
-        errores.append("El archivo CSV está vacío")
-        return errores
-    
-    if len(df.columns) == 0:
-        errores.append("El archivo CSV no tiene columnas")
-        return errores
-    
-    campos_obligatorios = ['ci', 'nombre']
-    for campo in campos_obligatorios:
-        if campo not in df.columns:
-            errores.append(f"Falta columna obligatoria: '{campo}'")
-    
-    if errores:
-        return errores
-    
-    if df['ci'].isnull().any():
-        errores.append("Hay valores nulos en la columna 'ci'")
-    
-    return errores
-
-def cargar_y_validar_csv(archivo_csv, nombre_funcionalidad="carga"):
-    """Carga y valida un archivo CSV con manejo de errores mejorado"""
+def cargar_y_validar_csv(archivo_csv, nombre_funcionalidad="carga", validar_cedula=False):
+    """
+    Carga y valida el CSV de metadatos en una sola pasada (ver carga_zip.leer_metadatos).
+    Los problemas de CI que no impiden la carga se muestran como avisos
+    """
     try:
         if archivo_csv.size == 0:
             return None, "El archivo CSV está vacío"
         
-        contenido = archivo_csv.getvalue().decode('utf-8')
-        
-        if not contenido.strip():
-            return None, "El archivo CSV está vacío"
-        
-        lineas = contenido.strip().split('\n')
-        
-        if len(lineas) == 0:
-            return None, "El archivo CSV no contiene datos"
-        
-        if len(lineas) < 2:
-            return None, "El archivo CSV no contiene filas de datos"
-        
+        archivo_csv.seek(0)
         try:
-            archivo_csv.seek(0)
-            df = pd.read_csv(archivo_csv)
-        except Exception as e:
-            try:
-                headers = lineas[0].split(',')
-                data = []
-                
-                for line in lineas[1:]:
-                    if line.strip():
-                        values = line.split(',')
-                        if len(values) == len(headers):
-                            data.append(values)
-                
-                if len(data) == 0:
-                    return None, "No se encontraron filas de datos válidas"
-                
-                df = pd.DataFrame(data, columns=headers)
-                st.success("✅ CSV cargado con procesamiento manual")
-                
-            except Exception as e2:
-                return None, f"No se pudo leer el CSV: {str(e2)}"
-        
-        if df.empty:
-            return None, "El archivo CSV no contiene filas de datos"
-        
-        if len(df.columns) == 0:
-            return None, "El archivo CSV no tiene columnas identificables"
+            df = carga_zip.leer_metadatos(archivo_csv)
+        except pd.errors.EmptyDataError:
+            return None, "El archivo CSV está vacío"
+        except (pd.errors.ParserError, UnicodeDecodeError) as e:
+            return None, f"No se pudo leer el CSV: {str(e)}"
         
-        df.columns = df.columns.str.strip()
+        errores = carga_zip.validar_csv_metadatos(df)
+        if errores:
+            return None, " | ".join(errores)
         
         st.success(f"✅ CSV cargado exitosamente: {len(df)} registros, {len(df.columns)} columnas")
         
-        errores = validar_csv_metadatos(df)
-        if errores:
-            return None, " | ".join(errores)
+        problemas = carga_zip.revisar_cis(df, validar_cedula)
+        if problemas["mal_formados"]:
+            ejemplos = ", ".join(f"fila {fila}: '{ci}'" for fila, ci in problemas["mal_formados"][:10])
+            st.warning(f"⚠️ {len(problemas['mal_formados'])} filas con CI mal formado; solo se usarán si algún archivo trae ese mismo CI. Ej.: {ejemplos}")
+        if problemas["repetidos"]:
+            st.warning(f"⚠️ {len(problemas['repetidos'])} CIs aparecen más de una vez; se usará la última fila de cada uno. "
+                       f"Ej.: {', '.join(problemas['repetidos'][:10])}")
+        if problemas["sin_nombre"]:
+            st.warning(f"⚠️ {len(problemas['sin_nombre'])} filas sin nombre se ignorarán. "
+                       f"Filas: {', '.join(str(fila) for fila in problemas['sin_nombre'][:10])}")
         
         return df, None
         
     except Exception as e:
         return None, f"Error inesperado al procesar el CSV: {str(e)}"
 
+@st.cache_data(ttl=30, max_entries=100, show_spinner=False)
+def obtener_deduplicacion_cache(_db, clave_conexion, marca_actualizacion):
+    """
+    Reporte de deduplicación de la barra lateral cacheado unos segundos, por
+    conexión (`clave_conexion`: base_datos.clave_uri de la URI, no el usuario).
+    `marca_actualizacion` cambia con cada alta o baja, de esta sesión o de
+    cualquier otro proceso (generación de la caché de consultas), y fuerza el recálculo
+    """
+    return almacenamiento.reporte_deduplicacion(_db)
+
+def mostrar_operaciones_masivas(db):
+    """
+    Eliminar, etiquetar o recategorizar todos los documentos que cumplen un filtro,
+    después de ver cuántos son (ver operaciones_masivas.py)
+    """
+    with st.expander("**🧰 Operaciones masivas**", expanded=False):
+        col_m1, col_m2, col_m3 = st.columns(3)
+        with col_m1:
+            lote_masivo = st.text_input("Lote de carga", help="Identificador del lote (p. ej. zip_20240101_120000)", key="lote_masivo")
+            ci_masivo = st.text_input("CI", key="ci_masivo")
+        with col_m2:
+            fecha_desde_masivo = st.date_input("Creados desde", value=None, key="fecha_desde_masivo")
+            fecha_hasta_masivo = st.date_input("Creados hasta", value=None, key="fecha_hasta_masivo")
+        with col_m3:
+            tipo_masivo = st.selectbox("Tipo", ["Todos", "Texto", "PDF", "Word", "Imagen"], key="tipo_masivo")
+            categoria_masivo = st.text_input("Categoría", key="categoria_masivo")
+        
+        criterios = {
+            "lote_carga": lote_masivo.strip(),
+            "ci": ci_masivo.strip(),
+            "fecha_desde": fecha_desde_masivo,
+            "fecha_hasta": fecha_hasta_masivo,
+            "tipo": tipo_masivo.lower() if tipo_masivo != "Todos" else None,
+            "categoria": categoria_masivo.strip()
+        }
+        
+        if st.button("🔍 Vista previa", key="vista_previa_masiva"):
+            try:
+                filtro = operaciones_masivas.construir_filtro(**criterios)
+                st.session_state.operacion_masiva = {
+                    "criterios": criterios,
+                    "filtro": filtro,
+                    "vista": operaciones_masivas.vista_previa(db, filtro)
+                }
+            except ValueError as e:
+                st.warning(f"⚠️ {e}")
+                st.session_state.operacion_masiva = None
+        
+        operacion = st.session_state.operacion_masiva
+        if operacion and operacion["criterios"] != criterios:
+            st.info("ℹ️ Los criterios cambiaron: vuelve a pulsar 'Vista previa'")
+        elif operacion:
+            vista = operacion["vista"]
+            st.write(f"**{vista['documentos']} documentos** seleccionados ({vista['bytes'] / (1024 * 1024):.2f} MB)")
+            if vista["ejemplos"]:
+                st.dataframe(
+                    pd.DataFrame([
+                        {"Título": doc.get("titulo"), "CI": doc.get("ci"), "Archivo": doc.get("nombre_archivo"),
+                         "Lote": doc.get("lote_carga"), "Creado": doc.get("fecha_creacion")}
+                        for doc in vista["ejemplos"]
+                    ]),
+                    use_container_width=True,
+                    hide_index=True
+                )
+            
+            if vista["documentos"]:
+                accion = st.radio("Operación", ["🗑️ Eliminar", "🏷️ Etiquetas y categoría"], horizontal=True, key="accion_masiva")
+                
+                if accion == "🗑️ Eliminar":
+                    confirmado = st.checkbox(
+                        f"Confirmo que quiero eliminar {vista['documentos']} documentos y sus archivos",
+                        key="confirmar_eliminacion_masiva"
+                    )
+                    if st.button("🗑️ Eliminar documentos", type="primary", disabled=not confirmado, key="eliminar_masivo"):
+                        barra = st.progress(0.0)
+                        resultado = operaciones_masivas.eliminar_por_filtro(
+                            db, operacion["filtro"], st.session_state.mongo_username, operacion["criterios"],
+                            progreso=lambda eliminados: barra.progress(min(eliminados / vista["documentos"], 1.0))
+                        )
+                        st.session_state.operacion_masiva = None
+                        st.session_state.last_delete_time = datetime.now().timestamp()
+                        if resultado["errores"]:
+                            st.error(f"❌ {len(resultado['errores'])} errores: {resultado['errores'][0]}")
+                        st.success(f"✅ {resultado['documentos_afectados']} documentos eliminados en {resultado['segundos']} s")
+                else:
+                    col_t1, col_t2, col_t3 = st.columns(3)
+                    with col_t1:
+                        agregar_tags = st.text_input("Agregar etiquetas", help="Separadas por comas", key="agregar_tags_masivo")
+                    with col_t2:
+                        quitar_tags = st.text_input("Quitar etiquetas", help="Separadas por comas", key="quitar_tags_masivo")
+                    with col_t3:
+                        nueva_categoria = st.text_input("Nueva categoría", key="nueva_categoria_masivo")
+                    
+                    if st.button("💾 Aplicar cambios", type="primary", key="actualizar_masivo"):
+                        try:
+                            resultado = operaciones_masivas.actualizar_por_filtro(
+                                db, operacion["filtro"], st.session_state.mongo_username,
+                                agregar_tags=[tag.strip() for tag in agregar_tags.split(",")],
+                                quitar_tags=[tag.strip() for tag in quitar_tags.split(",")],
+                                categoria=nueva_categoria.strip() or None,
+                                criterios=operacion["criterios"]
+                            )
+                            st.session_state.operacion_masiva = None
+                            st.session_state.last_delete_time = datetime.now().timestamp()
+                            if resultado["errores"]:
+                                st.error(f"❌ Error: {resultado['errores'][0]}")
+                            else:
+                                st.success(f"✅ {resultado['documentos_afectados']} documentos actualizados en {resultado['segundos']} s")
+                        except ValueError as e:
+                            st.warning(f"⚠️ {e}")
+        
+        ultimas = operaciones_masivas.ultimas_operaciones(db, 10)
+        if ultimas:
+            st.markdown("**Últimas operaciones masivas**")
+            st.dataframe(
+                pd.DataFrame([
+                    {"Fecha": entrada["fecha"], "Usuario": entrada.get("usuario"), "Operación": entrada["operacion"],
+                     "Criterios": ", ".join(f"{campo}={valor}" for campo, valor in entrada.get("criterios", {}).items()),
+                     "Documentos": entrada.get("documentos_afectados", 0), "Errores": len(entrada.get("errores", []))}
+                    for entrada in ultimas
+                ]),
+                use_container_width=True,
+                hide_index=True
+            )
+
+def mostrar_rendimiento():
+    """Tiempos por etapa y por comando de MongoDB acumulados en el proceso (ver rendimiento.py)"""
+    st.markdown("### ⏱️ Rendimiento")
+    
+    if not rendimiento.ACTIVO:
+        st.info("ℹ️ La medición está desactivada (DOCS_RENDIMIENTO=0)")
+        return
+    
+    metricas = rendimiento.REGISTRO.exportar()
+    st.caption(f"Acumulado en este proceso desde {metricas['desde'][:19].replace('T', ' ')} UTC, para todas las sesiones y cargas en segundo plano")
+    
+    def tabla(acumulados, nombre_columna):
+        return pd.DataFrame([
+            {
+                nombre_columna: nombre,
+                "Llamadas": valores["llamadas"],
+                "Fallidos": valores["fallidos"],
+                "Total (ms)": valores["total_ms"],
+                "Media (ms)": valores["media_ms"],
+                "Máximo (ms)": valores["maximo_ms"],
+                "Último (ms)": valores["ultimo_ms"],
+                "Bytes devueltos": valores["bytes"]
+            }
+            for nombre, valores in sorted(acumulados.items(), key=lambda item: -item[1]["total_ms"])
+        ])
+    
+    st.markdown("#### Etapas de la aplicación")
+    if metricas["etapas"]:
+        st.dataframe(tabla(metricas["etapas"], "Etapa").drop(columns=["Bytes devueltos"]), use_container_width=True, hide_index=True)
+    else:
+        st.info("📝 Todavía no hay mediciones")
+    
+    st.markdown("#### Comandos de MongoDB")
+    if metricas["comandos"]:
+        st.dataframe(tabla(metricas["comandos"], "Comando"), use_container_width=True, hide_index=True)
+    else:
+        st.info("📝 Todavía no hay comandos medidos (se miden los clientes creados después de activar la medición)")
+    
+    if metricas["contadores"]:
+        st.markdown("#### Contadores")
+        st.dataframe(
+            pd.DataFrame({"Contador": list(metricas["contadores"]), "Valor": list(metricas["contadores"].values())}),
+            use_container_width=True,
+            hide_index=True
+        )
+    
+    cache = cache_consultas.CACHE.resumen()
+    st.caption(f"Caché de consultas: {cache['entradas']} entradas, {cache['bytes'] / (1024 * 1024):.2f} MB")
+    if cambios.ACTIVO and st.session_state.db_connection is not None:
+        vigilante = cambios.VIGILANTES.obtener(st.session_state.db_connection)
+        st.caption(f"Seguimiento de cambios: {vigilante.modo or 'iniciando'} ({vigilante.eventos} cambios detectados)")
+    
+    col_r1, col_r2 = st.columns(2)
+    with col_r1:
+        st.download_button(
+            "📥 Exportar JSON",
+            data=json.dumps(metricas, ensure_ascii=False, indent=2),
+            file_name=f"rendimiento_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+            mime="application/json",
+            use_container_width=True,
+            key="exportar_rendimiento"
+        )
+    with col_r2:
+        if st.button("🧹 Reiniciar mediciones", use_container_width=True, key="reiniciar_rendimiento"):
+            rendimiento.REGISTRO.reiniciar()
+            st.rerun()
+
+ETIQUETAS_DIMENSIONES = {
+    "lote_carga": "Lote de carga",
+    "ci": "CI",
+    "tipo": "Tipo",
+    "categoria": "Categoría",
+    "usuario_creacion": "Usuario",
+    "mes": "Mes de creación"
+}
+
+@st.cache_data(ttl=15 * 60, max_entries=10, show_spinner=False)
+def obtener_uso_cache(_db, clave_conexion):
+    """
+    Informe de uso del almacenamiento, cacheado 15 minutos para todas las sesiones
+    conectadas a la misma URI (`clave_conexion`, ver base_datos.clave_uri):
+    recorre todo el índice y no hace falta que esté al día con cada alta
+    """
+    return uso_almacenamiento.informe_uso(_db)
+
+def uso_a_tabla(filas, dimension):
+    """Grupos de una dimensión del informe como DataFrame, con tamaños en MB"""
+    return pd.DataFrame([
+        {
+            ETIQUETAS_DIMENSIONES[dimension]: fila["valor"] if fila["valor"] is not None else "(sin valor)",
+            "Documentos": fila["documentos"],
+            "MB": round(fila["bytes"] / (1024 * 1024), 2),
+            "% del total": fila["porcentaje"],
+            "Mayor archivo (MB)": round(fila["maximo"] / (1024 * 1024), 2),
+            "Primero": (fila["desde"] or "")[:10],
+            "Último": (fila["hasta"] or "")[:10],
+            **({"⚠️ Anómalo": fila["anomalo"]} if "anomalo" in fila else {})
+        }
+        for fila in filas
+    ])
+
+def mostrar_uso_almacenamiento(db):
+    """Reparto del almacenamiento por dimensión y tamaño de las colecciones (ver uso_almacenamiento.py)"""
+    st.markdown("### 💾 Uso del almacenamiento")
+    
+    if st.button("🔄 Recalcular", key="recalcular_uso"):
+        obtener_uso_cache.clear()
+    
+    try:
+        with st.spinner("Calculando el uso del almacenamiento..."):
+            informe = obtener_uso_cache(db, base_datos.clave_uri(st.session_state.mongo_uri_conexion))
+    except Exception as e:
+        st.error(f"❌ Error al calcular el uso del almacenamiento: {str(e)}")
+        return
+    
+    st.caption(
+        f"Calculado {informe['calculado'][:19].replace('T', ' ')} UTC"
+        + ("" if informe["cubierto_por_indice"] else " · ⚠️ sin el índice uso_almacenamiento: se leyeron los documentos")
+    )
+    
+    total = informe["total"]
+    deduplicacion = informe["deduplicacion"]
+    col_u1, col_u2, col_u3 = st.columns(3)
+    col_u1.metric("📄 Documentos", total["documentos"])
+    col_u2.metric("📦 Tamaño original", f"{total['bytes'] / (1024 * 1024):.2f} MB")
+    col_u3.metric("💽 Archivos almacenados", f"{deduplicacion['bytes_almacenados'] / (1024 * 1024):.2f} MB")
+    if total["sin_tamaño"]:
+        st.info(f"ℹ️ {total['sin_tamaño']} documentos no tienen tamaño registrado y no suman en el informe")
+    
+    lotes_anomalos = [fila["valor"] for fila in informe["dimensiones"]["lote_carga"] if fila["anomalo"]]
+    if lotes_anomalos:
+        st.warning(
+            f"⚠️ Lotes que ocupan más de {uso_almacenamiento.FACTOR_LOTE_ANOMALO} veces la mediana: "
+            + ", ".join(lotes_anomalos)
+        )
+    
+    for dimension, etiqueta in ETIQUETAS_DIMENSIONES.items():
+        filas = informe["dimensiones"][dimension]
+        with st.expander(f"**Por {etiqueta.lower()}** ({len(filas)})", expanded=dimension == "lote_carga"):
+            if not filas:
+                st.info("📝 No hay documentos")
+                continue
+            if len(filas) == informe["limite_grupos"]:
+                st.caption(f"Se muestran los {informe['limite_grupos']} de mayor tamaño")
+            tabla = uso_a_tabla(filas, dimension)
+            st.dataframe(tabla, use_container_width=True, hide_index=True)
+            st.download_button(
+                "📥 Exportar CSV",
+                data=tabla.to_csv(index=False).encode("utf-8-sig"),
+                file_name=f"uso_{dimension}_{informe['calculado'][:10]}.csv",
+                mime="text/csv",
+                key=f"exportar_uso_{dimension}"
+            )
+    
+    if informe["colecciones"]:
+        st.markdown("#### Colecciones")
+        st.dataframe(
+            pd.DataFrame([
+                {
+                    "Colección": coleccion["coleccion"],
+                    "Documentos": coleccion["documentos"],
+                    "Datos (MB)": round(coleccion["bytes_datos"] / (1024 * 1024), 2),
+                    "En disco (MB)": round(coleccion["bytes_disco"] / (1024 * 1024), 2),
+                    "Índices (MB)": round(coleccion["bytes_indices"] / (1024 * 1024), 2)
+                }
+                for coleccion in informe["colecciones"]
+            ]),
+            use_container_width=True,
+            hide_index=True
+        )
+    
+    st.download_button(
+        "📥 Exportar informe completo (JSON)",
+        data=json.dumps(informe, ensure_ascii=False, indent=2, default=str),
+        file_name=f"uso_almacenamiento_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+        mime="application/json",
+        key="exportar_uso_json"
+    )
+
 def crear_plantilla_carga_masiva():
     """Crea y descarga plantilla CSV para carga masiva"""
     
@@ -943,25 +1436,35 @@ with st.sidebar:
         disconnect_btn = st.button("🔓 Desconectar", use_container_width=True, key="disconnect_btn")
     
     if disconnect_btn:
-        st.session_state.db_connection = None
-        st.session_state.db_connected = False
+        desconectar_mongodb()
         st.session_state.current_user = "No conectado"
         st.session_state.mongo_username = "Desconocido"
         st.session_state.df_metadatos_local = None
         st.session_state.last_delete_time = datetime.now().timestamp()
-        st.session_state.archivos_zip_procesados = {}
+        st.session_state.archivos_zip_procesados = []
+        st.session_state.zip_manifiesto = None
+        st.session_state.plan_carga = None
+        st.session_state.resultados_busqueda = None
+        st.session_state.operacion_masiva = None
         st.success("🔓 Desconectado de la base de datos")
         st.rerun()
     
     if connect_btn and mongo_uri:
         with st.spinner("Conectando a MongoDB..."):
-            db, connected, message, username = connect_mongodb(mongo_uri)
+            # Si la sesión ya estaba conectada con otra URI, liberar ese cliente
+            if st.session_state.mongo_uri_conexion and st.session_state.mongo_uri_conexion != mongo_uri:
+                desconectar_mongodb()
+            
+            db, connected, message, username = connect_mongodb(mongo_uri, st.session_state.sesion_id)
             if connected:
+                st.session_state.mongo_uri_conexion = mongo_uri
                 st.session_state.db_connection = db
                 st.session_state.db_connected = True
                 st.session_state.current_user = "Conectado"
                 st.session_state.mongo_username = username
                 st.session_state.last_delete_time = datetime.now().timestamp()
+                # Reanuda las cargas pendientes o interrumpidas (p. ej. tras reiniciar Streamlit)
+                ejecutor_trabajos.EJECUTOR.iniciar(mongo_uri)
                 st.success(f"✅ {message}")
             else:
                 st.error(f"❌ {message}")
@@ -973,13 +1476,19 @@ with st.sidebar:
         try:
             db = st.session_state.db_connection
             
-            total_docs = db.documentos.count_documents({})
-            pdf_count = db.documentos.count_documents({"tipo": "pdf"})
-            word_count = db.documentos.count_documents({"tipo": "word"})
-            text_count = db.documentos.count_documents({"tipo": "texto"})
-            image_count = db.documentos.count_documents({"tipo": "imagen"})
-            zip_count = db.documentos.count_documents({"procesado_desde_zip": True})
-            usuarios_activos = db.documentos.distinct("usuario_creacion")
+            with rendimiento.medir("barra_lateral.estadisticas"):
+                # Conteos mantenidos por el vigilante de cambios (ver cambios.py), sin recorrer la colección
+                estadisticas = cambios.estadisticas(db)
+                deduplicacion = obtener_deduplicacion_cache(
+                    db, base_datos.clave_uri(st.session_state.mongo_uri_conexion),
+                    (st.session_state.last_delete_time, cache_consultas.CACHE.generacion(db))
+                )
+            total_docs = estadisticas["total"]
+            pdf_count = estadisticas["por_tipo"].get("pdf", 0)
+            word_count = estadisticas["por_tipo"].get("word", 0)
+            text_count = estadisticas["por_tipo"].get("texto", 0)
+            image_count = estadisticas["por_tipo"].get("imagen", 0)
+            zip_count = estadisticas["desde_zip"]
             
             st.markdown("### 📊 Estadísticas")
             
@@ -993,13 +1502,19 @@ with st.sidebar:
                 st.metric("📋 Word", word_count)
                 st.metric("🖼️ Imágenes", image_count)
             
-            st.metric("👥 Usuarios Activos", len(usuarios_activos))
+            st.metric("👥 Usuarios Activos", estadisticas["usuarios"])
             st.metric("📦 Desde ZIP", zip_count)
+            
+            with st.expander("♻️ Deduplicación y compresión"):
+                st.metric("Archivos únicos", deduplicacion["archivos_unicos"])
+                st.metric("Referencias", deduplicacion["referencias"])
+                st.metric("Almacenado", f"{deduplicacion['bytes_almacenados'] / (1024 * 1024):.2f} MB")
+                st.metric("Ahorro por deduplicación", f"{deduplicacion['bytes_ahorrados_deduplicacion'] / (1024 * 1024):.2f} MB")
+                st.metric("Ahorro por compresión", f"{deduplicacion['bytes_ahorrados_compresion'] / (1024 * 1024):.2f} MB")
                 
         except Exception as e:
             st.error(f"❌ Error obteniendo estadísticas: {str(e)}")
-            st.session_state.db_connection = None
-            st.session_state.db_connected = False
+            desconectar_mongodb()
     
     elif mongo_uri and not st.session_state.db_connected:
         st.warning("⚠️ Presiona 'Conectar' para establecer la conexión")
@@ -1016,14 +1531,19 @@ if st.session_state.db_connected and st.session_state.db_connection is not None:
     st.markdown("## 📁 Gestión de Documentos")
     
     # ✅ SOLO 5 PESTAÑAS AHORA (ELIMINADA PESTAÑA 6)
-    tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs([
+    nombres_pestañas = [
         "🔍 Buscar Documentos", 
         "📝 Crear Texto", 
         "📄 Subir PDF", 
         "📝 Subir Word", 
         "📂 Todos los Documentos",
         "🚀 Carga desde ZIP"  # ✅ NUEVA PESTAÑA ÚNICA PARA ZIP
-    ])
+    ]
+    es_administrador = st.session_state.mongo_username in ADMINISTRADORES
+    if es_administrador:
+        nombres_pestañas.extend(["⏱️ Rendimiento", "💾 Almacenamiento"])
+    pestañas = st.tabs(nombres_pestañas)
+    tab1, tab2, tab3, tab4, tab5, tab6 = pestañas[:6]
     
     # PESTAÑA 1: BÚSQUEDA AVANZADA
     with tab1:
@@ -1042,8 +1562,9 @@ if st.session_state.db_connected and st.session_state.db_connection is not None:
             with col2:
                 tipo_busqueda = st.selectbox(
                     "**Buscar por:**",
-                    ["nombre", "autor", "contenido", "tags", "categoria", "ci", "descripcion", "usuario"],
+                    ["texto_completo", "nombre", "autor", "contenido", "tags", "categoria", "ci", "descripcion", "usuario"],
                     format_func=lambda x: {
+                        "texto_completo": "🧠 Texto completo (relevancia)",
                         "nombre": "📄 Nombre del documento",
                         "autor": "👤 Autor", 
                         "contenido": "📝 Contenido",
@@ -1070,31 +1591,40 @@ if st.session_state.db_connected and st.session_state.db_connection is not None:
             filtro_prioridad_busq = st.selectbox("Filtrar por prioridad", ["Todas", "Alta", "Media", "Baja"], key="filtro_prioridad_tab1")
         
         if buscar_btn and criterio_busqueda:
-            with st.spinner("🔍 Buscando en la base de datos..."):
-                filtros_adicionales = {}
-                if filtro_tipo_busq != "Todos":
-                    filtros_adicionales["tipo"] = filtro_tipo_busq.lower()
-                if filtro_categoria_busq != "Todas":
-                    filtros_adicionales["categoria"] = filtro_categoria_busq
-                if filtro_prioridad_busq != "Todas":
-                    filtros_adicionales["prioridad"] = filtro_prioridad_busq
-                
-                documentos_encontrados, error = buscar_documentos(
-                    db, criterio_busqueda, tipo_busqueda, filtros_adicionales
-                )
-                
-                if error:
-                    st.error(f"❌ Error en búsqueda: {error}")
-                elif documentos_encontrados:
-                    st.success(f"✅ Encontrados {len(documentos_encontrados)} documento(s)")
-                    
-                    for i, doc in enumerate(documentos_encontrados):
-                        mostrar_documento_compacto(doc, f"search_{i}")
-                else:
-                    st.info("🔍 No se encontraron documentos con esos criterios")
-        
+            filtros_adicionales = {}
+            if filtro_tipo_busq != "Todos":
+                filtros_adicionales["tipo"] = filtro_tipo_busq.lower()
+            if filtro_categoria_busq != "Todas":
+                filtros_adicionales["categoria"] = filtro_categoria_busq
+            if filtro_prioridad_busq != "Todas":
+                filtros_adicionales["prioridad"] = filtro_prioridad_busq
+            
+            # La búsqueda se conserva entre reruns (marcar filas, descargar, borrar)
+            st.session_state.resultados_busqueda = {
+                "parametros": (criterio_busqueda, tipo_busqueda, filtros_adicionales),
+                "id": uuid.uuid4().hex[:8]
+            }
         elif buscar_btn and not criterio_busqueda:
             st.warning("⚠️ Ingresa un término de búsqueda")
+        
+        resultados = st.session_state.resultados_busqueda
+        if resultados:
+            # Se repite en cada rerun: mientras no cambien los documentos la responde la caché
+            with st.spinner("🔍 Buscando en la base de datos..."):
+                documentos_encontrados, error = buscar_documentos(db, *resultados["parametros"])
+            
+            if error:
+                st.error(f"❌ Error en búsqueda: {error}")
+            elif documentos_encontrados:
+                if len(documentos_encontrados) >= LIMITE_BUSQUEDA:
+                    st.success(f"✅ Mostrando los primeros {LIMITE_BUSQUEDA} documentos: afina la búsqueda para ver el resto")
+                else:
+                    st.success(f"✅ Encontrados {len(documentos_encontrados)} documento(s)")
+                mostrar_resultados(
+                    documentos_encontrados, "search", f"{resultados['id']}_{cache_consultas.CACHE.generacion(db)}"
+                )
+            else:
+                st.info("🔍 No se encontraron documentos con esos criterios")
     
     # PESTAÑA 2: Crear Texto Simple
     with tab2:
@@ -1126,7 +1656,15 @@ if st.session_state.db_connected and st.session_state.db_connection is not None:
             with col4:
                 fecha_desde = st.date_input("Desde fecha", key="fecha_desde_tab5")
         
-        busqueda_rapida = st.text_input("🔍 Búsqueda rápida por título o CI", key="busqueda_rapida_tab5")
+        col_busq, col_pag = st.columns([4, 1])
+        with col_busq:
+            busqueda_rapida = st.text_input(
+                "🔍 Búsqueda rápida por título o CI",
+                help="Números: CI que empieza por el valor. Texto: búsqueda por palabras en título, autor, etiquetas y contenido",
+                key="busqueda_rapida_tab5"
+            )
+        with col_pag:
+            tamaño_pagina = st.selectbox("Documentos por página", [25, 50, 100, 200], index=1, key="tamaño_pagina_tab5")
         
         query = {}
         if filtro_tipo != "Todos":
@@ -1137,28 +1675,54 @@ if st.session_state.db_connected and st.session_state.db_connection is not None:
             query["prioridad"] = filtro_prioridad
         if fecha_desde:
             query["fecha_creacion"] = {"$gte": datetime.combine(fecha_desde, datetime.min.time())}
-        if busqueda_rapida:
-            query["$or"] = [
-                {"titulo": {"$regex": busqueda_rapida, "$options": "i"}},
-                {"ci": {"$regex": busqueda_rapida, "$options": "i"}},
-                {"autor": {"$regex": busqueda_rapida, "$options": "i"}},
-                {"usuario_creacion": {"$regex": busqueda_rapida, "$options": "i"}}
-            ]
+        if busqueda_rapida.strip():
+            termino = busqueda_rapida.strip()
+            if termino.isdigit():
+                query["ci"] = {"$regex": f"^{termino}"}
+            else:
+                query.update(base_datos.consulta_texto(termino))
         
-        try:
-            with st.spinner("Cargando documentos..."):
-                documentos = list(db.documentos.find(query).sort("fecha_creacion", -1))
+        # Volver a la primera página cuando cambian los filtros o el tamaño de página
+        firma_consulta = f"{query}|{tamaño_pagina}|{st.session_state.last_delete_time}"
+        if st.session_state.get('biblioteca_firma') != firma_consulta:
+            st.session_state.biblioteca_firma = firma_consulta
+            st.session_state.biblioteca_cursores = [None]
+        
+        cursores = st.session_state.biblioteca_cursores
+        
+        with st.spinner("Cargando documentos..."):
+            documentos, hay_mas, error = obtener_pagina_documentos(db, query, tamaño_pagina, cursores[-1])
+        
+        if error:
+            st.error(f"❌ Error al cargar documentos: {error}")
+        elif documentos:
+            pagina = len(cursores)
+            inicio = (pagina - 1) * tamaño_pagina + 1
+            st.info(f"📊 Página {pagina} | Mostrando documentos {inicio} - {inicio + len(documentos) - 1}")
             
-            if documentos:
-                st.info(f"📊 Mostrando {len(documentos)} documento(s)")
-                
-                for i, doc in enumerate(documentos):
-                    mostrar_documento_compacto(doc, f"all_{i}")
-            else:
-                st.info("📝 No se encontraron documentos. ¡Agrega el primero en las pestañas de arriba!")
-                
-        except Exception as e:
-            st.error(f"❌ Error al cargar documentos: {str(e)}")
+            mostrar_resultados(documentos, "all", f"{hash(firma_consulta)}_{pagina}_{cache_consultas.CACHE.generacion(db)}")
+            
+            col_ant, col_info, col_sig = st.columns([1, 2, 1])
+            with col_ant:
+                if st.button("⬅️ Anterior", disabled=pagina == 1, use_container_width=True, key="pagina_anterior_tab5"):
+                    cursores.pop()
+                    st.rerun()
+            with col_info:
+                st.markdown(f"<div style='text-align: center;'>Página {pagina}</div>", unsafe_allow_html=True)
+            with col_sig:
+                if st.button("Siguiente ➡️", disabled=not hay_mas, use_container_width=True, key="pagina_siguiente_tab5"):
+                    ultimo = documentos[-1]
+                    cursores.append((ultimo["fecha_creacion"], ultimo["_id"]))
+                    st.rerun()
+        elif len(cursores) > 1:
+            st.info("📝 No hay más documentos en esta página")
+            if st.button("⬅️ Volver al inicio", key="pagina_inicio_tab5"):
+                st.session_state.biblioteca_cursores = [None]
+                st.rerun()
+        else:
+            st.info("📝 No se encontraron documentos. ¡Agrega el primero en las pestañas de arriba!")
+        
+        mostrar_operaciones_masivas(db)
     
     # ✅ PESTAÑA 6: CARGA DESDE ZIP (ÚNICA)
     with tab6:
@@ -1166,13 +1730,16 @@ if st.session_state.db_connected and st.session_state.db_connection is not None:
         st.info(f"""
         **Carga masiva de documentos desde archivo ZIP**
         - Sube un ZIP con documentos organizados
-        - Los archivos se guardan COMPLETOS en la base de datos ✅
+        - Los archivos se guardan COMPLETOS en el almacenamiento de archivos (GridFS) ✅
         - Podrás descargarlos después desde la aplicación ✅
         - Soporta: PDF, Word, imágenes, texto
         - Hasta 10,000 documentos por carga
         - **Usuario de BD:** 👤 {st.session_state.mongo_username}
         """)
         
+        mostrar_trabajos_sin_terminar(db)
+        hash_zip = None
+        
         # Configuración
         col_config1, col_config2 = st.columns(2)
         
@@ -1187,14 +1754,16 @@ if st.session_state.db_connected and st.session_state.db_connection is not None:
             )
             
             if archivo_zip:
-                # Extraer y mostrar información del ZIP
-                archivos_zip, error_zip = extraer_archivos_desde_zip(archivo_zip)
+                # Leer solo el índice del ZIP (una vez por subida) y mostrar su información
+                manifiesto_zip, error_zip = extraer_archivos_desde_zip(archivo_zip)
                 
                 if error_zip:
                     st.error(f"❌ {error_zip}")
                 else:
+                    archivos_zip = manifiesto_zip["archivos"]
+                    hash_zip = manifiesto_zip["hash"]
                     st.session_state.archivos_zip_procesados = archivos_zip
-                    st.success(f"✅ ZIP procesado: {len(archivos_zip)} archivos extraídos")
+                    st.success(f"✅ ZIP procesado: {len(archivos_zip)} archivos encontrados")
                     
                     # Mostrar estadísticas del ZIP
                     with st.expander("📊 Estadísticas del ZIP", expanded=True):
@@ -1203,22 +1772,9 @@ if st.session_state.db_connected and st.session_state.db_connection is not None:
                         st.write(f"**📄 Total de archivos:** {len(archivos_zip)}")
                         
                         # Contar por tipo
-                        contadores = {
-                            'pdf': 0, 'word': 0, 'imagen': 0, 'texto': 0, 'otros': 0
-                        }
-                        
-                        for nombre_archivo in archivos_zip.keys():
-                            extension = Path(nombre_archivo).suffix.lower()
-                            if extension == '.pdf':
-                                contadores['pdf'] += 1
-                            elif extension in ['.docx', '.doc']:
-                                contadores['word'] += 1
-                            elif extension in ['.jpg', '.jpeg', '.png']:
-                                contadores['imagen'] += 1
-                            elif extension == '.txt':
-                                contadores['texto'] += 1
-                            else:
-                                contadores['otros'] += 1
+                        contadores = manifiesto_zip["contadores"]
+                        tamaño_total_mb = manifiesto_zip["tamaño_total"] / (1024 * 1024)
+                        st.write(f"**💾 Tamaño descomprimido:** {tamaño_total_mb:.2f} MB")
                         
                         col_stats1, col_stats2, col_stats3 = st.columns(3)
                         with col_stats1:
@@ -1234,9 +1790,9 @@ if st.session_state.db_connected and st.session_state.db_connection is not None:
                     
                     # Mostrar primeros archivos
                     with st.expander("📋 Ver primeros 15 archivos", expanded=False):
-                        for i, (nombre, archivo) in enumerate(list(archivos_zip.items())[:15]):
-                            tamaño_mb = len(archivo.getvalue()) / (1024 * 1024)
-                            st.write(f"{i+1}. 📄 `{nombre}` ({tamaño_mb:.2f} MB)")
+                        for i, entrada in enumerate(archivos_zip[:15]):
+                            tamaño_mb = entrada["tamaño"] / (1024 * 1024)
+                            st.write(f"{i+1}. 📄 `{entrada['nombre']}` ({tamaño_mb:.2f} MB)")
                         if len(archivos_zip) > 15:
                             st.write(f"... y {len(archivos_zip) - 15} archivos más")
             
@@ -1250,10 +1806,32 @@ if st.session_state.db_connected and st.session_state.db_connection is not None:
             
             patron_busqueda = st.selectbox(
                 "**Patrón de búsqueda de CI** *",
-                ["CI al inicio", "CI en cualquier parte", "CI específico en nombre"],
+                carga_zip.PATRONES_CI,
                 help="Cómo buscar el CI en los nombres de archivo",
                 key="patron_busqueda_tab6"
             )
+            
+            patrones_usuario_texto = st.text_area(
+                "**Patrones adicionales de CI**",
+                placeholder=r"EMP[_-]?(\d{10})",
+                help="Expresiones regulares, una por línea, con un grupo de captura para el CI. "
+                     "Se prueban después de las del patrón elegido",
+                key="patrones_usuario_tab6"
+            )
+            patrones_usuario = tuple(linea.strip() for linea in patrones_usuario_texto.splitlines() if linea.strip())
+            
+            validar_cedula = st.checkbox(
+                "**Validar cédula ecuatoriana**",
+                value=False,
+                help="Aceptar solo CIs de 10 dígitos con provincia y dígito verificador válidos",
+                key="validar_cedula_tab6"
+            )
+            
+            extractor_ci = None
+            try:
+                extractor_ci = extraccion_ci.obtener_extractor(patron_busqueda, patrones_usuario, validar_cedula)
+            except re.error as e:
+                st.error(f"❌ Patrón de CI no válido: {str(e)}")
         
         with col_config2:
             st.markdown("#### 📊 Configuración de Procesamiento")
@@ -1282,6 +1860,26 @@ if st.session_state.db_connected and st.session_state.db_connection is not None:
                 help="Reemplazar documentos que ya existen en la base de datos",
                 key="sobrescribir_existentes_tab6"
             )
+            
+            col_hilos1, col_hilos2 = st.columns(2)
+            with col_hilos1:
+                hilos_lectura = st.number_input(
+                    "**Hilos de lectura**",
+                    min_value=1,
+                    max_value=16,
+                    value=4,
+                    help="Archivos que se descomprimen y suben en paralelo",
+                    key="hilos_lectura_tab6"
+                )
+            with col_hilos2:
+                hilos_escritura = st.number_input(
+                    "**Escritores concurrentes**",
+                    min_value=1,
+                    max_value=8,
+                    value=2,
+                    help="Lotes que se escriben en MongoDB en paralelo",
+                    key="hilos_escritura_tab6"
+                )
         
         # Sección para CSV de metadatos
         st.markdown("#### 📋 Archivo CSV con Metadatos")
@@ -1311,10 +1909,12 @@ if st.session_state.db_connected and st.session_state.db_connection is not None:
         
         if archivo_csv:
             try:
-                content = archivo_csv.getvalue().decode('utf-8')
-                lines = content.split('\n')
+                # Solo el principio del archivo para la vista previa; las líneas se cuentan sobre los bytes
+                contenido_csv = archivo_csv.getvalue()
+                lines = contenido_csv[:64 * 1024].decode('utf-8-sig', errors='replace').splitlines()
                 
-                st.success(f"✅ Archivo CSV cargado: {len(lines)} líneas detectadas")
+                total_lineas = contenido_csv.count(b'\n') + (not contenido_csv.endswith(b'\n'))
+                st.success(f"✅ Archivo CSV cargado: {total_lineas} líneas detectadas")
                 
                 with st.expander("📊 Vista previa del CSV (primeras 5 líneas)", expanded=True):
                     st.write("**Contenido del CSV:**")
@@ -1324,7 +1924,7 @@ if st.session_state.db_connected and st.session_state.db_connection is not None:
                 if st.button("🔍 Validar estructura del CSV", key="validar_csv_tab6"):
                     with st.spinner("Validando CSV..."):
                         archivo_csv.seek(0)
-                        df_metadatos, error_csv = cargar_y_validar_csv(archivo_csv, "carga desde ZIP")
+                        df_metadatos, error_csv = cargar_y_validar_csv(archivo_csv, "carga desde ZIP", validar_cedula)
                         
                         if error_csv:
                             st.error(f"❌ Error en el CSV: {error_csv}")
@@ -1341,6 +1941,12 @@ if st.session_state.db_connected and st.session_state.db_connection is not None:
             except Exception as e:
                 st.error(f"❌ Error al leer el CSV: {str(e)}")
         
+        if st.session_state.archivos_zip_procesados and archivo_zip and extractor_ci and tipos_archivo:
+            mostrar_extraccion_ci(
+                st.session_state.archivos_zip_procesados, tipos_archivo, max_documentos,
+                extractor_ci, st.session_state.df_metadatos_local
+            )
+        
         st.markdown("---")
         st.markdown("#### 🧪 Generar Plantilla")
         crear_plantilla_carga_masiva()
@@ -1348,30 +1954,82 @@ if st.session_state.db_connected and st.session_state.db_connection is not None:
         # Botón de procesamiento
         st.markdown("#### ⚡ Procesamiento desde ZIP")
         
+        if st.button("🧭 Simular carga (sin escribir nada)", use_container_width=True, key="btn_simular_zip_tab6"):
+            if not archivo_zip or not st.session_state.archivos_zip_procesados:
+                st.error("❌ Primero debes subir y procesar un archivo ZIP")
+            elif st.session_state.df_metadatos_local is None:
+                st.error("❌ Primero debes validar el CSV usando el botón 'Validar estructura del CSV'")
+            elif not tipos_archivo:
+                st.error("❌ Debes seleccionar al menos un tipo de archivo")
+            elif extractor_ci is None:
+                st.error("❌ Corrige los patrones adicionales de CI")
+            else:
+                with st.spinner("Simulando la carga..."):
+                    filas, resumen = carga_zip.planificar_carga(
+                        db,
+                        st.session_state.archivos_zip_procesados,
+                        tipos_archivo,
+                        max_documentos,
+                        carga_zip.mapear_metadatos(st.session_state.df_metadatos_local),
+                        extractor_ci,
+                        sobrescribir_existentes
+                    )
+                st.session_state.plan_carga = {
+                    "hash_zip": hash_zip, "nombre_zip": archivo_zip.name, "filas": filas, "resumen": resumen
+                }
+        
+        # La simulación se conserva entre reruns (p. ej. al descargar el CSV) mientras no cambie el ZIP
+        if st.session_state.plan_carga and archivo_zip and st.session_state.plan_carga["hash_zip"] == hash_zip:
+            mostrar_plan_carga(st.session_state.plan_carga)
+        
         if st.button("🚀 Iniciar Carga desde ZIP", type="primary", use_container_width=True, key="btn_carga_zip_tab6"):
-            if not st.session_state.archivos_zip_procesados:
+            if not archivo_zip or not st.session_state.archivos_zip_procesados:
                 st.error("❌ Primero debes subir y procesar un archivo ZIP")
             elif st.session_state.df_metadatos_local is None:
                 st.error("❌ Primero debes validar el CSV usando el botón 'Validar estructura del CSV'")
             elif not tipos_archivo:
                 st.error("❌ Debes seleccionar al menos un tipo de archivo")
+            elif extractor_ci is None:
+                st.error("❌ Corrige los patrones adicionales de CI")
             else:
                 archivos_zip = st.session_state.archivos_zip_procesados
                 df_metadatos = st.session_state.df_metadatos_local
                 
                 st.info(f"📋 **Resumen a procesar:** {len(archivos_zip)} archivos en ZIP, {len(df_metadatos)} registros de {df_metadatos['ci'].nunique()} CIs")
                 
-                with st.spinner("🔄 Iniciando procesamiento desde ZIP..."):
-                    resultado = procesar_carga_desde_zip(
-                        db=db,
-                        archivos_zip=archivos_zip,
-                        df_metadatos=df_metadatos,
-                        tipos_archivo=tipos_archivo,
-                        max_documentos=max_documentos,
-                        tamaño_lote=tamaño_lote,
-                        patron_busqueda=patron_busqueda,
-                        sobrescribir_existentes=sobrescribir_existentes
-                    )
+                lote_id = encolar_carga_desde_zip(
+                    db=db,
+                    archivo_zip=archivo_zip,
+                    hash_zip=hash_zip,
+                    manifiesto=archivos_zip,
+                    df_metadatos=df_metadatos,
+                    tipos_archivo=tipos_archivo,
+                    max_documentos=max_documentos,
+                    tamaño_lote=tamaño_lote,
+                    patron_busqueda=patron_busqueda,
+                    sobrescribir_existentes=sobrescribir_existentes,
+                    hilos_lectura=int(hilos_lectura),
+                    hilos_escritura=int(hilos_escritura),
+                    patrones_usuario=patrones_usuario,
+                    validar_cedula=validar_cedula
+                )
+                if lote_id:
+                    st.session_state.trabajo_seguido = lote_id
+        
+        # Progreso de la carga en segundo plano que sigue esta sesión
+        if st.session_state.trabajo_seguido:
+            if st.session_state.trabajo_seguido_activo:
+                st.checkbox("🔄 Actualizar el progreso automáticamente", value=True, key="actualizar_trabajo_tab6")
+            # La carga no depende de estos refrescos; solo el panel se vuelve a ejecutar
+            sondear = st.session_state.trabajo_seguido_activo and st.session_state.get('actualizar_trabajo_tab6', True)
+            st.fragment(panel_trabajo_seguido, run_every=ejecutor_trabajos.INTERVALO_PROGRESO if sondear else None)(db)
+    
+    # PESTAÑAS DE RENDIMIENTO Y ALMACENAMIENTO (solo administradores)
+    if es_administrador:
+        with pestañas[6]:
+            mostrar_rendimiento()
+        with pestañas[7]:
+            mostrar_uso_almacenamiento(db)
 
 else:
     st.info("👈 Configura la conexión a MongoDB en la barra lateral para comenzar")
@@ -0,0 +1,265 @@
+"""
+Utilidades de base de datos compartidas por la aplicación y los procesos de carga
+"""
+import hashlib
+import os
+import threading
+import time
+import uuid
+import weakref
+
+import pymongo
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+from pymongo.errors import PyMongoError
+
+import rendimiento
+
+NOMBRE_BD = "documentation_db"
+
+# Configuración del pool de conexiones compartido
+MAX_POOL = int(os.environ.get("MONGODB_MAX_POOL_SIZE", 50))
+MIN_POOL = int(os.environ.get("MONGODB_MIN_POOL_SIZE", 0))
+# Segundos sin actividad tras los que se da por cerrada una sesión (y su cliente, si no quedan otras)
+INACTIVIDAD_MAXIMA = int(os.environ.get("MONGODB_INACTIVIDAD_MAXIMA", 2 * 60 * 60))
+
+# Código de error de MongoDB para claves duplicadas
+ERROR_DUPLICADO = 11000
+
+IDIOMA_BUSQUEDA = "spanish"
+
+# Índices de la colección `documentos`. El orden (fecha_creacion, _id) es el
+# que usa la paginación de la biblioteca, por eso los filtros lo incluyen.
+INDICES_DOCUMENTOS = [
+    IndexModel([("ci", ASCENDING)], name="ci"),
+    IndexModel([("fecha_creacion", DESCENDING), ("_id", DESCENDING)], name="fecha_creacion"),
+    IndexModel([("tipo", ASCENDING), ("fecha_creacion", DESCENDING), ("_id", DESCENDING)], name="tipo_fecha"),
+    IndexModel([("categoria", ASCENDING), ("fecha_creacion", DESCENDING), ("_id", DESCENDING)], name="categoria_fecha"),
+    IndexModel([("prioridad", ASCENDING), ("fecha_creacion", DESCENDING), ("_id", DESCENDING)], name="prioridad_fecha"),
+    IndexModel([("tags", ASCENDING)], name="tags"),
+    IndexModel([("lote_carga", ASCENDING)], name="lote_carga"),
+    # Cubre la agregación del informe de uso del almacenamiento (ver uso_almacenamiento.py)
+    IndexModel(
+        [
+            ("lote_carga", ASCENDING), ("ci", ASCENDING), ("tipo", ASCENDING), ("categoria", ASCENDING),
+            ("usuario_creacion", ASCENDING), ("fecha_creacion", ASCENDING), ("tamaño_bytes", ASCENDING)
+        ],
+        name="uso_almacenamiento"
+    ),
+    # Un mismo archivo no puede cargarse dos veces desde ZIP para el mismo CI
+    IndexModel(
+        [("ci", ASCENDING), ("nombre_archivo", ASCENDING)],
+        name="ci_archivo_zip_unico",
+        unique=True,
+        partialFilterExpression={"procesado_desde_zip": True}
+    ),
+    # Búsqueda de texto completo: stemming en español, sin distinguir acentos
+    IndexModel(
+        [
+            ("titulo", TEXT), ("tags", TEXT), ("autor", TEXT), ("nombre_completo", TEXT),
+            ("descripcion", TEXT), ("contenido", TEXT), ("usuario_creacion", TEXT)
+        ],
+        name="busqueda_texto",
+        default_language=IDIOMA_BUSQUEDA,
+        language_override="idioma_indice",
+        weights={
+            "titulo": 10, "tags": 5, "autor": 3, "nombre_completo": 3,
+            "descripcion": 2, "contenido": 1, "usuario_creacion": 1
+        }
+    ),
+]
+
+# Índices a crear por colección (`trabajos_carga` y `miembros_carga`: ver trabajos.py;
+# `auditoria`: ver operaciones_masivas.py; `blobs`: ver almacenamiento.py)
+INDICES_POR_COLECCION = {
+    "documentos": INDICES_DOCUMENTOS,
+    "trabajos_carga": [
+        IndexModel([("estado", ASCENDING), ("fecha_actualizacion", DESCENDING)], name="estado_fecha"),
+        IndexModel([("hash_zip", ASCENDING)], name="hash_zip"),
+    ],
+    "auditoria": [
+        IndexModel([("fecha", DESCENDING)], name="fecha"),
+    ],
+    "miembros_carga": [
+        IndexModel([("lote_carga", ASCENDING), ("nombre", ASCENDING)], name="lote_nombre_unico", unique=True),
+        IndexModel([("lote_carga", ASCENDING), ("estado", ASCENDING)], name="lote_estado"),
+    ],
+    # Si ningún archivo almacenado mide lo mismo, una subida no puede ser duplicada (ver almacenamiento.py)
+    "blobs": [
+        IndexModel([("tamaño_bytes", ASCENDING)], name="tamaño"),
+    ],
+}
+
+
+def clave_uri(uri):
+    """Clave del registro para una URI (hash, para no guardar credenciales en claro)"""
+    return hashlib.sha256(uri.encode("utf-8")).hexdigest()[:16]
+
+
+# Clave estable de cada cliente vivo, por id(); la entrada se borra cuando el
+# cliente se destruye, antes de que otro objeto pueda reutilizar su id
+_CLAVES_CLIENTE = {}
+_LOCK_CLAVES = threading.RLock()
+
+
+def _olvidar_clave(identificador):
+    with _LOCK_CLAVES:
+        _CLAVES_CLIENTE.pop(identificador, None)
+
+
+def _asignar_clave(cliente, clave):
+    with _LOCK_CLAVES:
+        if id(cliente) not in _CLAVES_CLIENTE:
+            weakref.finalize(cliente, _olvidar_clave, id(cliente))
+        _CLAVES_CLIENTE[id(cliente)] = clave
+        return clave
+
+
+def clave_cliente(cliente):
+    """
+    Identifica un cliente dentro del proceso (ver cache_consultas.clave_bd). Los
+    del registro usan la clave de su URI, así que un cliente recreado para la
+    misma URI conserva la clave; cualquier otro recibe una propia. Nunca se repite
+    para un cliente distinto, como sí puede pasar con id()
+    """
+    with _LOCK_CLAVES:
+        clave = _CLAVES_CLIENTE.get(id(cliente))
+        return clave or _asignar_clave(cliente, f"cliente_{uuid.uuid4().hex[:16]}")
+
+
+class RegistroClientes:
+    """
+    Un MongoClient por URI para todo el proceso, compartido por todas las sesiones.
+    Cada sesión solo guarda su identificador; el cliente se cierra cuando la última
+    sesión que lo usa se desconecta o lleva más de `inactividad_maxima` segundos sin usarlo
+    """
+
+    def __init__(self, max_pool=MAX_POOL, min_pool=MIN_POOL, inactividad_maxima=INACTIVIDAD_MAXIMA):
+        self.max_pool = max_pool
+        self.min_pool = min_pool
+        self.inactividad_maxima = inactividad_maxima
+        self._clientes = {}
+        self._lock = threading.Lock()
+
+    def obtener(self, uri, sesion_id):
+        """Devuelve el cliente compartido para `uri`, creándolo si hace falta"""
+        clave = clave_uri(uri)
+        with self._lock:
+            self._cerrar_inactivos()
+            entrada = self._clientes.get(clave)
+            if entrada is None:
+                cliente = pymongo.MongoClient(
+                    uri,
+                    serverSelectionTimeoutMS=5000,
+                    maxPoolSize=self.max_pool,
+                    minPoolSize=self.min_pool,
+                    maxIdleTimeMS=5 * 60 * 1000,
+                    event_listeners=rendimiento.listeners()
+                )
+                _asignar_clave(cliente, clave)
+                entrada = self._clientes[clave] = {"cliente": cliente, "sesiones": {}}
+            entrada["sesiones"][sesion_id] = time.monotonic()
+            return entrada["cliente"]
+
+    def liberar(self, uri, sesion_id):
+        """Quita la sesión del cliente y lo cierra si ya no lo usa nadie"""
+        clave = clave_uri(uri)
+        with self._lock:
+            entrada = self._clientes.get(clave)
+            if entrada is None:
+                return
+            entrada["sesiones"].pop(sesion_id, None)
+            if not entrada["sesiones"]:
+                self._cerrar(clave)
+
+    def _cerrar_inactivos(self):
+        limite = time.monotonic() - self.inactividad_maxima
+        for clave, entrada in list(self._clientes.items()):
+            for sesion_id, ultimo_uso in list(entrada["sesiones"].items()):
+                if ultimo_uso < limite:
+                    del entrada["sesiones"][sesion_id]
+            if not entrada["sesiones"]:
+                self._cerrar(clave)
+
+    def _cerrar(self, clave):
+        entrada = self._clientes.pop(clave)
+        entrada["cliente"].close()
+
+    def cerrar_todos(self):
+        with self._lock:
+            for clave in list(self._clientes):
+                self._cerrar(clave)
+
+    def resumen(self):
+        """Clientes abiertos y número de sesiones que usan cada uno"""
+        with self._lock:
+            return {clave: len(entrada["sesiones"]) for clave, entrada in self._clientes.items()}
+
+
+# Registro único del proceso
+REGISTRO_CLIENTES = RegistroClientes()
+
+
+def asegurar_indices(db):
+    """
+    Crea los índices que falten. Cada índice se crea por separado para que un
+    conflicto o falta de permisos en uno no impida crear los demás.
+    Devuelve la lista de errores (vacía si todo fue bien)
+    """
+    errores = []
+    for coleccion, indices in INDICES_POR_COLECCION.items():
+        for indice in indices:
+            try:
+                db[coleccion].create_indexes([indice])
+            except PyMongoError as e:
+                errores.append(f"{coleccion}.{indice.document['name']}: {e}")
+    return errores
+
+
+def consulta_texto(termino):
+    """Filtro $text para buscar con el índice de texto completo"""
+    return {"$text": {"$search": termino, "$language": IDIOMA_BUSQUEDA}}
+
+
+def obtener_estadisticas(db):
+    """
+    Calcula las estadísticas de la barra lateral en una sola agregación:
+    total, conteo por tipo, documentos cargados desde ZIP y usuarios distintos
+    """
+    pipeline = [
+        {"$project": {"tipo": 1, "procesado_desde_zip": 1, "usuario_creacion": 1}},
+        {"$facet": {
+            "por_tipo": [{"$group": {"_id": "$tipo", "total": {"$sum": 1}}}],
+            "desde_zip": [{"$match": {"procesado_desde_zip": True}}, {"$count": "total"}],
+            "usuarios": [{"$group": {"_id": "$usuario_creacion"}}, {"$count": "total"}]
+        }}
+    ]
+    resultado = next(db.documentos.aggregate(pipeline), {})
+
+    por_tipo = {fila["_id"]: fila["total"] for fila in resultado.get("por_tipo", [])}
+    desde_zip = resultado.get("desde_zip") or [{"total": 0}]
+    usuarios = resultado.get("usuarios") or [{"total": 0}]
+
+    return {
+        "total": sum(por_tipo.values()),
+        "por_tipo": por_tipo,
+        "desde_zip": desde_zip[0]["total"],
+        "usuarios": usuarios[0]["total"]
+    }
+
+
+def claves_existentes(db, claves):
+    """
+    Devuelve, con una sola consulta, el subconjunto de claves (ci, nombre_archivo)
+    que ya existen en `documentos`
+    """
+    if not claves:
+        return set()
+
+    cursor = db.documentos.find(
+        {
+            "ci": {"$in": list({ci for ci, _ in claves})},
+            "nombre_archivo": {"$in": list({nombre for _, nombre in claves})}
+        },
+        {"_id": 0, "ci": 1, "nombre_archivo": 1}
+    )
+    return {(doc["ci"], doc["nombre_archivo"]) for doc in cursor} & set(claves)
@@ -0,0 +1,135 @@
+"""
+Caché de consultas de listado compartida por todas las sesiones del proceso.
+
+Guarda el resultado de find() (solo metadatos: las consultas de listado usan
+proyecciones sin archivos ni textos largos) con la clave de la consulta
+normalizada: filtro, proyección, orden y límite. Cada base de datos tiene un
+contador de generación que se incrementa con cada alta, baja o carga desde ZIP
+(`invalidar`); una entrada de una generación anterior no se vuelve a usar. Los
+cambios que hacen otros procesos también invalidan la caché: los detecta
+cambios.VigilanteDocumentos con un change stream o, sin replica set, sondeando
+la colección. DOCS_CACHE_TTL solo acota la vida de las entradas cuando ese
+seguimiento está desactivado (DOCS_VIGILAR_CAMBIOS=0).
+
+La caché es LRU y está acotada en número de entradas y en bytes (tamaño BSON de
+los documentos guardados).
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import bson
+from bson import json_util
+
+import base_datos
+import rendimiento
+
+TTL = float(os.environ.get("DOCS_CACHE_TTL", 5 * 60))
+MAX_ENTRADAS = int(os.environ.get("DOCS_CACHE_ENTRADAS", 256))
+MAX_BYTES = int(os.environ.get("DOCS_CACHE_MB", 64)) * 1024 * 1024
+
+
+def clave_bd(db):
+    """
+    Identifica la base de datos dentro del proceso: la clave de la URI de su
+    cliente (ver base_datos.clave_cliente) y el nombre de la base de datos
+    """
+    return f"{base_datos.clave_cliente(db.client)}:{db.name}"
+
+
+class CacheConsultas:
+    """LRU con caducidad y generaciones por base de datos; segura entre hilos"""
+
+    def __init__(self, ttl=TTL, max_entradas=MAX_ENTRADAS, max_bytes=MAX_BYTES):
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self.max_bytes = max_bytes
+        self._entradas = OrderedDict()
+        self._generaciones = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def generacion(self, db):
+        with self._lock:
+            return self._generaciones.get(clave_bd(db), 0)
+
+    def invalidar(self, db):
+        """Deja obsoletas todas las consultas cacheadas de `db` (se borran al volver a pedirlas o por LRU)"""
+        with self._lock:
+            clave = clave_bd(db)
+            self._generaciones[clave] = self._generaciones.get(clave, 0) + 1
+
+    def vaciar(self):
+        with self._lock:
+            self._entradas.clear()
+            self._bytes = 0
+
+    def _quitar(self, clave):
+        entrada = self._entradas.pop(clave)
+        self._bytes -= entrada["bytes"]
+
+    def obtener(self, db, clave):
+        """Resultado cacheado vigente para `clave`, o None"""
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                return None
+            if entrada["generacion"] != self._generaciones.get(clave_bd(db), 0) or entrada["expira"] < time.monotonic():
+                self._quitar(clave)
+                return None
+            self._entradas.move_to_end(clave)
+            return entrada["valor"]
+
+    def guardar(self, db, clave, valor, generacion):
+        """
+        Guarda `valor` (lista de documentos) si sigue en la generación con la que se
+        consultó; si mientras tanto hubo cambios, el resultado ya podría estar desfasado
+        """
+        tamaño = sum(len(bson.encode(doc)) for doc in valor)
+        if tamaño > self.max_bytes // 4:
+            return
+        with self._lock:
+            if generacion != self._generaciones.get(clave_bd(db), 0):
+                return
+            if clave in self._entradas:
+                self._quitar(clave)
+            self._entradas[clave] = {
+                "valor": valor, "bytes": tamaño, "generacion": generacion, "expira": time.monotonic() + self.ttl
+            }
+            self._bytes += tamaño
+            while self._entradas and (len(self._entradas) > self.max_entradas or self._bytes > self.max_bytes):
+                self._quitar(next(iter(self._entradas)))
+
+    def resumen(self):
+        with self._lock:
+            return {"entradas": len(self._entradas), "bytes": self._bytes, "generaciones": dict(self._generaciones)}
+
+
+# Caché única del proceso
+CACHE = CacheConsultas()
+
+
+def buscar(db, filtro, proyeccion, orden, limite=0, coleccion="documentos"):
+    """
+    find() con caché: devuelve la lista de documentos de la consulta, del
+    resultado cacheado si la consulta es idéntica y no hubo cambios desde entonces
+    """
+    clave = (clave_bd(db), coleccion, json_util.dumps([filtro, proyeccion, orden, limite], sort_keys=True))
+    valor = CACHE.obtener(db, clave)
+    if valor is not None:
+        rendimiento.contar("cache.aciertos")
+        return list(valor)
+
+    rendimiento.contar("cache.fallos")
+    generacion = CACHE.generacion(db)
+    cursor = db[coleccion].find(filtro, proyeccion).sort(orden)
+    if limite:
+        cursor = cursor.limit(limite)
+    valor = list(cursor)
+    CACHE.guardar(db, clave, valor, generacion)
+    return list(valor)
+
+
+def invalidar(db):
+    CACHE.invalidar(db)
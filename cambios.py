@@ -0,0 +1,247 @@
+"""
+Seguimiento de los cambios en `documentos` hechos por cualquier proceso.
+
+Por cada base de datos hay un hilo de fondo que escucha un change stream de la
+colección. Con cada alta, baja o modificación invalida la caché de consultas
+(ver cache_consultas.py) y mantiene al día las estadísticas de la barra
+lateral: las altas se suman directamente a partir del propio evento y solo
+las bajas, las modificaciones o un usuario nuevo obligan a recalcularlas, como
+mucho una vez cada INTERVALO_RECALCULO segundos. Las bajas y modificaciones que
+hace este proceso se recalculan en el momento (ver documentos_modificados), para
+que quien borra vea ya las estadísticas al día.
+
+Los change streams necesitan un replica set (Atlas siempre lo es). Contra un
+mongod independiente el hilo pasa a sondear cada INTERVALO_SONDEO segundos el
+número de documentos y el último _id, y recalcula todo si cambian.
+"""
+import os
+import threading
+import time
+
+from pymongo.errors import InvalidOperation, PyMongoError
+
+import base_datos
+import cache_consultas
+import rendimiento
+
+# "0" desactiva el seguimiento: las estadísticas se calculan con cada consulta
+ACTIVO = os.environ.get("DOCS_VIGILAR_CAMBIOS", "1") != "0"
+INTERVALO_SONDEO = float(os.environ.get("DOCS_INTERVALO_SONDEO_CAMBIOS", 10))
+INTERVALO_RECALCULO = 30
+# Espera antes de reabrir un change stream que se cortó
+ESPERA_REINTENTO = 5
+
+# Los eventos solo traen los campos que usan las estadísticas (nunca el contenido)
+PIPELINE_CAMBIOS = [
+    {"$match": {"operationType": {"$in": ["insert", "delete", "replace", "update", "drop", "rename", "invalidate"]}}},
+    {"$project": {
+        "operationType": 1,
+        "fullDocument.tipo": 1,
+        "fullDocument.procesado_desde_zip": 1,
+        "fullDocument.usuario_creacion": 1
+    }}
+]
+
+
+class VigilanteDocumentos:
+    """Hilo que sigue los cambios de `documentos` en una base de datos y sus estadísticas vivas"""
+
+    def __init__(self, db):
+        self.db = db
+        self.modo = None
+        self.eventos = 0
+        self._estadisticas = base_datos.obtener_estadisticas(db)
+        self._usuarios_conocidos = set()
+        self._recalcular = False
+        self._ultimo_recalculo = time.monotonic()
+        self._lock = threading.Lock()
+        # Los recálculos van de uno en uno: así el último en empezar es el último en guardarse
+        self._lock_recalculo = threading.Lock()
+        self._detener = threading.Event()
+        self._despertar = threading.Event()
+        self._hilo = threading.Thread(target=self._ejecutar, daemon=True)
+        self._hilo.start()
+
+    def activo(self):
+        return self._hilo.is_alive()
+
+    def detener(self):
+        self._detener.set()
+        self._despertar.set()
+
+    def despertar(self):
+        """En modo sondeo, adelanta la siguiente comprobación (tras un cambio hecho por este proceso)"""
+        self._despertar.set()
+
+    def recalcular(self):
+        """Recalcula ya las estadísticas, sin esperar al evento ni al intervalo (tras una baja o modificación de este proceso)"""
+        self._recalcular = True
+        self._recalcular_si_toca(forzar=True)
+
+    def estadisticas(self):
+        with self._lock:
+            return {**self._estadisticas, "por_tipo": dict(self._estadisticas["por_tipo"])}
+
+    def _ejecutar(self):
+        try:
+            self._escuchar()
+        except Exception:
+            # Sin change streams (mongod independiente) o se perdió el stream sin poder reanudarlo
+            if not self._detener.is_set():
+                self._sondear()
+
+    def _escuchar(self):
+        token = None
+        while not self._detener.is_set():
+            try:
+                with self.db.documentos.watch(PIPELINE_CAMBIOS, resume_after=token, max_await_time_ms=1000) as stream:
+                    self.modo = "change_stream"
+                    while not self._detener.is_set() and stream.alive:
+                        evento = stream.try_next()
+                        if evento is not None:
+                            # Tras borrar o renombrar la colección el stream no se puede reanudar
+                            token = None if evento["operationType"] in ("drop", "rename", "invalidate") else stream.resume_token
+                            self._aplicar(evento)
+                        self._recalcular_si_toca()
+            except InvalidOperation:
+                # El cliente se cerró (ver base_datos.RegistroClientes)
+                return
+            except PyMongoError:
+                if self.modo is None or token is None:
+                    raise
+                # Corte transitorio: se reanuda desde el último evento procesado
+                self._detener.wait(ESPERA_REINTENTO)
+
+    def _sondear(self):
+        self.modo = "sondeo"
+        huella = None
+        primera = True
+        while not self._detener.is_set():
+            # También se espera tras un error, para no reintentar sin pausa mientras dure el corte
+            if not primera:
+                self._despertar.wait(INTERVALO_SONDEO)
+                self._despertar.clear()
+                if self._detener.is_set():
+                    return
+            primera = False
+            try:
+                ultimo = self.db.documentos.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+                nueva = (self.db.documentos.estimated_document_count(), ultimo["_id"] if ultimo else None)
+            except InvalidOperation:
+                return
+            except PyMongoError:
+                continue
+            if huella is not None and nueva != huella:
+                self.eventos += 1
+                cache_consultas.invalidar(self.db)
+                self._recalcular = True
+                self._recalcular_si_toca(forzar=True)
+            huella = nueva
+
+    def _aplicar(self, evento):
+        self.eventos += 1
+        rendimiento.contar(f"cambios.{evento['operationType']}")
+        cache_consultas.invalidar(self.db)
+        if evento["operationType"] != "insert":
+            self._recalcular = True
+            return
+
+        documento = evento.get("fullDocument") or {}
+        usuario = documento.get("usuario_creacion")
+        with self._lock:
+            self._estadisticas["total"] += 1
+            tipo = documento.get("tipo")
+            self._estadisticas["por_tipo"][tipo] = self._estadisticas["por_tipo"].get(tipo, 0) + 1
+            if documento.get("procesado_desde_zip"):
+                self._estadisticas["desde_zip"] += 1
+        if usuario not in self._usuarios_conocidos:
+            # Puede ser un usuario nuevo: el conteo de usuarios distintos se recalcula
+            self._usuarios_conocidos.add(usuario)
+            self._recalcular = True
+
+    def _recalcular_si_toca(self, forzar=False):
+        with self._lock_recalculo:
+            if not self._recalcular:
+                return
+            if not forzar and time.monotonic() - self._ultimo_recalculo < INTERVALO_RECALCULO:
+                return
+            self._recalcular = False
+            self._ultimo_recalculo = time.monotonic()
+            try:
+                with rendimiento.medir("cambios.recalculo_estadisticas"):
+                    estadisticas = base_datos.obtener_estadisticas(self.db)
+            except PyMongoError:
+                self._recalcular = True
+                return
+            with self._lock:
+                self._estadisticas = estadisticas
+
+
+class RegistroVigilantes:
+    """Un vigilante por base de datos para todo el proceso"""
+
+    def __init__(self):
+        self._vigilantes = {}
+        self._lock = threading.Lock()
+
+    def obtener(self, db):
+        """Vigilante de `db`, creándolo (con las estadísticas iniciales) si no hay uno vivo"""
+        clave = cache_consultas.clave_bd(db)
+        with self._lock:
+            # Los de clientes ya cerrados terminan solos; aquí se olvidan
+            for clave_vieja, vigilante in list(self._vigilantes.items()):
+                if clave_vieja != clave and not vigilante.activo():
+                    del self._vigilantes[clave_vieja]
+            vigilante = self._vigilantes.get(clave)
+            if vigilante is not None and vigilante.db.client is not db.client:
+                # Cliente recreado para la misma URI: el vigilante del anterior se descarta
+                vigilante.detener()
+                vigilante = None
+            if vigilante is None or not vigilante.activo():
+                vigilante = self._vigilantes[clave] = VigilanteDocumentos(db)
+            return vigilante
+
+    def despertar(self, db):
+        with self._lock:
+            vigilante = self._vigilantes.get(cache_consultas.clave_bd(db))
+        if vigilante is not None:
+            vigilante.despertar()
+
+    def recalcular(self, db):
+        with self._lock:
+            vigilante = self._vigilantes.get(cache_consultas.clave_bd(db))
+        if vigilante is not None:
+            vigilante.recalcular()
+
+    def detener_todos(self):
+        with self._lock:
+            for vigilante in self._vigilantes.values():
+                vigilante.detener()
+            self._vigilantes.clear()
+
+
+# Registro único del proceso
+VIGILANTES = RegistroVigilantes()
+
+
+def estadisticas(db):
+    """Estadísticas de la barra lateral: las que mantiene el vigilante, o calculadas en el momento si está desactivado"""
+    if not ACTIVO:
+        return base_datos.obtener_estadisticas(db)
+    return VIGILANTES.obtener(db).estadisticas()
+
+
+def documentos_modificados(db, recalcular=True):
+    """
+    Aviso de que este proceso acaba de modificar `documentos`: invalida la caché
+    de consultas enseguida, sin esperar al evento del change stream o al sondeo,
+    y recalcula las estadísticas antes de volver. Con `recalcular=False` (altas y
+    cargas, donde un recálculo por lote sería caro) las pone al día el vigilante
+    """
+    cache_consultas.invalidar(db)
+    if not ACTIVO:
+        return
+    if recalcular:
+        VIGILANTES.recalcular(db)
+    else:
+        VIGILANTES.despertar(db)
@@ -0,0 +1,797 @@
+"""
+Lectura de archivos ZIP y escritura por lotes para la carga masiva.
+
+El ZIP nunca se descomprime entero: para la vista previa y las estadísticas
+solo se lee el índice (`infolist()`), y durante la carga cada archivo se abre
+y se copia al almacenamiento por bloques, de uno en uno. El origen de una carga
+también puede ser un directorio con los documentos.
+"""
+import hashlib
+import os
+import queue
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+from pymongo import InsertOne, ReplaceOne
+from pymongo.errors import BulkWriteError
+
+import almacenamiento
+import cambios
+import compresion
+import rendimiento
+import trabajos
+from base_datos import ERROR_DUPLICADO, claves_existentes
+from extraccion_ci import PATRONES_CI, es_cedula_valida, obtener_extractor
+
+TIPOS_POR_EXTENSION = {
+    '.pdf': 'pdf',
+    '.docx': 'word',
+    '.doc': 'word',
+    '.jpg': 'imagen',
+    '.jpeg': 'imagen',
+    '.png': 'imagen',
+    '.txt': 'texto'
+}
+
+
+def tipo_desde_extension(nombre_archivo, por_defecto='documento'):
+    """Tipo de documento (pdf, word, imagen, texto) según la extensión del archivo"""
+    return TIPOS_POR_EXTENSION.get(Path(nombre_archivo).suffix.lower(), por_defecto)
+
+
+def es_directorio(origen):
+    return isinstance(origen, (str, os.PathLike)) and os.path.isdir(origen)
+
+
+def leer_manifiesto(archivo_zip):
+    """
+    Lee el índice del ZIP sin descomprimir nada (o recorre el directorio, si el origen lo es).
+    Devuelve una lista de dicts con nombre, tamaño, tamaño comprimido y CRC de cada archivo
+    """
+    if es_directorio(archivo_zip):
+        base = Path(archivo_zip)
+        return [
+            {
+                "nombre": ruta.relative_to(base).as_posix(),
+                "tamaño": ruta.stat().st_size,
+                "tamaño_comprimido": ruta.stat().st_size,
+                "crc": None
+            }
+            for ruta in sorted(base.rglob("*"))
+            if ruta.is_file()
+        ]
+
+    with zipfile.ZipFile(archivo_zip, 'r') as zip_ref:
+        return [
+            {
+                "nombre": info.filename,
+                "tamaño": info.file_size,
+                "tamaño_comprimido": info.compress_size,
+                "crc": info.CRC
+            }
+            for info in zip_ref.infolist()
+            if not info.is_dir()
+        ]
+
+
+@contextmanager
+def abrir_origen(origen):
+    """
+    Abre el origen de una carga (ZIP como ruta o file-like, o directorio) y
+    devuelve una función que abre cada archivo por su nombre del manifiesto.
+    Un ZIP en disco no se carga en memoria: cada archivo se lee con seek
+    sobre el propio archivo ZIP
+    """
+    if es_directorio(origen):
+        base = Path(origen)
+        yield lambda nombre: open(base / nombre, 'rb')
+    else:
+        with zipfile.ZipFile(origen, 'r') as zip_ref:
+            yield zip_ref.open
+
+
+def filtrar_manifiesto(manifiesto, tipos_archivo, max_documentos):
+    """Archivos del manifiesto con alguna de las extensiones indicadas, hasta `max_documentos` (None = todos)"""
+    archivos = []
+    for entrada in manifiesto:
+        if Path(entrada["nombre"]).suffix.lower() in tipos_archivo:
+            archivos.append(entrada)
+        if max_documentos and len(archivos) >= max_documentos:
+            break
+    return archivos
+
+
+def extraer_ci_desde_nombre(nombre_archivo, patron_busqueda):
+    """
+    Extrae el CI del nombre del archivo según el patrón especificado
+    (para muchos archivos a la vez, ver ExtractorCI.extraer_lote)
+    """
+    return obtener_extractor(patron_busqueda).extraer(nombre_archivo)
+
+
+def leer_metadatos(archivo_csv):
+    """
+    Lee el CSV de metadatos en una sola pasada, con todas las columnas como
+    texto (los CI conservan los ceros a la izquierda) y normalizado de forma
+    vectorizada: nombres de columna y valores sin espacios sobrantes, celdas
+    vacías como nulos y CI sin guiones, puntos ni espacios
+    """
+    df = pd.read_csv(archivo_csv, dtype=str, keep_default_na=False, encoding='utf-8-sig', skipinitialspace=True)
+    df.columns = df.columns.str.strip()
+    for columna in df.columns:
+        valores = df[columna].str.strip()
+        df[columna] = valores.mask(valores == '')
+    if 'ci' in df.columns:
+        df['ci'] = df['ci'].str.replace(r'[\s.\-]', '', regex=True)
+    return df
+
+
+def revisar_cis(df_metadatos, validar_cedula=False):
+    """
+    Problemas de los CI del CSV, calculados en bloque: filas con CI mal formado
+    (no son 8 a 10 dígitos o, con `validar_cedula`, no son una cédula válida como
+    exige el extractor), CI repetidos (se usa la última fila) y filas sin nombre.
+    Solo se informa: las filas con CI mal formado se mantienen en MetadatosPorCI.
+    Devuelve un dict con las listas de cada tipo
+    """
+    cis = df_metadatos['ci']
+    if validar_cedula:
+        bien_formados = cis.map(lambda ci: isinstance(ci, str) and es_cedula_valida(ci))
+    else:
+        bien_formados = cis.str.fullmatch(r'\d{8,10}', na=False)
+    mal_formados = cis.notna() & ~bien_formados
+    repetidos = cis[cis.notna() & cis.duplicated(keep=False)]
+    sin_nombre = df_metadatos['nombre'].isna()
+    return {
+        # Número de fila tal como se ve en el archivo (la 1 es la cabecera)
+        "mal_formados": [(int(fila) + 2, ci) for fila, ci in cis[mal_formados].items()],
+        "repetidos": sorted(repetidos.unique().tolist()),
+        "sin_nombre": [int(fila) + 2 for fila in df_metadatos.index[sin_nombre]]
+    }
+
+
+class MetadatosPorCI:
+    """
+    Búsqueda de metadatos por CI. Guarda las columnas del CSV como listas y un
+    índice CI -> posición; el dict de cada fila (sin las celdas vacías) solo se
+    arma cuando se pide
+    """
+
+    def __init__(self, df_metadatos):
+        # Se mantiene cualquier CI no vacío, aunque no tenga el formato habitual:
+        # si un archivo trae ese mismo CI, sus metadatos son estos
+        validas = df_metadatos['ci'].notna() & df_metadatos['nombre'].notna()
+        df = df_metadatos[validas]
+        self.columnas = list(df.columns)
+        self._valores = [df[columna].tolist() for columna in self.columnas]
+        # Con CI repetidos gana la última fila, como al cargar fila a fila
+        self._posiciones = {ci: posicion for posicion, ci in enumerate(df['ci'].tolist())}
+
+    def get(self, ci, por_defecto=None):
+        posicion = self._posiciones.get(ci)
+        if posicion is None:
+            return por_defecto
+        return {
+            columna: valores[posicion]
+            for columna, valores in zip(self.columnas, self._valores)
+            if pd.notna(valores[posicion])
+        }
+
+    def __contains__(self, ci):
+        return ci in self._posiciones
+
+    def __len__(self):
+        return len(self._posiciones)
+
+    def cis(self):
+        return self._posiciones.keys()
+
+
+def mapear_metadatos(df_metadatos):
+    """Índice CI -> metadatos para buscar por CI en O(1) (ver MetadatosPorCI)"""
+    return MetadatosPorCI(df_metadatos)
+
+
+def validar_csv_metadatos(df):
+    """Valida la estructura del CSV de metadatos"""
+    errores = []
+
+    if df.empty:
+        errores.append("El archivo CSV está vacío")
+        return errores
+
+    if len(df.columns) == 0:
+        errores.append("El archivo CSV no tiene columnas")
+        return errores
+
+    campos_obligatorios = ['ci', 'nombre']
+    for campo in campos_obligatorios:
+        if campo not in df.columns:
+            errores.append(f"Falta columna obligatoria: '{campo}'")
+
+    if errores:
+        return errores
+
+    if df['ci'].isnull().all():
+        errores.append("La columna 'ci' no tiene valores")
+    elif df['ci'].isnull().any():
+        errores.append(f"Hay {int(df['ci'].isnull().sum())} valores nulos en la columna 'ci'")
+
+    return errores
+
+
+def contar_por_tipo(manifiesto):
+    """Cuenta los archivos del manifiesto por tipo de documento"""
+    contadores = {'pdf': 0, 'word': 0, 'imagen': 0, 'texto': 0, 'otros': 0}
+    for entrada in manifiesto:
+        contadores[tipo_desde_extension(entrada["nombre"], 'otros')] += 1
+    return contadores
+
+
+def calcular_hash(archivo, tamaño_chunk=1024 * 1024):
+    """SHA-256 del contenido de un file-like, leído por bloques"""
+    sha256 = hashlib.sha256()
+    archivo.seek(0)
+    for bloque in iter(lambda: archivo.read(tamaño_chunk), b""):
+        sha256.update(bloque)
+    archivo.seek(0)
+    return sha256.hexdigest()
+
+
+def _en_milisegundos(fecha):
+    """Una fecha tal como la devuelve MongoDB (BSON solo guarda milisegundos)"""
+    return fecha.replace(microsecond=fecha.microsecond // 1000 * 1000)
+
+
+def indices_escritos(db, documentos):
+    """
+    Índices de los documentos del lote que están escritos tal como se enviaron:
+    mismo (ci, nombre_archivo), mismo archivo y misma fecha de actualización.
+    Sirve para saber qué llegó a escribirse cuando bulk_write se corta a medias
+    """
+    guardados = {}
+    cursor = db.documentos.find(
+        {
+            "ci": {"$in": list({doc["ci"] for doc in documentos})},
+            "nombre_archivo": {"$in": list({doc["nombre_archivo"] for doc in documentos})}
+        },
+        {"ci": 1, "nombre_archivo": 1, "blob_id": 1, "fecha_actualizacion": 1}
+    )
+    for guardado in cursor:
+        guardados.setdefault((guardado["ci"], guardado["nombre_archivo"]), []).append(guardado)
+
+    escritos = set()
+    for indice, documento in enumerate(documentos):
+        huella = (documento["blob_id"], _en_milisegundos(documento["fecha_actualizacion"]))
+        if any(
+            (guardado.get("blob_id"), guardado.get("fecha_actualizacion")) == huella
+            for guardado in guardados.get((documento["ci"], documento["nombre_archivo"]), [])
+        ):
+            escritos.add(indice)
+    return escritos
+
+
+def liberar_archivos(db, documentos):
+    """
+    Libera los archivos de esos documentos sin interrumpir el lote; si alguno falla,
+    su referencia queda de más. Devuelve los errores
+    """
+    errores = []
+    for documento in documentos:
+        try:
+            almacenamiento.eliminar_contenido(db, documento)
+        except Exception as e:
+            errores.append(f"{documento['nombre_archivo']}: no se pudo liberar el archivo: {e}")
+    return errores
+
+
+def escribir_lote(db, documentos, sobrescribir=False, liberar=True):
+    """
+    Escribe un lote de documentos con un solo bulk_write sin orden.
+
+    - Sin sobrescribir: inserta; los duplicados que rechaza el índice único se cuentan aparte.
+    - Sobrescribiendo: ReplaceOne con upsert por (ci, nombre_archivo). Se conservan la fecha y
+      el usuario de creación del documento original y se libera la referencia a su archivo anterior.
+
+    Se liberan las referencias a los archivos de los documentos que no llegan a escribirse.
+    Si bulk_write se corta a medias (p. ej. AutoReconnect) se comprueba qué documentos
+    llegaron a escribirse; si tampoco eso es posible la excepción sigue sin liberar nada.
+    Con `liberar=False` no se libera nada: los documentos cuyos archivos sobran quedan en
+    `por_liberar` para liberarlos después del punto de control (ver ejecutar_carga).
+    Devuelve un dict con insertados, reemplazados, duplicados, fallidos, errores,
+    por_liberar y `estados` (el resultado de cada documento, en el mismo orden: ver trabajos.py)
+    """
+    resultado = {
+        "insertados": 0, "reemplazados": 0, "duplicados": 0, "fallidos": 0,
+        "errores": [], "estados": [], "por_liberar": []
+    }
+    if not documentos:
+        return resultado
+
+    anteriores = {}
+    if sobrescribir:
+        # Documentos que se van a reemplazar (una consulta por lote)
+        cursor = db.documentos.find(
+            {
+                "ci": {"$in": list({doc["ci"] for doc in documentos})},
+                "nombre_archivo": {"$in": list({doc["nombre_archivo"] for doc in documentos})}
+            },
+            {"ci": 1, "nombre_archivo": 1, "fecha_creacion": 1, "usuario_creacion": 1, "almacenamiento": 1, "blob_id": 1, "sha256": 1}
+        )
+        for anterior in cursor:
+            anteriores.setdefault((anterior["ci"], anterior["nombre_archivo"]), anterior)
+
+    operaciones = []
+    for documento in documentos:
+        if not sobrescribir:
+            operaciones.append(InsertOne(documento))
+            continue
+
+        anterior = anteriores.get((documento["ci"], documento["nombre_archivo"]))
+        if anterior:
+            documento["fecha_creacion"] = anterior.get("fecha_creacion", documento["fecha_creacion"])
+            documento["usuario_creacion"] = anterior.get("usuario_creacion", documento["usuario_creacion"])
+            filtro = {"_id": anterior["_id"]}
+        else:
+            filtro = {"ci": documento["ci"], "nombre_archivo": documento["nombre_archivo"]}
+        operaciones.append(ReplaceOne(filtro, documento, upsert=True))
+
+    try:
+        detalles = db.documentos.bulk_write(operaciones, ordered=False).bulk_api_result
+    except BulkWriteError as e:
+        detalles = e.details
+    except Exception as e:
+        # Sin detalle por documento: solo se dan por fallidos los que seguro no se escribieron
+        escritos = indices_escritos(db, documentos)
+        detalles = {"writeErrors": [
+            {"index": indice, "errmsg": str(e)} for indice in range(len(documentos)) if indice not in escritos
+        ]}
+    finally:
+        cambios.documentos_modificados(db, recalcular=False)
+
+    errores = {error["index"]: error for error in detalles.get("writeErrors", [])}
+    upserts = {upsert["index"] for upsert in detalles.get("upserted", [])}
+
+    for indice, documento in enumerate(documentos):
+        anterior = anteriores.get((documento["ci"], documento["nombre_archivo"]))
+
+        if indice in errores:
+            resultado["por_liberar"].append(documento)
+            if errores[indice].get("code") == ERROR_DUPLICADO:
+                resultado["duplicados"] += 1
+                resultado["estados"].append((trabajos.DUPLICADO, None))
+            else:
+                error = f"{documento['nombre_archivo']}: {errores[indice].get('errmsg')}"
+                resultado["fallidos"] += 1
+                resultado["errores"].append(error)
+                resultado["estados"].append((trabajos.ERROR, error))
+        elif not sobrescribir or indice in upserts or not anterior:
+            resultado["insertados"] += 1
+            resultado["estados"].append((trabajos.INSERTADO, None))
+        else:
+            resultado["reemplazados"] += 1
+            resultado["estados"].append((trabajos.REEMPLAZADO, None))
+            resultado["por_liberar"].append(anterior)
+
+    if liberar:
+        resultado["errores"].extend(liberar_archivos(db, resultado["por_liberar"]))
+        resultado["por_liberar"] = []
+    return resultado
+
+
+def conciliar_subidas(db, lote_id):
+    """
+    Resuelve los archivos subidos de un trabajo cuyo lote no llegó a su punto de
+    control (el proceso murió antes, o la escritura falló sin saber qué se escribió).
+    Los que tienen su documento escrito se dan por insertados; los demás quedan con
+    error (se reintentan al reanudar) y se les libera la referencia. Cada archivo
+    pasa del contador de su estado anterior al del nuevo (ver trabajos.reclasificar_miembros).
+    Devuelve (escritos, liberados): los registros de esos archivos, con su estado anterior
+    """
+    miembros = trabajos.subidas_sin_confirmar(db, lote_id)
+    if not miembros:
+        return [], []
+
+    indices = indices_escritos(db, [miembro["subida"] for miembro in miembros])
+    escritos = [miembro for indice, miembro in enumerate(miembros) if indice in indices]
+    liberados = [miembro for indice, miembro in enumerate(miembros) if indice not in indices]
+    trabajos.reclasificar_miembros(db, lote_id, escritos, trabajos.INSERTADO)
+
+    for miembro in liberados:
+        # Primero se borra la anotación: si el proceso muere entre medias la referencia
+        # queda de más, pero nunca se libera dos veces
+        trabajos.reclasificar_miembros(db, lote_id, [miembro], trabajos.ERROR, "El documento no llegó a escribirse")
+        almacenamiento.eliminar_contenido(db, miembro["subida"])
+    return escritos, liberados
+
+
+def procesar_archivo_desde_zip(archivo_nombre, flujo, ci, metadatos_ci, config, tamaño=None):
+    """
+    Procesa un archivo desde ZIP y copia su contenido, por bloques, al almacenamiento de archivos.
+    Si el mismo contenido ya estaba almacenado se reutiliza (deduplicación por SHA-256).
+    `tamaño` es el del manifiesto (ver almacenamiento.guardar_deduplicado)
+    """
+    try:
+        # Determinar tipo de archivo
+        tipo_archivo = tipo_desde_extension(archivo_nombre)
+
+        # Generar título automático si no está en metadatos
+        titulo = metadatos_ci.get('titulo')
+        if not titulo:
+            nombre_archivo = Path(archivo_nombre).stem
+            titulo = f"{nombre_archivo} - {metadatos_ci['nombre']}"
+
+        # Procesar etiquetas
+        etiquetas = []
+        if 'etiquetas' in metadatos_ci and pd.notna(metadatos_ci['etiquetas']):
+            etiquetas = [tag.strip() for tag in str(metadatos_ci['etiquetas']).split(',')]
+
+        # Agregar etiquetas automáticas
+        etiquetas.extend([str(ci), 'carga_zip', 'automático', tipo_archivo])
+
+        # Subir el archivo por bloques; el documento solo guarda la referencia
+        guardado = almacenamiento.guardar_deduplicado(
+            config['db'],
+            config['almacen'],
+            flujo,
+            Path(archivo_nombre).name,
+            {"ci": str(ci), "lote_carga": config.get('lote_id')},
+            tamaño=tamaño
+        )
+
+        documento = {
+            "titulo": titulo,
+            "categoria": metadatos_ci.get('categoria', 'Personal'),
+            "autor": metadatos_ci.get('autor', metadatos_ci['nombre']),
+            "ci": str(ci),
+            "nombre_completo": metadatos_ci['nombre'],
+            "version": metadatos_ci.get('version', '1.0'),
+            "tags": etiquetas,
+            "prioridad": metadatos_ci.get('prioridad', 'Media'),
+            "tipo": tipo_archivo,
+            "nombre_archivo": Path(archivo_nombre).name,
+            "blob_id": guardado["blob_id"],
+            "tamaño_bytes": guardado["tamaño_bytes"],
+            "tamaño_almacenado": guardado["tamaño_almacenado"],
+            "compresion": guardado["compresion"],
+            "sha256": guardado["sha256"],
+            "ruta_origen_zip": f"zip://{archivo_nombre}",
+            "fecha_creacion": datetime.utcnow(),
+            "fecha_actualizacion": datetime.utcnow(),
+            "usuario_creacion": config['usuario'],
+            "usuario_actualizacion": config['usuario'],
+            "procesado_desde_zip": True,
+            "lote_carga": config.get('lote_id'),
+            "almacenamiento": guardado["almacenamiento"]
+        }
+
+        return documento, None
+
+    except Exception as e:
+        return None, f"Error procesando {archivo_nombre}: {str(e)}"
+
+
+class EstadoCarga:
+    """Contadores de una carga desde ZIP, compartidos por los hilos del pipeline"""
+
+    def __init__(self, total):
+        self.total = total
+        self.procesados = 0
+        self.insertados = 0
+        self.reemplazados = 0
+        self.duplicados = 0
+        self.sin_ci = 0
+        self.fallidos = 0
+        self.bytes = 0
+        self.cis_encontrados = set()
+        self.errores = []
+        self.inicio = time.monotonic()
+        self._lock = threading.Lock()
+
+    def sumar(self, **valores):
+        with self._lock:
+            for campo, valor in valores.items():
+                setattr(self, campo, getattr(self, campo) + valor)
+
+    def registrar_error(self, error):
+        with self._lock:
+            self.errores.append(error)
+
+    @property
+    def exitosos(self):
+        return self.insertados + self.reemplazados
+
+    def velocidad(self):
+        """Devuelve (archivos/s, MB/s) desde el inicio de la carga"""
+        segundos = max(time.monotonic() - self.inicio, 1e-6)
+        return self.procesados / segundos, self.bytes / (1024 * 1024) / segundos
+
+
+def ejecutar_carga(db, archivo_zip, archivos, mapeo_metadatos, extraer_ci, config,
+                   tamaño_lote=100, sobrescribir=False, hilos_lectura=4, hilos_escritura=2,
+                   al_progresar=None, registrar_miembros=None, registrar_subidas=None):
+    """
+    Carga los archivos del manifiesto en un pipeline de tres etapas que se solapan:
+
+    1. Hilo principal: por lote, extrae el CI, busca los metadatos y descarta
+       duplicados con una sola consulta.
+    2. `hilos_lectura` hilos: descomprimen cada archivo, calculan su SHA-256 y
+       lo suben al almacenamiento.
+    3. `hilos_escritura` hilos: escriben los lotes con bulk_write. Se alimentan de
+       una cola acotada, así que la lectura se frena si la escritura se atrasa.
+
+    `al_progresar(estado)` se llama siempre desde el hilo que invoca esta función.
+    `registrar_miembros(resultados, conservar_subidas=False)` recibe, desde cualquier
+    hilo, tuplas (nombre en el ZIP, estado, error) de los archivos ya escritos o
+    descartados; es el punto de control que permite reanudar la carga (ver trabajos.py).
+    `registrar_subidas(subidas)` recibe tuplas (nombre en el ZIP, documento) en cuanto
+    se suben sus archivos, para conciliarlas al reanudar si el lote no llega a su
+    punto de control (ver conciliar_subidas). Los archivos que sobran tras escribir
+    un lote se liberan después de su punto de control, nunca antes.
+    Devuelve el EstadoCarga final
+    """
+    estado = EstadoCarga(len(archivos))
+    config = {**config, 'db': db}
+    cola_lotes = queue.Queue(maxsize=hilos_escritura * 2)
+    claves_cargadas = set()
+
+    def notificar():
+        if al_progresar:
+            al_progresar(estado)
+
+    def punto_de_control(resultados, conservar_subidas=False):
+        if registrar_miembros and resultados:
+            registrar_miembros(resultados, conservar_subidas=conservar_subidas)
+
+    def anotar_subidas(subidas):
+        if registrar_subidas and subidas:
+            registrar_subidas(subidas)
+
+    def escritor():
+        while True:
+            elemento = cola_lotes.get()
+            if elemento is None:
+                return
+            lote, nombres = elemento
+            try:
+                with rendimiento.medir("carga.escritura_lote"):
+                    escritura = escribir_lote(db, lote, sobrescribir, liberar=False)
+            except Exception as e:
+                # No se sabe qué llegó a escribirse: no se libera ningún archivo (un documento
+                # escrito se quedaría sin él) y el lote queda con error para reintentarlo al reanudar,
+                # con sus subidas anotadas para conciliarlas entonces
+                error = f"Error escribiendo lote: {e}"
+                estado.registrar_error(error)
+                estado.sumar(fallidos=len(lote), procesados=len(lote))
+                try:
+                    punto_de_control([(nombre, trabajos.ERROR, error) for nombre in nombres], conservar_subidas=True)
+                except Exception as e:
+                    estado.registrar_error(f"Error guardando el punto de control: {e}")
+                continue
+
+            for error in escritura["errores"]:
+                estado.registrar_error(error)
+            estado.sumar(
+                insertados=escritura["insertados"],
+                reemplazados=escritura["reemplazados"],
+                duplicados=escritura["duplicados"],
+                fallidos=escritura["fallidos"],
+                procesados=len(lote)
+            )
+            resultados = [
+                (nombre, estado_miembro, error)
+                for nombre, (estado_miembro, error) in zip(nombres, escritura["estados"])
+            ]
+            try:
+                punto_de_control(resultados)
+            except Exception as e:
+                # Sin punto de control las subidas siguen anotadas y se concilian al reanudar:
+                # liberar ahora sus archivos haría que se liberaran dos veces
+                estado.registrar_error(f"Error guardando el punto de control: {e}")
+                continue
+            for error in liberar_archivos(db, escritura["por_liberar"]):
+                estado.registrar_error(error)
+
+    escritores = [threading.Thread(target=escritor, daemon=True) for _ in range(hilos_escritura)]
+    for hilo in escritores:
+        hilo.start()
+
+    try:
+        with abrir_origen(archivo_zip) as abrir, ThreadPoolExecutor(max_workers=hilos_lectura) as lectores:
+
+            tamaños = {entrada["nombre"]: entrada.get("tamaño") for entrada in archivos}
+
+            def leer_y_subir(archivo_nombre, ci, metadatos_ci):
+                with rendimiento.medir("carga.lectura_y_subida"), abrir(archivo_nombre) as flujo:
+                    return procesar_archivo_desde_zip(
+                        archivo_nombre, flujo, ci, metadatos_ci, config, tamaños.get(archivo_nombre)
+                    )
+
+            for i in range(0, len(archivos), tamaño_lote):
+                lote_actual = archivos[i:i + tamaño_lote]
+
+                # Etapa 1: CI, metadatos y duplicados
+                with rendimiento.medir("carga.ci_y_duplicados"):
+                    candidatos = []
+                    descartados = []
+                    for entrada in lote_actual:
+                        archivo_nombre = entrada["nombre"]
+                        ci = extraer_ci(archivo_nombre)
+                        metadatos_ci = mapeo_metadatos.get(ci) if ci else None
+                        if not metadatos_ci:
+                            estado.sumar(sin_ci=1)
+                            descartados.append((archivo_nombre, trabajos.SIN_CI, None))
+                            continue
+
+                        estado.cis_encontrados.add(ci)
+                        clave = (ci, Path(archivo_nombre).name)
+                        if clave in claves_cargadas:
+                            # El mismo archivo aparece varias veces en el ZIP
+                            estado.sumar(duplicados=1)
+                            descartados.append((archivo_nombre, trabajos.DUPLICADO, None))
+                            continue
+                        claves_cargadas.add(clave)
+                        candidatos.append((archivo_nombre, ci, metadatos_ci, clave))
+
+                    if not sobrescribir and candidatos:
+                        existentes = claves_existentes(db, [clave for *_, clave in candidatos])
+                        omitidos = [candidato[0] for candidato in candidatos if candidato[3] in existentes]
+                        estado.sumar(duplicados=len(omitidos))
+                        descartados.extend((archivo_nombre, trabajos.DUPLICADO, None) for archivo_nombre in omitidos)
+                        candidatos = [candidato for candidato in candidatos if candidato[3] not in existentes]
+                    estado.sumar(procesados=len(descartados))
+
+                # Etapa 2: lectura, hash y subida en paralelo
+                nombres_por_futuro = {
+                    lectores.submit(leer_y_subir, archivo_nombre, ci, metadatos_ci): archivo_nombre
+                    for archivo_nombre, ci, metadatos_ci, _ in candidatos
+                }
+                pendientes = set(nombres_por_futuro)
+                documentos = []
+                nombres = []
+                while pendientes:
+                    terminados, pendientes = wait(pendientes, timeout=0.5, return_when=FIRST_COMPLETED)
+                    subidas = []
+                    for futuro in terminados:
+                        documento, error = futuro.result()
+                        if error:
+                            estado.registrar_error(error)
+                            estado.sumar(fallidos=1, procesados=1)
+                            descartados.append((nombres_por_futuro[futuro], trabajos.ERROR, error))
+                        else:
+                            subidas.append((nombres_por_futuro[futuro], documento))
+                    try:
+                        anotar_subidas(subidas)
+                    except Exception as e:
+                        # Sin anotar no se podrían conciliar al reanudar: se liberan ya
+                        error = f"Error anotando los archivos subidos: {e}"
+                        estado.registrar_error(error)
+                        for error_liberar in liberar_archivos(db, [documento for _, documento in subidas]):
+                            estado.registrar_error(error_liberar)
+                        estado.sumar(fallidos=len(subidas), procesados=len(subidas))
+                        descartados.extend((nombre, trabajos.ERROR, error) for nombre, _ in subidas)
+                        subidas = []
+                    for nombre, documento in subidas:
+                        documentos.append(documento)
+                        nombres.append(nombre)
+                        estado.sumar(bytes=documento["tamaño_bytes"])
+                    notificar()
+                punto_de_control(descartados)
+
+                # Etapa 3: la cola acotada bloquea aquí si los escritores van atrasados
+                if documentos:
+                    while True:
+                        try:
+                            cola_lotes.put((documentos, nombres), timeout=0.5)
+                            break
+                        except queue.Full:
+                            notificar()
+                notificar()
+    finally:
+        for _ in escritores:
+            cola_lotes.put(None)
+        for hilo in escritores:
+            while hilo.is_alive():
+                hilo.join(timeout=0.5)
+                notificar()
+
+    notificar()
+    return estado
+
+
+# Acciones del plan de una carga (ver planificar_carga)
+INSERTAR = "insertar"
+REEMPLAZAR = "reemplazar"
+DUPLICADO_EN_ZIP = "duplicado_en_zip"
+DUPLICADO_EN_BD = "duplicado_en_bd"
+SIN_CI = "sin_ci"
+SIN_METADATOS = "sin_metadatos"
+
+
+def planificar_carga(db, manifiesto, tipos_archivo, max_documentos, mapeo_metadatos, extractor, sobrescribir=False):
+    """
+    Simula una carga sin leer ningún archivo ni escribir nada: decide qué pasaría
+    con cada archivo con las mismas reglas que ejecutar_carga, a partir del
+    manifiesto y de una sola consulta a `documentos`.
+
+    El crecimiento del almacenamiento es una estimación: se toma el tamaño
+    comprimido dentro del ZIP como aproximación del que ocupará comprimido y los
+    archivos repetidos dentro del ZIP (mismo CRC y tamaño) cuentan una sola vez;
+    la deduplicación contra lo ya almacenado solo se conoce al calcular el SHA-256.
+    Devuelve (lista de filas del plan, resumen)
+    """
+    inicio = time.monotonic()
+    rendimiento.contar("carga.planes")
+    archivos = filtrar_manifiesto(manifiesto, tipos_archivo, max_documentos)
+    cis_por_archivo, _ = extractor.extraer_lote(entrada["nombre"] for entrada in archivos)
+
+    filas = []
+    claves_cargadas = set()
+    for entrada in archivos:
+        archivo_nombre = entrada["nombre"]
+        ci = cis_por_archivo.get(archivo_nombre)
+        fila = {"archivo": archivo_nombre, "ci": ci, "tamaño": entrada["tamaño"], "accion": None}
+        if ci is None:
+            fila["accion"] = SIN_CI
+        elif ci not in mapeo_metadatos:
+            fila["accion"] = SIN_METADATOS
+        else:
+            clave = (ci, Path(archivo_nombre).name)
+            if clave in claves_cargadas:
+                fila["accion"] = DUPLICADO_EN_ZIP
+            else:
+                claves_cargadas.add(clave)
+                fila["clave"] = clave
+        filas.append(fila)
+
+    existentes = claves_existentes(db, list(claves_cargadas))
+    comprimir = compresion.codec_disponible() is not None
+    contenidos = set()
+    crecimiento = 0
+    for fila, entrada in zip(filas, archivos):
+        clave = fila.pop("clave", None)
+        if clave is None:
+            continue
+        if clave in existentes:
+            fila["accion"] = REEMPLAZAR if sobrescribir else DUPLICADO_EN_BD
+            if not sobrescribir:
+                continue
+        else:
+            fila["accion"] = INSERTAR
+        contenido = (entrada["crc"], entrada["tamaño"]) if entrada["crc"] is not None else entrada["nombre"]
+        if contenido not in contenidos:
+            contenidos.add(contenido)
+            if comprimir and entrada["tamaño"] >= compresion.TAMAÑO_MINIMO:
+                crecimiento += min(entrada["tamaño"], entrada["tamaño_comprimido"])
+            else:
+                crecimiento += entrada["tamaño"]
+
+    por_accion = {accion: {"archivos": 0, "bytes": 0} for accion in (INSERTAR, REEMPLAZAR, DUPLICADO_EN_ZIP, DUPLICADO_EN_BD, SIN_CI, SIN_METADATOS)}
+    for fila in filas:
+        por_accion[fila["accion"]]["archivos"] += 1
+        por_accion[fila["accion"]]["bytes"] += fila["tamaño"]
+
+    cis_con_archivo = set(cis_por_archivo.values())
+    resumen = {
+        "total_archivos": len(filas),
+        "bytes_totales": sum(fila["tamaño"] for fila in filas),
+        "por_accion": por_accion,
+        "bytes_a_cargar": por_accion[INSERTAR]["bytes"] + por_accion[REEMPLAZAR]["bytes"],
+        "crecimiento_estimado": crecimiento,
+        "cis_distintos": len(cis_con_archivo),
+        "cis_sin_metadatos": sorted(ci for ci in cis_con_archivo if ci not in mapeo_metadatos),
+        "cis_csv_sin_archivos": sorted(ci for ci in mapeo_metadatos.cis() if ci not in cis_con_archivo),
+        "segundos": round(time.monotonic() - inicio, 2)
+    }
+    return filas, resumen
+
+
+def plan_a_csv(filas):
+    """Plan de carga como CSV (bytes UTF-8 con BOM, para abrirlo en Excel)"""
+    return pd.DataFrame(filas, columns=["archivo", "ci", "tamaño", "accion"]).to_csv(index=False).encode('utf-8-sig')
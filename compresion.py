@@ -0,0 +1,168 @@
+"""
+Compresión transparente de los archivos almacenados.
+
+El códec se elige mirando el primer bloque del archivo: los formatos que ya
+vienen comprimidos (JPEG, PNG, DOCX/ZIP, ...) se guardan tal cual, y el resto
+solo se comprime si una prueba rápida sobre ese bloque ahorra espacio.
+Se usa zstd (el paquete `zstandard` está en requirements.txt: todos los
+procesos que leen los archivos, aplicación, ejecutores y CLI, deben poder
+descomprimirlos) y zlib si falta el paquete o se configura así.
+"""
+import os
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ZSTD = "zstd"
+ZLIB = "zlib"
+
+# "auto" usa zstd si está disponible; "ninguna" desactiva la compresión
+CODEC_CONFIGURADO = os.environ.get("DOCS_COMPRESION", "auto")
+
+# Firmas de formatos que ya están comprimidos
+FIRMAS_COMPRIMIDAS = (
+    b"\xff\xd8\xff",          # JPEG
+    b"\x89PNG\r\n\x1a\n",     # PNG
+    b"GIF8",                  # GIF
+    b"PK\x03\x04",            # ZIP, DOCX, XLSX, PPTX
+    b"\x1f\x8b",              # GZIP
+    b"\x28\xb5\x2f\xfd",      # ZSTD
+    b"7z\xbc\xaf\x27\x1c",    # 7-Zip
+    b"Rar!",                  # RAR
+    b"BZh",                   # BZIP2
+)
+
+# Por debajo de este tamaño no compensa comprimir
+TAMAÑO_MINIMO = 1024
+# Se comprime solo si la prueba sobre el primer bloque reduce al menos un 10%
+RATIO_MAXIMO = 0.9
+TAMAÑO_MUESTRA = 256 * 1024
+
+
+def codec_disponible():
+    """Códec a usar para los archivos comprimibles según la configuración"""
+    if CODEC_CONFIGURADO == "ninguna":
+        return None
+    if CODEC_CONFIGURADO == ZLIB or zstandard is None:
+        return ZLIB
+    return ZSTD
+
+
+def elegir_codec(primer_bloque):
+    """Decide, a partir del primer bloque del archivo, con qué códec guardarlo (None = sin comprimir)"""
+    codec = codec_disponible()
+    if codec is None or len(primer_bloque) < TAMAÑO_MINIMO:
+        return None
+    if primer_bloque.startswith(FIRMAS_COMPRIMIDAS):
+        return None
+
+    muestra = primer_bloque[:TAMAÑO_MUESTRA]
+    if len(zlib.compress(muestra, 1)) > len(muestra) * RATIO_MAXIMO:
+        return None
+    return codec
+
+
+def _nuevo_compresor(codec):
+    if codec == ZSTD:
+        return zstandard.ZstdCompressor(level=3).compressobj()
+    return zlib.compressobj(6)
+
+
+class FlujoComprimido:
+    """File-like de solo lectura que devuelve comprimido lo que lee de `origen`"""
+
+    def __init__(self, primer_bloque, origen, codec, tamaño_chunk):
+        self._pendiente = primer_bloque
+        self._origen = origen
+        self._compresor = _nuevo_compresor(codec)
+        self._tamaño_chunk = tamaño_chunk
+        self._buffer = b""
+        self._fin = False
+
+    def _siguiente_bloque(self):
+        if self._pendiente:
+            bloque, self._pendiente = self._pendiente, b""
+            return bloque
+        return self._origen.read(self._tamaño_chunk)
+
+    def read(self, tamaño=-1):
+        while not self._fin and (tamaño < 0 or len(self._buffer) < tamaño):
+            bloque = self._siguiente_bloque()
+            if bloque:
+                self._buffer += self._compresor.compress(bloque)
+            else:
+                self._buffer += self._compresor.flush()
+                self._fin = True
+
+        if tamaño < 0:
+            datos, self._buffer = self._buffer, b""
+        else:
+            datos, self._buffer = self._buffer[:tamaño], self._buffer[tamaño:]
+        return datos
+
+
+class FlujoConPrefijo:
+    """File-like que devuelve primero `prefijo` y después el resto de `origen`"""
+
+    def __init__(self, prefijo, origen):
+        self._prefijo = prefijo
+        self._origen = origen
+
+    def read(self, tamaño=-1):
+        if not self._prefijo:
+            return self._origen.read(tamaño)
+        if tamaño < 0:
+            datos, self._prefijo = self._prefijo + self._origen.read(), b""
+        else:
+            datos, self._prefijo = self._prefijo[:tamaño], self._prefijo[tamaño:]
+        return datos
+
+
+class FlujoDescomprimido:
+    """File-like que descomprime al vuelo un archivo almacenado con `codec`"""
+
+    def __init__(self, origen, codec, tamaño_chunk):
+        self._origen = origen
+        self._tamaño_chunk = tamaño_chunk
+        self._lector_zstd = None
+        if codec == ZSTD:
+            if zstandard is None:
+                raise RuntimeError("El archivo está comprimido con zstd y falta el paquete 'zstandard'")
+            self._lector_zstd = zstandard.ZstdDecompressor().stream_reader(origen)
+        self._descompresor = zlib.decompressobj()
+        self._fin = False
+
+    def read(self, tamaño=-1):
+        if self._lector_zstd is not None:
+            return self._lector_zstd.read(tamaño)
+
+        if tamaño < 0:
+            partes = []
+            while True:
+                parte = self.read(self._tamaño_chunk)
+                if not parte:
+                    return b"".join(partes)
+                partes.append(parte)
+
+        # Limitar lo que se descomprime de una vez para no disparar la memoria
+        while not self._fin:
+            comprimido = self._descompresor.unconsumed_tail or self._origen.read(self._tamaño_chunk)
+            if not comprimido:
+                self._fin = True
+                return self._descompresor.flush()
+            datos = self._descompresor.decompress(comprimido, tamaño)
+            if datos:
+                return datos
+        return b""
+
+    def close(self):
+        self._origen.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
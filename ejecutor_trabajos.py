@@ -0,0 +1,484 @@
+"""
+Ejecución de las cargas desde ZIP fuera del script de Streamlit.
+
+La aplicación solo copia el ZIP y el CSV de metadatos a DIRECTORIO_TRABAJOS y
+encola el trabajo en `trabajos_carga`; la carga la hace un EjecutorTrabajos,
+así que sigue aunque el usuario cambie de pestaña, pulse otros botones o cierre
+el navegador. Hay un ejecutor dentro del propio proceso de Streamlit (EJECUTOR)
+y se pueden lanzar más como procesos aparte, que comparten la misma cola
+(deben ver el mismo DIRECTORIO_TRABAJOS que la aplicación):
+
+    python ejecutor_trabajos.py trabajar --uri "mongodb+srv://..." [--concurrencia 2] [--una-vez]
+
+Una carga también se puede ejecutar directamente, sin navegador ni cola (p. ej.
+desde cron), a partir de un ZIP en disco o de un directorio:
+
+    python ejecutor_trabajos.py cargar documentos.zip --metadatos metadatos.csv --uri "mongodb+srv://..."
+        [--patron "CI al inicio"] [--tipos .pdf,.docx] [--tamaño-lote 100] [--reanudar LOTE]
+
+El progreso sale por stderr y el resumen final, en JSON, por stdout. El código
+de salida es 0 si todo se cargó, 1 si algún archivo falló y 2 si los
+parámetros no son válidos.
+"""
+import argparse
+import getpass
+import json
+import os
+import re
+import shutil
+import socket
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+
+from pymongo.errors import PyMongoError
+
+import almacenamiento
+import carga_zip
+import trabajos
+from base_datos import NOMBRE_BD, REGISTRO_CLIENTES, asegurar_indices
+from extraccion_ci import obtener_extractor
+
+DIRECTORIO_TRABAJOS = os.environ.get("DOCS_DIRECTORIO_TRABAJOS", "trabajos_pendientes")
+# Trabajos que se ejecutan a la vez en cada proceso
+CONCURRENCIA = int(os.environ.get("DOCS_TRABAJOS_CONCURRENTES", 2))
+# Segundos entre consultas a la cola y entre actualizaciones del progreso
+INTERVALO_SONDEO = 2
+INTERVALO_PROGRESO = 2
+
+# Identificador de sesión con el que el ejecutor usa el registro de clientes
+SESION_EJECUTOR = "ejecutor_trabajos"
+
+
+def preparar_archivos(lote_id, archivo_zip, df_metadatos, directorio=None):
+    """
+    Copia el ZIP (por bloques) y los metadatos a `directorio` para que el
+    ejecutor los lea aunque la sesión que los subió ya no exista.
+    Devuelve el dict de rutas que se guarda en el trabajo
+    """
+    destino = Path(directorio or DIRECTORIO_TRABAJOS)
+    destino.mkdir(parents=True, exist_ok=True)
+
+    ruta_zip = destino / f"{lote_id}.zip"
+    archivo_zip.seek(0)
+    with open(ruta_zip, "wb") as salida:
+        shutil.copyfileobj(archivo_zip, salida, almacenamiento.TAMAÑO_CHUNK)
+
+    ruta_metadatos = destino / f"{lote_id}.csv"
+    df_metadatos.to_csv(ruta_metadatos, index=False)
+
+    return {"origen": str(ruta_zip), "metadatos": str(ruta_metadatos)}
+
+
+def eliminar_archivos(trabajo):
+    """Borra las copias del ZIP y los metadatos (nunca los archivos originales de una carga por comando)"""
+    if not trabajo.get("archivos_temporales", True):
+        return
+    for ruta in (trabajo.get("archivos") or {}).values():
+        try:
+            os.remove(ruta)
+        except FileNotFoundError:
+            pass
+
+
+def descartar_trabajo(db, lote_id):
+    """
+    Descarta una carga sin terminar: borra el trabajo, libera los archivos subidos
+    que no llegaron a tener documento, y borra el estado de sus archivos y las copias
+    del ZIP y los metadatos. Devuelve False si no se puede (está en curso o ya terminó)
+    """
+    trabajo = trabajos.descartar_trabajo(db, lote_id)
+    if trabajo is None:
+        return False
+    carga_zip.conciliar_subidas(db, lote_id)
+    trabajos.borrar_miembros(db, lote_id)
+    eliminar_archivos(trabajo)
+    return True
+
+
+def ejecutar_trabajo(db, trabajo, al_progresar=None):
+    """
+    Ejecuta (o continúa) un trabajo ya reclamado. Salta los archivos que una
+    ejecución anterior dejó terminados y guarda el progreso en el propio trabajo.
+    `al_progresar(estado)` se llama además en cada actualización del progreso.
+    Devuelve el EstadoCarga de esta ejecución, o None si no pudo empezar
+    """
+    lote_id = trabajo["_id"]
+    parametros = trabajo["parametros"]
+
+    try:
+        manifiesto = carga_zip.leer_manifiesto(trabajo["archivos"]["origen"])
+        archivos = carga_zip.filtrar_manifiesto(manifiesto, parametros["tipos_archivo"], parametros["max_documentos"])
+        df_metadatos = carga_zip.leer_metadatos(trabajo["archivos"]["metadatos"])
+        mapeo_metadatos = carga_zip.mapear_metadatos(df_metadatos)
+
+        # Primero se concilian las subidas: preparar_reintento rehace los contadores con el resultado
+        carga_zip.conciliar_subidas(db, lote_id)
+        trabajos.preparar_reintento(db, lote_id)
+        terminados = trabajos.miembros_terminados(db, lote_id)
+        pendientes = [entrada for entrada in archivos if entrada["nombre"] not in terminados]
+        # CI de todos los archivos pendientes en una sola pasada
+        extractor = obtener_extractor(
+            parametros["patron_busqueda"],
+            tuple(parametros.get("patrones_usuario", [])),
+            parametros.get("validar_cedula", False)
+        )
+        cis_por_archivo, _ = extractor.extraer_lote(entrada["nombre"] for entrada in pendientes)
+        db.trabajos_carga.update_one({"_id": lote_id}, {"$set": {"total": len(archivos)}})
+
+        config = {
+            'lote_id': lote_id,
+            'almacen': almacenamiento.obtener_almacen(db),
+            'usuario': trabajo["usuario"]
+        }
+        ultima_actualizacion = [0.0]
+
+        def guardar_progreso(estado, forzar=False):
+            ahora = time.monotonic()
+            if not forzar and ahora - ultima_actualizacion[0] < INTERVALO_PROGRESO:
+                return
+            ultima_actualizacion[0] = ahora
+            archivos_por_segundo, mb_por_segundo = estado.velocidad()
+            trabajos.actualizar_progreso(
+                db, lote_id,
+                omitidos=len(terminados),
+                procesados=estado.procesados,
+                pendientes=estado.total,
+                cis_encontrados=len(estado.cis_encontrados),
+                archivos_por_segundo=archivos_por_segundo,
+                mb_por_segundo=mb_por_segundo
+            )
+            if al_progresar:
+                al_progresar(estado)
+
+        estado = carga_zip.ejecutar_carga(
+            db,
+            trabajo["archivos"]["origen"],
+            pendientes,
+            mapeo_metadatos,
+            cis_por_archivo.get,
+            config,
+            tamaño_lote=parametros["tamaño_lote"],
+            sobrescribir=parametros["sobrescribir"],
+            hilos_lectura=parametros.get("hilos_lectura", 4),
+            hilos_escritura=parametros.get("hilos_escritura", 2),
+            al_progresar=guardar_progreso,
+            registrar_miembros=lambda resultados, **opciones: trabajos.registrar_miembros(db, lote_id, resultados, **opciones),
+            registrar_subidas=lambda subidas: trabajos.registrar_subidas(db, lote_id, subidas)
+        )
+        # Lotes que no llegaron a su punto de control (p. ej. se cortó la conexión al guardarlo).
+        # Los de lotes cuya escritura falló ya se contaron como fallidos: los que sí se
+        # escribieron dejan de serlo antes de decidir cómo termina el trabajo
+        escritos, _ = carga_zip.conciliar_subidas(db, lote_id)
+        recuperados = sum(1 for miembro in escritos if miembro["estado"] == trabajos.ERROR)
+        estado.sumar(insertados=recuperados, fallidos=-recuperados)
+        guardar_progreso(estado, forzar=True)
+
+    except Exception as e:
+        trabajos.finalizar_trabajo(db, lote_id, trabajos.FALLIDO, str(e))
+        return None
+
+    # Si quedaron archivos con error el trabajo sigue disponible para reintentarlos
+    if estado.fallidos:
+        trabajos.finalizar_trabajo(db, lote_id, trabajos.FALLIDO, errores=estado.errores[:20])
+    else:
+        trabajos.finalizar_trabajo(db, lote_id, trabajos.COMPLETADO, errores=estado.errores[:20])
+        eliminar_archivos(trabajo)
+    return estado
+
+
+class EjecutorTrabajos:
+    """
+    Atiende la cola `trabajos_carga` de una o varias bases de datos en un hilo
+    propio y ejecuta hasta `concurrencia` trabajos a la vez, cada uno en su hilo.
+    Cuando la cola de una base de datos se vacía y no le queda ningún trabajo en
+    curso, deja de atenderla y libera su cliente (ver base_datos.RegistroClientes):
+    la aplicación vuelve a llamar a `iniciar` al conectarse o al encolar una carga
+    """
+
+    def __init__(self, concurrencia=CONCURRENCIA, intervalo=INTERVALO_SONDEO):
+        self.concurrencia = concurrencia
+        self.intervalo = intervalo
+        self.trabajador = f"{socket.gethostname()}:{os.getpid()}"
+        self._uris = set()
+        self._activos = set()
+        # Trabajos en curso por URI: mientras haya alguno, su cliente no se libera
+        self._en_curso = Counter()
+        self._lock = threading.Lock()
+        self._hilo = None
+        self._detener = threading.Event()
+
+    def iniciar(self, uri):
+        """Empieza a atender la cola de la base de datos de `uri` (se puede llamar varias veces)"""
+        with self._lock:
+            self._uris.add(uri)
+            if self._hilo is None or not self._hilo.is_alive():
+                self._detener.clear()
+                self._hilo = threading.Thread(target=self._bucle, name="ejecutor_trabajos", daemon=True)
+                self._hilo.start()
+
+    def detener(self):
+        """Deja de reclamar trabajos; los que están en curso terminan igualmente"""
+        self._detener.set()
+
+    def activos(self):
+        with self._lock:
+            return sorted(self._activos)
+
+    def _bucle(self):
+        while not self._detener.is_set():
+            for uri in list(self._uris):
+                try:
+                    cola_vacia = self._atender(uri)
+                except PyMongoError as e:
+                    print(f"Error consultando la cola de trabajos: {e}", file=sys.stderr)
+                    continue
+                if cola_vacia:
+                    self._soltar(uri)
+            with self._lock:
+                # Sin nada que atender el hilo termina; `iniciar` lo vuelve a arrancar
+                if not self._uris:
+                    self._hilo = None
+                    return
+            self._detener.wait(self.intervalo)
+
+    def _atender(self, uri):
+        """
+        Reclama trabajos de `uri` mientras haya hueco. Devuelve True si su cola está
+        vacía: ni pendientes ni en curso, que pueden ser interrumpidos por reclamar
+        """
+        # Pedir el cliente en cada vuelta lo mantiene abierto en el registro mientras se atiende la URI
+        db = REGISTRO_CLIENTES.obtener(uri, SESION_EJECUTOR)[NOMBRE_BD]
+        while not self._detener.is_set():
+            # Reclamar con el lock tomado: `activos()` nunca ve un trabajo reclamado sin registrar
+            with self._lock:
+                if len(self._activos) >= self.concurrencia:
+                    return False
+                trabajo = trabajos.reclamar_trabajo(db, self.trabajador)
+                if trabajo is None:
+                    return not trabajos.hay_trabajos_abiertos(db)
+                self._activos.add(trabajo["_id"])
+                self._en_curso[uri] += 1
+            threading.Thread(target=self._ejecutar, args=(uri, db, trabajo), daemon=True).start()
+        return False
+
+    def _soltar(self, uri):
+        """Deja de atender `uri` y libera su cliente, salvo que tenga trabajos en curso"""
+        with self._lock:
+            if self._en_curso[uri]:
+                return
+            self._uris.discard(uri)
+        REGISTRO_CLIENTES.liberar(uri, SESION_EJECUTOR)
+
+    def _ejecutar(self, uri, db, trabajo):
+        try:
+            ejecutar_trabajo(db, trabajo)
+        finally:
+            with self._lock:
+                self._activos.discard(trabajo["_id"])
+                self._en_curso[uri] -= 1
+
+
+# Ejecutor único del proceso de Streamlit
+EJECUTOR = EjecutorTrabajos()
+
+
+def cargar(db, args):
+    """Ejecuta una carga en primer plano (subcomando `cargar`). Devuelve el código de salida"""
+    trabajador = f"cli:{socket.gethostname()}:{os.getpid()}"
+
+    if args.reanudar:
+        trabajo = trabajos.tomar_trabajo(db, args.reanudar, trabajador)
+        if trabajo is None:
+            print(f"No hay ninguna carga sin terminar con id {args.reanudar}", file=sys.stderr)
+            return 2
+    else:
+        df_metadatos = carga_zip.leer_metadatos(args.metadatos)
+        errores = carga_zip.validar_csv_metadatos(df_metadatos)
+        if errores:
+            print(f"CSV de metadatos no válido: {' | '.join(errores)}", file=sys.stderr)
+            return 2
+        problemas = carga_zip.revisar_cis(df_metadatos, args.validar_cedula)
+        if problemas["mal_formados"]:
+            print(f"Aviso: {len(problemas['mal_formados'])} filas con CI mal formado "
+                  "(solo se usan si algún archivo trae ese mismo CI)", file=sys.stderr)
+        if problemas["repetidos"]:
+            print(f"Aviso: {len(problemas['repetidos'])} CI repetidos (se usa la última fila)", file=sys.stderr)
+        if problemas["sin_nombre"]:
+            print(f"Aviso: {len(problemas['sin_nombre'])} filas sin nombre (se ignoran)", file=sys.stderr)
+
+        if args.plan:
+            return simular(db, args, df_metadatos)
+
+        lote_id = f"cli_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+        trabajos.crear_trabajo(
+            db, lote_id, None, Path(args.origen).name,
+            {
+                'tipos_archivo': [tipo.strip().lower() for tipo in args.tipos.split(",") if tipo.strip()],
+                'max_documentos': args.max_documentos,
+                'tamaño_lote': args.tamaño_lote,
+                'patron_busqueda': args.patron,
+                'patrones_usuario': args.patron_extra,
+                'validar_cedula': args.validar_cedula,
+                'sobrescribir': args.sobrescribir,
+                'hilos_lectura': args.hilos_lectura,
+                'hilos_escritura': args.hilos_escritura
+            },
+            args.usuario,
+            {"origen": os.path.abspath(args.origen), "metadatos": os.path.abspath(args.metadatos)},
+            estado=trabajos.EN_CURSO,
+            trabajador=trabajador,
+            temporales=False
+        )
+        trabajo = trabajos.obtener_trabajo(db, lote_id)
+
+    def mostrar_progreso(estado):
+        archivos_por_segundo, mb_por_segundo = estado.velocidad()
+        print(
+            f"[{trabajo['_id']}] {estado.procesados}/{estado.total} | "
+            f"insertados {estado.insertados} | reemplazados {estado.reemplazados} | "
+            f"duplicados {estado.duplicados} | sin CI {estado.sin_ci} | fallidos {estado.fallidos} | "
+            f"{archivos_por_segundo:.1f} archivos/s, {mb_por_segundo:.2f} MB/s",
+            file=sys.stderr,
+            flush=True
+        )
+
+    estado = ejecutar_trabajo(db, trabajo, al_progresar=mostrar_progreso)
+
+    final = trabajos.obtener_trabajo(db, trabajo["_id"])
+    resumen = {
+        "lote_carga": final["_id"],
+        "estado": final["estado"],
+        "error": final.get("error"),
+        "total": final.get("total"),
+        "contadores": final["contadores"],
+        "errores": final.get("errores", [])
+    }
+    if estado is not None:
+        archivos_por_segundo, mb_por_segundo = estado.velocidad()
+        resumen["ejecucion"] = {
+            "procesados": estado.procesados,
+            "insertados": estado.insertados,
+            "reemplazados": estado.reemplazados,
+            "duplicados": estado.duplicados,
+            "sin_ci": estado.sin_ci,
+            "fallidos": estado.fallidos,
+            "omitidos_por_reanudacion": final.get("progreso", {}).get("omitidos", 0),
+            "cis_encontrados": len(estado.cis_encontrados),
+            "segundos": round(time.monotonic() - estado.inicio, 2),
+            "archivos_por_segundo": round(archivos_por_segundo, 2),
+            "mb_por_segundo": round(mb_por_segundo, 2)
+        }
+    print(json.dumps(resumen, ensure_ascii=False, indent=2, default=str))
+    return 0 if final["estado"] == trabajos.COMPLETADO else 1
+
+
+def simular(db, args, df_metadatos):
+    """Escribe el plan de la carga en CSV y su resumen en JSON, sin cargar nada (opción --plan)"""
+    filas, resumen = carga_zip.planificar_carga(
+        db,
+        carga_zip.leer_manifiesto(args.origen),
+        [tipo.strip().lower() for tipo in args.tipos.split(",") if tipo.strip()],
+        args.max_documentos,
+        carga_zip.mapear_metadatos(df_metadatos),
+        obtener_extractor(args.patron, tuple(args.patron_extra), args.validar_cedula),
+        args.sobrescribir
+    )
+    with open(args.plan, "wb") as archivo:
+        archivo.write(carga_zip.plan_a_csv(filas))
+    print(json.dumps(resumen, ensure_ascii=False, indent=2))
+    return 0
+
+
+def trabajar(args):
+    """Atiende la cola hasta Ctrl+C, o hasta vaciarla con --una-vez (subcomando `trabajar`)"""
+    ejecutor = EjecutorTrabajos(concurrencia=args.concurrencia)
+    ejecutor.iniciar(args.uri)
+    db = REGISTRO_CLIENTES.obtener(args.uri, SESION_EJECUTOR)[NOMBRE_BD]
+
+    try:
+        while True:
+            time.sleep(INTERVALO_SONDEO * 2)
+            activos = ejecutor.activos()
+            if activos:
+                print(f"En curso: {', '.join(activos)}")
+            elif args.una_vez:
+                pendientes = db.trabajos_carga.count_documents({"estado": trabajos.PENDIENTE})
+                if not pendientes and not ejecutor.activos():
+                    break
+    except KeyboardInterrupt:
+        print("Deteniendo: los trabajos en curso quedarán para reanudarse")
+    finally:
+        ejecutor.detener()
+        REGISTRO_CLIENTES.cerrar_todos()
+    return 0
+
+
+def main(argv=None):
+    from dotenv import load_dotenv
+    import pymongo
+
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Cargas masivas desde ZIP sin pasar por el navegador")
+    subparsers = parser.add_subparsers(dest="comando", required=True)
+
+    parser_trabajar = subparsers.add_parser("trabajar", help="Ejecutar las cargas encoladas en MongoDB")
+    parser_trabajar.add_argument("--uri", default=os.environ.get("MONGODB_URI"), help="URI de MongoDB (o variable MONGODB_URI)")
+    parser_trabajar.add_argument("--concurrencia", type=int, default=CONCURRENCIA, help="Trabajos a la vez")
+    parser_trabajar.add_argument("--una-vez", action="store_true", help="Terminar cuando la cola quede vacía")
+
+    parser_cargar = subparsers.add_parser("cargar", help="Cargar un ZIP o un directorio en primer plano")
+    parser_cargar.add_argument("origen", nargs="?", help="Ruta del ZIP o del directorio con los documentos")
+    parser_cargar.add_argument("--metadatos", help="CSV con los metadatos por CI (columnas ci y nombre obligatorias)")
+    parser_cargar.add_argument("--uri", default=os.environ.get("MONGODB_URI"), help="URI de MongoDB (o variable MONGODB_URI)")
+    parser_cargar.add_argument("--patron", choices=carga_zip.PATRONES_CI, default=carga_zip.PATRONES_CI[0], help="Cómo buscar el CI en los nombres de archivo")
+    parser_cargar.add_argument("--patron-extra", action="append", default=[], metavar="REGEX",
+                               help="Patrón adicional para el CI, con un grupo de captura (se puede repetir)")
+    parser_cargar.add_argument("--validar-cedula", action="store_true", help="Aceptar solo cédulas ecuatorianas válidas")
+    parser_cargar.add_argument("--tipos", default=".pdf,.docx,.doc", help="Extensiones a procesar, separadas por comas")
+    parser_cargar.add_argument("--max-documentos", type=int, default=None, help="Máximo de archivos a procesar (por defecto, todos)")
+    parser_cargar.add_argument("--tamaño-lote", type=int, default=100, help="Documentos por escritura en MongoDB")
+    parser_cargar.add_argument("--hilos-lectura", type=int, default=4, help="Archivos que se leen y suben en paralelo")
+    parser_cargar.add_argument("--hilos-escritura", type=int, default=2, help="Lotes que se escriben en paralelo")
+    parser_cargar.add_argument("--sobrescribir", action="store_true", help="Reemplazar los documentos que ya existen")
+    parser_cargar.add_argument("--usuario", default=getpass.getuser(), help="Usuario que figura como creador")
+    parser_cargar.add_argument("--reanudar", metavar="LOTE", help="Continuar una carga interrumpida con sus parámetros originales")
+    parser_cargar.add_argument("--plan", metavar="CSV", help="Solo simular la carga: guardar qué pasaría con cada archivo en este CSV")
+
+    args = parser.parse_args(argv)
+    if not args.uri:
+        parser.error("Falta la URI de MongoDB (--uri o MONGODB_URI)")
+
+    if args.comando == "trabajar":
+        return trabajar(args)
+
+    if not args.reanudar:
+        try:
+            obtener_extractor(args.patron, tuple(args.patron_extra), args.validar_cedula)
+        except re.error as e:
+            parser.error(f"Patrón de CI no válido: {e}")
+        if not args.origen or not args.metadatos:
+            parser.error("Indica el ZIP o directorio de origen y --metadatos (o --reanudar)")
+        if not os.path.exists(args.origen):
+            parser.error(f"No existe el origen: {args.origen}")
+    elif args.plan:
+        parser.error("--plan no se puede combinar con --reanudar")
+
+    client = pymongo.MongoClient(args.uri, serverSelectionTimeoutMS=5000)
+    try:
+        db = client[NOMBRE_BD]
+        errores_indices = asegurar_indices(db)
+        for error in errores_indices:
+            print(f"Aviso: no se pudo crear el índice {error}", file=sys.stderr)
+        return cargar(db, args)
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,145 @@
+"""
+Extracción del CI desde los nombres de archivo.
+
+Cada modo de búsqueda (y los patrones adicionales del usuario) se compila una
+sola vez en una única expresión regular con una alternativa por patrón, cada
+una con su grupo con nombre. Un nombre de archivo se recorre una sola vez: de
+todas las coincidencias se queda la del patrón de mayor prioridad (el orden de
+la lista) y la más a la izquierda, como si se probaran los patrones uno por
+uno, y si se pide solo acepta cédulas ecuatorianas válidas.
+"""
+import re
+from functools import lru_cache
+
+import rendimiento
+
+PATRONES_POR_MODO = {
+    "CI al inicio": [r'^(\d{8,10})'],
+    "CI en cualquier parte": [r'(\d{8,10})'],
+    "CI específico en nombre": [
+        r'CI[_\-\s]*(\d{8,10})',
+        r'(\d{8,10})[_\-\s]',
+        r'cedula[_\-\s]*(\d{8,10})',
+        r'identificacion[_\-\s]*(\d{8,10})'
+    ],
+}
+PATRONES_CI = list(PATRONES_POR_MODO)
+
+# Primer grupo de captura sin nombre (un "(" no escapado que no empieza por "?")
+_GRUPO_SIN_NOMBRE = re.compile(r'(?<!\\)\((?!\?)')
+_GRUPO_CI = re.compile(r'\(\?P<ci>')
+
+# Provincias 01-24 y 30 (ecuatorianos registrados en el exterior)
+PROVINCIAS_VALIDAS = {f"{provincia:02d}" for provincia in range(1, 25)} | {"30"}
+
+
+def es_cedula_valida(ci):
+    """Cédula ecuatoriana: 10 dígitos, provincia válida, tercer dígito < 6 y dígito verificador (módulo 10)"""
+    if len(ci) != 10 or not ci.isdigit() or ci[:2] not in PROVINCIAS_VALIDAS or int(ci[2]) >= 6:
+        return False
+    suma = 0
+    for posicion, digito in enumerate(ci[:9]):
+        producto = int(digito) * (2 if posicion % 2 == 0 else 1)
+        suma += producto - 9 if producto > 9 else producto
+    return (10 - suma % 10) % 10 == int(ci[9])
+
+
+def _nombrar_grupo(patron, nombre):
+    """
+    Da nombre al grupo que captura el CI: el grupo `ci` si lo hay, si no el primer
+    grupo sin nombre y, si no tiene grupos, toda la coincidencia
+    """
+    if _GRUPO_CI.search(patron):
+        return _GRUPO_CI.sub(f'(?P<{nombre}>', patron, count=1)
+    if _GRUPO_SIN_NOMBRE.search(patron):
+        return _GRUPO_SIN_NOMBRE.sub(f'(?P<{nombre}>', patron, count=1)
+    return f'(?P<{nombre}>{patron})'
+
+
+def raiz_nombre(nombre_archivo):
+    """Igual que Path(nombre).stem para las rutas de un ZIP, sin crear objetos Path"""
+    base = nombre_archivo.rpartition('/')[2]
+    punto = base.rfind('.')
+    return base[:punto] if punto > 0 else base
+
+
+class ExtractorCI:
+    """
+    Extrae el CI con los patrones del modo elegido seguidos de `patrones_usuario`.
+    Lanza re.error si algún patrón no es una expresión regular válida
+    """
+
+    def __init__(self, modo, patrones_usuario=(), validar_cedula=False):
+        self.patrones = list(PATRONES_POR_MODO.get(modo, [])) + [patron for patron in patrones_usuario if patron]
+        self.validar_cedula = validar_cedula
+        self._grupos = [f"c{indice}" for indice in range(len(self.patrones))]
+        for patron in patrones_usuario:
+            if patron:
+                re.compile(patron)
+        alternativas = [_nombrar_grupo(patron, grupo) for patron, grupo in zip(self.patrones, self._grupos)]
+        # Dentro de un lookahead las coincidencias pueden solaparse: en cada posición gana el
+        # patrón de mayor prioridad, igual que probando los patrones uno por uno
+        self._regex = None
+        if alternativas:
+            self._regex = re.compile('(?=' + '|'.join(f'(?:{alternativa})' for alternativa in alternativas) + ')', re.IGNORECASE)
+
+    def extraer_con_patron(self, nombre_archivo):
+        """Devuelve (ci, índice del patrón que coincidió, descartado_por_verificador)"""
+        if self._regex is None:
+            return None, None, False
+        mejor = (None, None)
+        descartado = False
+        for coincidencia in self._regex.finditer(raiz_nombre(nombre_archivo)):
+            for indice, grupo in enumerate(self._grupos):
+                ci = coincidencia.group(grupo)
+                if ci is not None:
+                    break
+            if mejor[1] is not None and indice >= mejor[1]:
+                continue
+            if self.validar_cedula and not es_cedula_valida(ci):
+                descartado = True
+                continue
+            mejor = (ci, indice)
+            if indice == 0:
+                break
+        return mejor[0], mejor[1], descartado and mejor[0] is None
+
+    def extraer(self, nombre_archivo):
+        return self.extraer_con_patron(nombre_archivo)[0]
+
+    def extraer_lote(self, nombres_archivo):
+        """
+        Aplica el extractor a todo el manifiesto de una vez.
+        Devuelve (dict nombre -> CI solo de los que tienen CI, estadísticas)
+        """
+        cis = {}
+        por_patron = [0] * len(self.patrones)
+        descartados = 0
+        sin_ci = []
+        with rendimiento.medir("extraccion_ci.lote"):
+            for nombre in nombres_archivo:
+                ci, indice, descartado = self.extraer_con_patron(nombre)
+                if ci is None:
+                    sin_ci.append(nombre)
+                    descartados += descartado
+                    continue
+                cis[nombre] = ci
+                por_patron[indice] += 1
+        rendimiento.contar("extraccion_ci.nombres", len(cis) + len(sin_ci))
+
+        estadisticas = {
+            "total": len(cis) + len(sin_ci),
+            "con_ci": len(cis),
+            "sin_ci": len(sin_ci),
+            "descartados_por_verificador": descartados,
+            "cis_distintos": len(set(cis.values())),
+            "por_patron": dict(zip(self.patrones, por_patron)),
+            "ejemplos_sin_ci": sin_ci[:20]
+        }
+        return cis, estadisticas
+
+
+@lru_cache(maxsize=32)
+def obtener_extractor(modo, patrones_usuario=(), validar_cedula=False):
+    """Extractor compilado y reutilizado para cada combinación de parámetros"""
+    return ExtractorCI(modo, patrones_usuario, validar_cedula)
@@ -0,0 +1,165 @@
+"""
+Operaciones sobre muchos documentos a la vez, seleccionados por filtro.
+
+Los documentos se eligen por lote de carga, CI, rango de fechas, tipo y
+categoría (al menos un criterio: nunca se opera sobre toda la colección).
+Antes de ejecutar se puede ver cuántos documentos y bytes afecta el filtro.
+Cada operación queda registrada en la colección `auditoria`.
+
+- Eliminar: por lotes de `tamaño_lote` documentos, un delete_many por lote, y
+  las referencias a los archivos de cada lote se liberan en bloque.
+- Etiquetar y recategorizar: un único bulk_write con UpdateMany.
+"""
+import time
+from datetime import datetime
+
+from bson import json_util
+from pymongo import UpdateMany
+
+import almacenamiento
+import cambios
+
+ELIMINAR = "eliminar"
+ACTUALIZAR = "actualizar"
+
+
+def construir_filtro(lote_carga=None, ci=None, fecha_desde=None, fecha_hasta=None, tipo=None, categoria=None):
+    """
+    Filtro de MongoDB con los criterios indicados (los vacíos se ignoran).
+    Lanza ValueError si no hay ningún criterio
+    """
+    filtro = {}
+    if lote_carga:
+        filtro["lote_carga"] = lote_carga.strip()
+    if ci:
+        filtro["ci"] = ci.strip()
+    if fecha_desde or fecha_hasta:
+        filtro["fecha_creacion"] = {}
+        if fecha_desde:
+            filtro["fecha_creacion"]["$gte"] = datetime.combine(fecha_desde, datetime.min.time())
+        if fecha_hasta:
+            # Hasta el final del día indicado
+            filtro["fecha_creacion"]["$lte"] = datetime.combine(fecha_hasta, datetime.max.time())
+    if tipo:
+        filtro["tipo"] = tipo
+    if categoria:
+        filtro["categoria"] = categoria
+
+    if not filtro:
+        raise ValueError("Indica al menos un criterio para seleccionar los documentos")
+    return filtro
+
+
+def vista_previa(db, filtro, muestra=10):
+    """Cuántos documentos y bytes selecciona el filtro, con algunos de ejemplo"""
+    totales = next(db.documentos.aggregate([
+        {"$match": filtro},
+        {"$group": {"_id": None, "documentos": {"$sum": 1}, "bytes": {"$sum": {"$ifNull": ["$tamaño_bytes", 0]}}}}
+    ]), None) or {"documentos": 0, "bytes": 0}
+    ejemplos = list(
+        db.documentos.find(filtro, {"titulo": 1, "ci": 1, "nombre_archivo": 1, "lote_carga": 1, "fecha_creacion": 1})
+        .sort([("fecha_creacion", -1), ("_id", -1)])
+        .limit(muestra)
+    )
+    return {"documentos": totales["documentos"], "bytes": totales["bytes"], "ejemplos": ejemplos}
+
+
+def registrar_auditoria(db, operacion, criterios, filtro, usuario, resultado, cambios_aplicados=None):
+    """
+    Guarda una entrada en `auditoria`. El filtro se guarda como JSON extendido
+    (sus claves empiezan por $ y no se pueden guardar tal cual en un documento)
+    """
+    db.auditoria.insert_one({
+        "operacion": operacion,
+        # Las fechas del formulario (date) no se pueden guardar en BSON
+        "criterios": {
+            campo: valor.isoformat() if hasattr(valor, "isoformat") else valor
+            for campo, valor in criterios.items() if valor
+        },
+        "filtro": json_util.dumps(filtro),
+        "cambios": cambios_aplicados or {},
+        "usuario": usuario,
+        "fecha": datetime.utcnow(),
+        **resultado
+    })
+
+
+def eliminar_por_filtro(db, filtro, usuario, criterios=None, tamaño_lote=500, progreso=None):
+    """
+    Elimina los documentos que cumplen el filtro y libera sus archivos.
+    `progreso(eliminados)` se llama después de cada lote. Devuelve el resultado
+    que se registra en la auditoría
+    """
+    inicio = time.monotonic()
+    resultado = {"documentos_afectados": 0, "referencias_no_liberadas": 0, "errores": []}
+    campos = {"almacenamiento": 1, "blob_id": 1, "sha256": 1}
+
+    try:
+        while True:
+            # Siempre el primer lote: los anteriores ya no cumplen el filtro
+            lote = list(db.documentos.find(filtro, campos).limit(tamaño_lote))
+            if not lote:
+                break
+
+            eliminados = db.documentos.delete_many({"_id": {"$in": [doc["_id"] for doc in lote]}}).deleted_count
+            resultado["documentos_afectados"] += eliminados
+            if eliminados == len(lote):
+                resultado["errores"].extend(almacenamiento.liberar_contenidos(db, lote))
+            else:
+                # Otro proceso borró alguno a la vez y no se sabe cuál: mejor dejar
+                # referencias de más (el archivo no se borra) que borrar uno en uso
+                resultado["referencias_no_liberadas"] += len(lote)
+            if progreso:
+                progreso(resultado["documentos_afectados"])
+    except Exception as e:
+        resultado["errores"].append(str(e))
+    finally:
+        cambios.documentos_modificados(db)
+
+    resultado["segundos"] = round(time.monotonic() - inicio, 2)
+    registrar_auditoria(db, ELIMINAR, criterios or {}, filtro, usuario, resultado)
+    return resultado
+
+
+def actualizar_por_filtro(db, filtro, usuario, agregar_tags=(), quitar_tags=(), categoria=None, criterios=None):
+    """
+    Agrega o quita etiquetas y cambia la categoría de los documentos que cumplen
+    el filtro, en un solo bulk_write. Devuelve el resultado que se registra en la auditoría
+    """
+    inicio = time.monotonic()
+    agregar_tags = [tag for tag in agregar_tags if tag]
+    quitar_tags = [tag for tag in quitar_tags if tag]
+    if not (agregar_tags or quitar_tags or categoria):
+        raise ValueError("No hay ningún cambio que aplicar")
+
+    sello = {"fecha_actualizacion": datetime.utcnow(), "usuario_actualizacion": usuario}
+    primero = {"$set": {**sello, **({"categoria": categoria} if categoria else {})}}
+    if agregar_tags:
+        primero["$addToSet"] = {"tags": {"$each": agregar_tags}}
+    operaciones = []
+    if quitar_tags:
+        # $addToSet y $pull sobre el mismo campo no pueden ir en la misma actualización.
+        # El $pull va primero porque la otra puede cambiar la categoría por la que se filtra
+        operaciones.append(UpdateMany(filtro, {"$pull": {"tags": {"$in": quitar_tags}}}))
+    operaciones.append(UpdateMany(filtro, primero))
+
+    resultado = {"documentos_afectados": 0, "errores": []}
+    try:
+        detalles = db.documentos.bulk_write(operaciones, ordered=True)
+        resultado["documentos_afectados"] = detalles.matched_count // len(operaciones)
+        resultado["modificados"] = detalles.modified_count
+    except Exception as e:
+        resultado["errores"].append(str(e))
+    finally:
+        cambios.documentos_modificados(db)
+
+    resultado["segundos"] = round(time.monotonic() - inicio, 2)
+    registrar_auditoria(
+        db, ACTUALIZAR, criterios or {}, filtro, usuario, resultado,
+        {"agregar_tags": agregar_tags, "quitar_tags": quitar_tags, "categoria": categoria}
+    )
+    return resultado
+
+
+def ultimas_operaciones(db, limite=20):
+    return list(db.auditoria.find({}, {"filtro": 0}).sort("fecha", -1).limit(limite))
@@ -0,0 +1,152 @@
+"""
+Medición del tiempo que se va en cada etapa de la aplicación y de las cargas.
+
+`medir("etapa")` es un context manager que acumula llamadas, tiempo total y
+máximo por etapa; `contar("nombre", n)` suma contadores. Los comandos que el
+driver envía a MongoDB se miden aparte con un CommandListener de pymongo
+(latencia por comando y bytes devueltos), registrado en los clientes que crea
+base_datos.RegistroClientes. Todo se acumula en un registro único del proceso,
+así que incluye también las cargas que ejecuta el ejecutor en segundo plano.
+
+El tiempo de las etapas de interfaz es el que tarda el script en generar los
+elementos; el dibujado en el navegador no se puede medir desde Python.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import bson
+from pymongo import monitoring
+
+# "0" desactiva la medición (los context managers no hacen nada)
+ACTIVO = os.environ.get("DOCS_RENDIMIENTO", "1") != "0"
+
+
+class Acumulado:
+    """Llamadas, tiempo total, máximo y último de una etapa o comando (en segundos)"""
+
+    __slots__ = ("llamadas", "total", "maximo", "ultimo", "fallidos", "bytes")
+
+    def __init__(self):
+        self.llamadas = 0
+        self.total = 0.0
+        self.maximo = 0.0
+        self.ultimo = 0.0
+        self.fallidos = 0
+        self.bytes = 0
+
+    def sumar(self, segundos, fallido=False, bytes_devueltos=0):
+        self.llamadas += 1
+        self.total += segundos
+        self.ultimo = segundos
+        if segundos > self.maximo:
+            self.maximo = segundos
+        if fallido:
+            self.fallidos += 1
+        self.bytes += bytes_devueltos
+
+    def como_dict(self):
+        return {
+            "llamadas": self.llamadas,
+            "fallidos": self.fallidos,
+            "total_ms": round(self.total * 1000, 2),
+            "media_ms": round(self.total * 1000 / self.llamadas, 2) if self.llamadas else 0.0,
+            "maximo_ms": round(self.maximo * 1000, 2),
+            "ultimo_ms": round(self.ultimo * 1000, 2),
+            "bytes": self.bytes
+        }
+
+
+class RegistroRendimiento:
+    """Acumulados por etapa, por comando de MongoDB y contadores; seguro entre hilos"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reiniciar()
+
+    def reiniciar(self):
+        with self._lock:
+            self._etapas = {}
+            self._comandos = {}
+            self._contadores = {}
+            self._desde = datetime.utcnow()
+
+    def registrar_etapa(self, etapa, segundos, fallido=False):
+        with self._lock:
+            self._etapas.setdefault(etapa, Acumulado()).sumar(segundos, fallido)
+
+    def registrar_comando(self, comando, segundos, fallido=False, bytes_devueltos=0):
+        with self._lock:
+            self._comandos.setdefault(comando, Acumulado()).sumar(segundos, fallido, bytes_devueltos)
+
+    def contar(self, nombre, valor=1):
+        with self._lock:
+            self._contadores[nombre] = self._contadores.get(nombre, 0) + valor
+
+    def exportar(self):
+        """Copia de todos los acumulados, lista para mostrar o guardar como JSON"""
+        with self._lock:
+            return {
+                "desde": self._desde.isoformat(),
+                "hasta": datetime.utcnow().isoformat(),
+                "etapas": {etapa: acumulado.como_dict() for etapa, acumulado in sorted(self._etapas.items())},
+                "comandos": {comando: acumulado.como_dict() for comando, acumulado in sorted(self._comandos.items())},
+                "contadores": dict(sorted(self._contadores.items()))
+            }
+
+
+class MonitorComandos(monitoring.CommandListener):
+    """Mide cada comando que el driver envía a MongoDB (latencia del servidor y red, y bytes de la respuesta)"""
+
+    def __init__(self, registro):
+        self.registro = registro
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        try:
+            bytes_devueltos = len(bson.encode(event.reply))
+        except Exception:
+            bytes_devueltos = 0
+        self.registro.registrar_comando(event.command_name, event.duration_micros / 1e6, bytes_devueltos=bytes_devueltos)
+
+    def failed(self, event):
+        self.registro.registrar_comando(event.command_name, event.duration_micros / 1e6, fallido=True)
+
+
+# Registro único del proceso y el listener que se pasa a los MongoClient
+REGISTRO = RegistroRendimiento()
+MONITOR_COMANDOS = MonitorComandos(REGISTRO)
+
+
+def listeners():
+    """event_listeners para un MongoClient nuevo (ninguno si la medición está desactivada)"""
+    return [MONITOR_COMANDOS] if ACTIVO else []
+
+
+@contextmanager
+def medir(etapa):
+    """
+    Acumula el tiempo del bloque en `etapa`. Si el bloque lanza una excepción
+    cuenta como fallido (no las de control de flujo de Streamlit, como st.rerun)
+    """
+    if not ACTIVO:
+        yield
+        return
+    inicio = time.perf_counter()
+    fallido = False
+    try:
+        yield
+    except Exception:
+        fallido = True
+        raise
+    finally:
+        REGISTRO.registrar_etapa(etapa, time.perf_counter() - inicio, fallido)
+
+
+def contar(nombre, valor=1):
+    if ACTIVO:
+        REGISTRO.contar(nombre, valor)
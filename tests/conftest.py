@@ -0,0 +1,35 @@
+"""
+Configuración común de las pruebas: MongoDB simulado con mongomock y el
+almacenamiento local en un directorio temporal. Las variables de entorno se
+fijan antes de importar los módulos de la aplicación, que las leen al cargarse.
+"""
+import os
+import sys
+from pathlib import Path
+
+os.environ["DOCS_ALMACENAMIENTO"] = "local"
+os.environ["DOCS_VIGILAR_CAMBIOS"] = "0"
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import mongomock  # noqa: E402
+import pytest  # noqa: E402
+
+import almacenamiento  # noqa: E402
+
+
+@pytest.fixture
+def db():
+    db = mongomock.MongoClient().documentation_db
+    # mongomock no aplica el filtro parcial del índice real (ver base_datos.py);
+    # en las pruebas todos los documentos vienen de un ZIP, así que es equivalente
+    db.documentos.create_index([("ci", 1), ("nombre_archivo", 1)], unique=True)
+    return db
+
+
+@pytest.fixture
+def almacen(tmp_path, monkeypatch):
+    """AlmacenLocal en un directorio temporal, usado también al liberar archivos"""
+    almacen = almacenamiento.AlmacenLocal(tmp_path / "archivos")
+    monkeypatch.setattr(almacenamiento, "obtener_almacen", lambda db, nombre=None: almacen)
+    return almacen
+
@@ -0,0 +1,140 @@
+import io
+import os
+
+import almacenamiento
+
+
+def archivos_guardados(almacen):
+    return [ruta for ruta in almacen.directorio.rglob("*") if ruta.is_file()]
+
+
+def guardar(db, almacen, contenido, nombre="archivo.pdf"):
+    guardado = almacenamiento.guardar_deduplicado(db, almacen, io.BytesIO(contenido), nombre)
+    return {**guardado, "nombre_archivo": nombre}
+
+
+def test_guardar_deduplicado_reutiliza_el_mismo_contenido(db, almacen):
+    primero = guardar(db, almacen, b"contenido repetido" * 100)
+    segundo = guardar(db, almacen, b"contenido repetido" * 100, "otro.pdf")
+
+    assert not primero["reutilizado"]
+    assert segundo["reutilizado"]
+    assert segundo["blob_id"] == primero["blob_id"]
+    assert db.blobs.find_one({"_id": primero["sha256"]})["referencias"] == 2
+    assert len(archivos_guardados(almacen)) == 1
+
+
+def test_guardar_deduplicado_comprime_y_recupera_el_original(db, almacen):
+    contenido = b"texto muy repetitivo " * 50000
+    guardado = guardar(db, almacen, contenido)
+
+    assert guardado["compresion"]
+    assert guardado["tamaño_bytes"] == len(contenido)
+    assert guardado["tamaño_almacenado"] < guardado["tamaño_bytes"]
+    assert almacenamiento.leer_contenido(db, guardado) == contenido
+
+
+def test_guardar_deduplicado_no_comprime_lo_incompresible(db, almacen):
+    contenido = os.urandom(200000)
+    guardado = guardar(db, almacen, contenido)
+
+    assert guardado["compresion"] is None
+    assert guardado["tamaño_almacenado"] == len(contenido)
+    assert almacenamiento.leer_contenido(db, guardado) == contenido
+
+
+def test_eliminar_contenido_borra_el_archivo_con_la_ultima_referencia(db, almacen):
+    primero = guardar(db, almacen, b"compartido" * 100)
+    segundo = guardar(db, almacen, b"compartido" * 100, "otro.pdf")
+
+    almacenamiento.eliminar_contenido(db, primero)
+    assert db.blobs.find_one({"_id": primero["sha256"]})["referencias"] == 1
+    assert almacenamiento.leer_contenido(db, segundo) == b"compartido" * 100
+
+    almacenamiento.eliminar_contenido(db, segundo)
+    assert db.blobs.count_documents({}) == 0
+    assert archivos_guardados(almacen) == []
+
+
+def test_eliminar_contenido_ignora_los_documentos_en_linea(db, almacen):
+    guardar(db, almacen, b"otro archivo" * 100)
+
+    almacenamiento.eliminar_contenido(db, {"almacenamiento": almacenamiento.EN_LINEA, "contenido_binario": b"x"})
+
+    assert db.blobs.count_documents({}) == 1
+    assert len(archivos_guardados(almacen)) == 1
+
+
+def test_liberar_contenidos_descuenta_las_referencias_en_bloque(db, almacen):
+    compartidos = [guardar(db, almacen, b"compartido" * 100, f"copia{i}.pdf") for i in range(3)]
+    unico = guardar(db, almacen, b"unico" * 100)
+
+    errores = almacenamiento.liberar_contenidos(db, compartidos[:2] + [unico])
+
+    assert errores == []
+    assert db.blobs.find_one({"_id": compartidos[0]["sha256"]})["referencias"] == 1
+    assert db.blobs.find_one({"_id": unico["sha256"]}) is None
+    assert len(archivos_guardados(almacen)) == 1
+    assert almacenamiento.leer_contenido(db, compartidos[2]) == b"compartido" * 100
+
+
+class SinRebobinar(io.RawIOBase):
+    """Flujo que solo se puede leer hacia delante, como una respuesta de red"""
+
+    def __init__(self, contenido):
+        self._datos = io.BytesIO(contenido)
+
+    def readable(self):
+        return True
+
+    def readinto(self, destino):
+        bloque = self._datos.read(len(destino))
+        destino[:len(bloque)] = bloque
+        return len(bloque)
+
+
+def contar_subidas(almacen, monkeypatch):
+    subidas = []
+    guardar_original = almacen.guardar
+
+    def guardar(flujo, nombre_archivo, metadatos=None):
+        subidas.append(nombre_archivo)
+        return guardar_original(flujo, nombre_archivo, metadatos)
+
+    monkeypatch.setattr(almacen, "guardar", guardar)
+    return subidas
+
+
+def test_guardar_deduplicado_no_sube_un_contenido_ya_almacenado(db, almacen, monkeypatch):
+    subidas = contar_subidas(almacen, monkeypatch)
+    primero = guardar(db, almacen, b"repetido" * 1000)
+
+    segundo = guardar(db, almacen, b"repetido" * 1000, "copia.pdf")
+
+    assert subidas == ["archivo.pdf"]
+    assert segundo["reutilizado"]
+    assert segundo["blob_id"] == primero["blob_id"]
+    assert db.blobs.find_one({"_id": primero["sha256"]})["referencias"] == 2
+
+
+def test_guardar_deduplicado_con_un_tamaño_nuevo_no_lee_dos_veces(db, almacen):
+    guardar(db, almacen, b"otro contenido" * 10)
+    flujo = io.BytesIO(b"nuevo" * 1000)
+    lecturas = []
+    leer_original = flujo.read
+    flujo.read = lambda tamaño=-1: lecturas.append(tamaño) or leer_original(tamaño)
+
+    almacenamiento.guardar_deduplicado(db, almacen, flujo, "nuevo.pdf", tamaño=5000)
+
+    # Una sola pasada: el bloque inicial y la lectura vacía del final
+    assert len(lecturas) == 2
+
+
+def test_guardar_deduplicado_sin_rebobinar_tambien_deduplica(db, almacen):
+    primero = guardar(db, almacen, b"repetido" * 1000)
+
+    segundo = almacenamiento.guardar_deduplicado(db, almacen, SinRebobinar(b"repetido" * 1000), "copia.pdf")
+
+    assert segundo["reutilizado"]
+    assert segundo["blob_id"] == primero["blob_id"]
+    assert len(archivos_guardados(almacen)) == 1
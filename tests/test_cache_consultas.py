@@ -0,0 +1,76 @@
+import pytest
+
+import cache_consultas
+
+ORDEN = [("fecha_creacion", -1)]
+PROYECCION = {"_id": 0, "titulo": 1}
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = cache_consultas.CacheConsultas(ttl=60, max_entradas=2)
+    monkeypatch.setattr(cache_consultas, "CACHE", cache)
+    return cache
+
+
+def titulos(db):
+    return [doc["titulo"] for doc in cache_consultas.buscar(db, {}, PROYECCION, [("titulo", 1)])]
+
+
+def test_buscar_repite_el_resultado_hasta_que_se_invalida(db, cache):
+    db.documentos.insert_one({"titulo": "a", "nombre_archivo": "a.pdf"})
+    assert titulos(db) == ["a"]
+
+    # Un cambio sin invalidar no se ve: la consulta sale de la caché
+    db.documentos.insert_one({"titulo": "b", "nombre_archivo": "b.pdf"})
+    assert titulos(db) == ["a"]
+
+    cache_consultas.invalidar(db)
+    assert titulos(db) == ["a", "b"]
+
+
+def test_buscar_devuelve_copias_de_la_lista(db, cache):
+    db.documentos.insert_one({"titulo": "a", "nombre_archivo": "a.pdf"})
+    cache_consultas.buscar(db, {}, PROYECCION, ORDEN).append({"titulo": "intruso"})
+
+    assert titulos(db) == ["a"]
+
+
+def test_no_guarda_un_resultado_consultado_antes_de_invalidar(db, cache):
+    generacion = cache.generacion(db)
+    cache.invalidar(db)
+
+    cache.guardar(db, "clave", [{"titulo": "viejo"}], generacion)
+
+    assert cache.obtener(db, "clave") is None
+    assert cache.resumen()["entradas"] == 0
+
+
+def test_las_entradas_caducan(db):
+    cache = cache_consultas.CacheConsultas(ttl=0)
+    cache.guardar(db, "clave", [{"titulo": "a"}], cache.generacion(db))
+
+    assert cache.obtener(db, "clave") is None
+
+
+def test_descarta_la_entrada_usada_hace_mas_tiempo(db, cache):
+    for clave in ("a", "b"):
+        cache.guardar(db, clave, [{"titulo": clave}], 0)
+    cache.obtener(db, "a")
+
+    cache.guardar(db, "c", [{"titulo": "c"}], 0)
+
+    assert cache.obtener(db, "b") is None
+    assert cache.obtener(db, "a") == [{"titulo": "a"}]
+    assert cache.resumen()["entradas"] == 2
+
+
+def test_invalidar_una_base_de_datos_no_afecta_a_otra(db, cache):
+    otra = db.client.otra_db
+    cache.guardar(db, "propia", [{"titulo": "a"}], 0)
+    cache.guardar(otra, "ajena", [{"titulo": "b"}], 0)
+
+    cache.invalidar(db)
+
+    assert cache.obtener(db, "propia") is None
+    assert cache.obtener(otra, "ajena") == [{"titulo": "b"}]
@@ -0,0 +1,25 @@
+import time
+
+import mongomock
+from pymongo.errors import AutoReconnect
+
+import cambios
+
+
+def test_sondeo_espera_entre_reintentos_si_falla_la_primera_consulta(db, monkeypatch):
+    intentos = []
+
+    def sin_conexion(*args, **opciones):
+        intentos.append(time.monotonic())
+        raise AutoReconnect("sin conexión")
+
+    monkeypatch.setattr(cambios, "INTERVALO_SONDEO", 0.1)
+    monkeypatch.setattr(mongomock.collection.Collection, "find_one", sin_conexion)
+    vigilante = cambios.VigilanteDocumentos(db)
+    try:
+        time.sleep(0.35)
+    finally:
+        vigilante.detener()
+
+    assert vigilante.modo == "sondeo"
+    assert 1 <= len(intentos) <= 5
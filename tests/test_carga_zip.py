@@ -0,0 +1,236 @@
+import io
+import zipfile
+from datetime import datetime
+
+import mongomock
+import pytest
+from pymongo.errors import AutoReconnect
+
+import almacenamiento
+import carga_zip
+import compresion
+import extraccion_ci
+import trabajos
+
+CI = "1712345678"
+
+
+def documento(db, almacen, nombre_archivo, contenido, usuario="ana"):
+    """Documento como los que genera procesar_archivo_desde_zip, con su archivo ya subido"""
+    guardado = almacenamiento.guardar_deduplicado(db, almacen, io.BytesIO(contenido), nombre_archivo)
+    ahora = datetime.utcnow()
+    return {
+        "ci": CI,
+        "nombre_archivo": nombre_archivo,
+        "tipo": "pdf",
+        "procesado_desde_zip": True,
+        "fecha_creacion": ahora,
+        "fecha_actualizacion": ahora,
+        "usuario_creacion": usuario,
+        "usuario_actualizacion": usuario,
+        **{campo: guardado[campo] for campo in ("almacenamiento", "blob_id", "tamaño_bytes", "compresion", "sha256")}
+    }
+
+
+def referencias(db, doc):
+    blob = db.blobs.find_one({"_id": doc["sha256"]})
+    return blob["referencias"] if blob else 0
+
+
+def test_escribir_lote_inserta_los_documentos(db, almacen):
+    lote = [documento(db, almacen, f"doc{i}.pdf", f"contenido {i}".encode() * 100) for i in range(3)]
+
+    resultado = carga_zip.escribir_lote(db, lote)
+
+    assert resultado["insertados"] == 3
+    assert resultado["estados"] == [(trabajos.INSERTADO, None)] * 3
+    assert resultado["errores"] == []
+    assert db.documentos.count_documents({}) == 3
+
+
+def test_escribir_lote_libera_el_archivo_de_los_duplicados(db, almacen):
+    original = documento(db, almacen, "doc.pdf", b"original" * 100)
+    carga_zip.escribir_lote(db, [original])
+    repetido = documento(db, almacen, "doc.pdf", b"otra version" * 100)
+
+    resultado = carga_zip.escribir_lote(db, [repetido])
+
+    assert resultado["duplicados"] == 1
+    assert resultado["estados"] == [(trabajos.DUPLICADO, None)]
+    assert referencias(db, repetido) == 0
+    guardado = db.documentos.find_one({"ci": CI, "nombre_archivo": "doc.pdf"})
+    assert almacenamiento.leer_contenido(db, guardado) == b"original" * 100
+
+
+def test_escribir_lote_sobrescribiendo_conserva_la_creacion_y_libera_el_archivo_anterior(db, almacen):
+    original = documento(db, almacen, "doc.pdf", b"original" * 100, usuario="ana")
+    carga_zip.escribir_lote(db, [original])
+    nuevo = documento(db, almacen, "doc.pdf", b"nueva version" * 100, usuario="luis")
+
+    resultado = carga_zip.escribir_lote(db, [nuevo], sobrescribir=True)
+
+    assert resultado["reemplazados"] == 1
+    assert resultado["estados"] == [(trabajos.REEMPLAZADO, None)]
+    assert db.documentos.count_documents({}) == 1
+    guardado = db.documentos.find_one({"ci": CI, "nombre_archivo": "doc.pdf"})
+    assert guardado["usuario_creacion"] == "ana"
+    assert guardado["usuario_actualizacion"] == "luis"
+    assert almacenamiento.leer_contenido(db, guardado) == b"nueva version" * 100
+    assert referencias(db, original) == 0
+
+
+def test_escribir_lote_sobrescribiendo_inserta_los_nuevos(db, almacen):
+    resultado = carga_zip.escribir_lote(db, [documento(db, almacen, "doc.pdf", b"nuevo" * 100)], sobrescribir=True)
+
+    assert resultado["insertados"] == 1
+    assert resultado["estados"] == [(trabajos.INSERTADO, None)]
+    assert db.documentos.count_documents({}) == 1
+
+
+def test_escribir_lote_sin_liberar_deja_los_archivos_para_despues(db, almacen):
+    carga_zip.escribir_lote(db, [documento(db, almacen, "doc.pdf", b"original" * 100)])
+    repetido = documento(db, almacen, "doc.pdf", b"otra version" * 100)
+
+    resultado = carga_zip.escribir_lote(db, [repetido], liberar=False)
+
+    assert resultado["por_liberar"] == [repetido]
+    assert referencias(db, repetido) == 1
+
+
+def test_escribir_lote_cortado_a_medias_solo_libera_lo_no_escrito(db, almacen, monkeypatch):
+    lote = [documento(db, almacen, f"doc{i}.pdf", f"contenido {i}".encode() * 100) for i in range(3)]
+    bulk_write = mongomock.collection.Collection.bulk_write
+
+    def escribe_dos_y_se_corta(coleccion, operaciones, ordered=True, **opciones):
+        bulk_write(coleccion, operaciones[:2], ordered=ordered)
+        raise AutoReconnect("conexión perdida")
+
+    monkeypatch.setattr(mongomock.collection.Collection, "bulk_write", escribe_dos_y_se_corta)
+    resultado = carga_zip.escribir_lote(db, lote)
+
+    assert resultado["insertados"] == 2
+    assert resultado["fallidos"] == 1
+    assert [estado for estado, _ in resultado["estados"]] == [trabajos.INSERTADO, trabajos.INSERTADO, trabajos.ERROR]
+    assert [referencias(db, doc) for doc in lote] == [1, 1, 0]
+    for guardado in db.documentos.find():
+        assert almacenamiento.leer_contenido(db, guardado)
+
+
+def test_escribir_lote_sin_poder_comprobar_lo_escrito_no_libera_nada(db, almacen, monkeypatch):
+    lote = [documento(db, almacen, "doc.pdf", b"contenido" * 100)]
+
+    def falla(*args, **kwargs):
+        raise AutoReconnect("sin conexión")
+
+    monkeypatch.setattr(mongomock.collection.Collection, "bulk_write", falla)
+    monkeypatch.setattr(carga_zip, "indices_escritos", falla)
+    with pytest.raises(AutoReconnect):
+        carga_zip.escribir_lote(db, lote)
+
+    assert referencias(db, lote[0]) == 1
+
+
+def test_conciliar_subidas_da_por_insertado_lo_escrito_y_libera_el_resto(db, almacen):
+    trabajos.crear_trabajo(db, "lote", None, "carga.zip", {}, "ana", {})
+    escrito = documento(db, almacen, "escrito.pdf", b"escrito" * 100)
+    perdido = documento(db, almacen, "perdido.pdf", b"perdido" * 100)
+    trabajos.registrar_subidas(db, "lote", [("zip/escrito.pdf", escrito), ("zip/perdido.pdf", perdido)])
+    db.documentos.insert_one(dict(escrito))
+
+    escritos, liberados = carga_zip.conciliar_subidas(db, "lote")
+
+    assert [miembro["nombre"] for miembro in escritos] == ["zip/escrito.pdf"]
+    assert [miembro["nombre"] for miembro in liberados] == ["zip/perdido.pdf"]
+    assert trabajos.miembros_terminados(db, "lote") == {"zip/escrito.pdf"}
+    assert trabajos.subidas_sin_confirmar(db, "lote") == []
+    assert referencias(db, escrito) == 1
+    assert referencias(db, perdido) == 0
+    contadores = trabajos.obtener_trabajo(db, "lote")["contadores"]
+    assert contadores["insertados"] == 1
+    assert contadores["fallidos"] == 1
+
+
+def test_leer_metadatos_conserva_ceros_y_normaliza_los_ci():
+    csv = "\ufeff ci , nombre ,etiquetas\n0912345678, Ana ,\n17.123.456-70,Luis,\"a,b\"\n"
+
+    df = carga_zip.leer_metadatos(io.BytesIO(csv.encode("utf-8")))
+
+    assert list(df.columns) == ["ci", "nombre", "etiquetas"]
+    assert df["ci"].tolist() == ["0912345678", "1712345670"]
+    assert df["nombre"].tolist() == ["Ana", "Luis"]
+    assert df["etiquetas"].isna().tolist() == [True, False]
+
+
+def test_metadatos_por_ci_mantiene_los_ci_con_formato_inesperado():
+    csv = "ci,nombre,categoria\n1712345670,Ana,\nEMP-42,Luis,Legal\n1712345670,Ana María,Personal\n,Sin CI,\n99,,\n"
+    df = carga_zip.leer_metadatos(io.BytesIO(csv.encode("utf-8")))
+
+    metadatos = carga_zip.mapear_metadatos(df)
+
+    assert set(metadatos.cis()) == {"1712345670", "EMP42"}
+    # Con CI repetidos gana la última fila; las celdas vacías no aparecen
+    assert metadatos.get("1712345670") == {"ci": "1712345670", "nombre": "Ana María", "categoria": "Personal"}
+    assert metadatos.get("EMP42")["nombre"] == "Luis"
+    assert metadatos.get("99") is None
+
+
+def test_revisar_cis_informa_sin_descartar():
+    csv = "ci,nombre\n1712345675,Ana\n1712345671,Luis\nEMP42,Eva\n1712345675,Ana\n0912345675,\n"
+    df = carga_zip.leer_metadatos(io.BytesIO(csv.encode("utf-8")))
+
+    problemas = carga_zip.revisar_cis(df)
+    # Con la validación de cédula, 1712345671 no pasa el dígito verificador
+    problemas_cedula = carga_zip.revisar_cis(df, validar_cedula=True)
+
+    assert problemas == {"mal_formados": [(4, "EMP42")], "repetidos": ["1712345675"], "sin_nombre": [6]}
+    assert problemas_cedula["mal_formados"] == [(3, "1712345671"), (4, "EMP42")]
+
+
+def plan(db, sobrescribir=False):
+    zip_en_memoria = io.BytesIO()
+    with zipfile.ZipFile(zip_en_memoria, "w") as zip_ref:
+        zip_ref.writestr("1712345675_a.pdf", b"A" * 1000)
+        zip_ref.writestr("copia/1712345675_a.pdf", b"otra" * 10)
+        zip_ref.writestr("1712345675_d.pdf", b"A" * 1000)
+        zip_ref.writestr("0912345675_c.pdf", b"C" * 300)
+        zip_ref.writestr("1712345676_b.pdf", b"B" * 200)
+        zip_ref.writestr("escaneo.pdf", b"S" * 50)
+        zip_ref.writestr("1712345675_nota.txt", b"no se carga")
+    csv = "ci,nombre\n1712345675,Ana\n0912345675,Luis\n0101010101,Eva\n"
+    metadatos = carga_zip.mapear_metadatos(carga_zip.leer_metadatos(io.BytesIO(csv.encode())))
+    return carga_zip.planificar_carga(
+        db, carga_zip.leer_manifiesto(zip_en_memoria), [".pdf"], None, metadatos,
+        extraccion_ci.obtener_extractor("CI al inicio"), sobrescribir
+    )
+
+
+def test_planificar_carga_clasifica_cada_archivo_sin_leerlo(db, monkeypatch):
+    monkeypatch.setattr(compresion, "codec_disponible", lambda: None)
+    db.documentos.insert_one({"ci": "0912345675", "nombre_archivo": "0912345675_c.pdf"})
+
+    filas, resumen = plan(db)
+
+    assert {fila["archivo"]: fila["accion"] for fila in filas} == {
+        "1712345675_a.pdf": carga_zip.INSERTAR,
+        "copia/1712345675_a.pdf": carga_zip.DUPLICADO_EN_ZIP,
+        "1712345675_d.pdf": carga_zip.INSERTAR,
+        "0912345675_c.pdf": carga_zip.DUPLICADO_EN_BD,
+        "1712345676_b.pdf": carga_zip.SIN_METADATOS,
+        "escaneo.pdf": carga_zip.SIN_CI,
+    }
+    assert resumen["bytes_a_cargar"] == 2000
+    # _a y _d tienen el mismo contenido: se almacena una sola vez
+    assert resumen["crecimiento_estimado"] == 1000
+    assert resumen["cis_sin_metadatos"] == ["1712345676"]
+    assert resumen["cis_csv_sin_archivos"] == ["0101010101"]
+
+
+def test_planificar_carga_sobrescribiendo_reemplaza_lo_existente(db, monkeypatch):
+    monkeypatch.setattr(compresion, "codec_disponible", lambda: None)
+    db.documentos.insert_one({"ci": "0912345675", "nombre_archivo": "0912345675_c.pdf"})
+
+    filas, resumen = plan(db, sobrescribir=True)
+
+    assert resumen["por_accion"][carga_zip.REEMPLAZAR] == {"archivos": 1, "bytes": 300}
+    assert resumen["crecimiento_estimado"] == 1300
+    assert db.documentos.count_documents({}) == 1
@@ -0,0 +1,115 @@
+import time
+import zipfile
+
+import mongomock
+from pymongo.errors import AutoReconnect
+
+import base_datos
+import carga_zip
+import ejecutor_trabajos
+import trabajos
+
+PARAMETROS = {
+    "tipos_archivo": [".pdf"], "max_documentos": None, "tamaño_lote": 4,
+    "patron_busqueda": "CI al inicio", "sobrescribir": False, "hilos_lectura": 2, "hilos_escritura": 1
+}
+
+
+def crear_trabajo(db, tmp_path, archivos=6):
+    origen = tmp_path / "carga.zip"
+    with zipfile.ZipFile(origen, "w") as zip_ref:
+        for i in range(archivos):
+            zip_ref.writestr(f"171234567{i % 2}_doc{i}.pdf", f"contenido {i}".encode() * 100)
+    metadatos = tmp_path / "metadatos.csv"
+    metadatos.write_text("ci,nombre\n1712345670,Ana\n1712345671,Luis\n")
+    trabajos.crear_trabajo(
+        db, "lote", None, "carga.zip", PARAMETROS, "ana",
+        {"origen": str(origen), "metadatos": str(metadatos)}, temporales=False
+    )
+    return trabajos.tomar_trabajo(db, "lote", "prueba")
+
+
+def test_lote_escrito_aunque_bulk_write_falle_no_cuenta_como_fallido(db, almacen, tmp_path, monkeypatch):
+    trabajo = crear_trabajo(db, tmp_path)
+    escribir_lote = carga_zip.escribir_lote
+
+    def escribe_y_se_corta(*args, **opciones):
+        escribir_lote(*args, **opciones)
+        raise AutoReconnect("respuesta perdida")
+
+    # El lote se escribe pero el escritor no lo sabe: lo cuenta entero como fallido
+    monkeypatch.setattr(carga_zip, "escribir_lote", escribe_y_se_corta)
+    estado = ejecutor_trabajos.ejecutar_trabajo(db, trabajo)
+
+    final = trabajos.obtener_trabajo(db, "lote")
+    assert db.documentos.count_documents({}) == 6
+    assert (estado.insertados, estado.fallidos) == (6, 0)
+    assert final["estado"] == trabajos.COMPLETADO
+    assert final["contadores"]["insertados"] == 6
+    assert final["contadores"]["fallidos"] == 0
+
+
+def test_preparar_reintento_no_descuenta_dos_veces_los_fallidos(db):
+    trabajos.crear_trabajo(db, "lote", None, "carga.zip", PARAMETROS, "ana", {})
+    trabajos.registrar_miembros(db, "lote", [
+        ("a.pdf", trabajos.INSERTADO, None), ("b.pdf", trabajos.ERROR, "x"), ("c.pdf", trabajos.ERROR, "x")
+    ])
+
+    # Dos ejecuciones que se cortan antes de reintentar nada
+    trabajos.preparar_reintento(db, "lote")
+    contadores = trabajos.preparar_reintento(db, "lote")
+
+    assert contadores["fallidos"] == 0
+    assert contadores["insertados"] == 1
+    assert trabajos.obtener_trabajo(db, "lote")["contadores"] == contadores
+
+
+def test_recalcular_contadores_cuenta_los_errores(db):
+    trabajos.crear_trabajo(db, "lote", None, "carga.zip", PARAMETROS, "ana", {})
+    trabajos.registrar_miembros(db, "lote", [("a.pdf", trabajos.DUPLICADO, None), ("b.pdf", trabajos.ERROR, "x")])
+    trabajos.preparar_reintento(db, "lote")
+
+    contadores = trabajos.recalcular_contadores(db, "lote")
+
+    assert contadores["duplicados"] == 1
+    assert contadores["fallidos"] == 1
+
+
+class ClienteSimulado(mongomock.MongoClient):
+    cerrado = False
+
+    def close(self):
+        self.cerrado = True
+
+
+def esperar(condicion, segundos=5):
+    limite = time.monotonic() + segundos
+    while not condicion():
+        assert time.monotonic() < limite, "tiempo de espera agotado"
+        time.sleep(0.01)
+
+
+def test_ejecutor_libera_el_cliente_al_vaciarse_la_cola(almacen, tmp_path, monkeypatch):
+    registro = base_datos.RegistroClientes()
+    servidor = mongomock.store.ServerStore()
+    clientes = []
+
+    def crear_cliente(uri, **opciones):
+        clientes.append(ClienteSimulado(_store=servidor))
+        return clientes[-1]
+
+    monkeypatch.setattr(base_datos.pymongo, "MongoClient", crear_cliente)
+    monkeypatch.setattr(ejecutor_trabajos, "REGISTRO_CLIENTES", registro)
+    db = registro.obtener("mongodb://prueba", "usuario")[base_datos.NOMBRE_BD]
+    crear_trabajo(db, tmp_path)
+    trabajos.reencolar_trabajo(db, "lote")
+    # El usuario se desconecta con la carga todavía en cola
+    registro.liberar("mongodb://prueba", "usuario")
+
+    ejecutor = ejecutor_trabajos.EjecutorTrabajos(concurrencia=1, intervalo=0.01)
+    ejecutor.iniciar("mongodb://prueba")
+    esperar(lambda: not registro.resumen())
+
+    assert trabajos.obtener_trabajo(db, "lote")["estado"] == trabajos.COMPLETADO
+    assert clientes and all(cliente.cerrado for cliente in clientes)
+    assert not ejecutor._uris
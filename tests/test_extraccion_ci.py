@@ -0,0 +1,91 @@
+import re
+
+import pytest
+
+import extraccion_ci
+
+NOMBRES = [
+    "1712345675_informe.pdf",
+    "informe_1712345675.pdf",
+    "carpeta/0912345675 contrato.docx",
+    "Copia de CI-0912345675 y 1712345675_anexo.pdf",
+    "cedula 1712345675.pdf",
+    "identificacion_0912345675.PDF",
+    "sin numero.pdf",
+    "1234567.pdf",
+    "12345678901234.pdf",
+]
+
+
+def uno_por_uno(patrones, nombre):
+    """Referencia: probar los patrones en orden y quedarse con la primera coincidencia"""
+    raiz = extraccion_ci.raiz_nombre(nombre)
+    for patron in patrones:
+        coincidencia = re.search(patron, raiz, re.IGNORECASE)
+        if coincidencia:
+            return coincidencia.group(1)
+    return None
+
+
+@pytest.mark.parametrize("modo", extraccion_ci.PATRONES_CI)
+def test_una_pasada_equivale_a_probar_los_patrones_en_orden(modo):
+    extractor = extraccion_ci.ExtractorCI(modo)
+
+    for nombre in NOMBRES:
+        assert extractor.extraer(nombre) == uno_por_uno(extraccion_ci.PATRONES_POR_MODO[modo], nombre), nombre
+
+
+def test_gana_el_patron_de_mayor_prioridad_aunque_coincida_mas_a_la_derecha():
+    extractor = extraccion_ci.ExtractorCI("CI específico en nombre")
+
+    ci, indice, _ = extractor.extraer_con_patron("1712345675_copia_CI_0912345675.pdf")
+
+    assert (ci, indice) == ("0912345675", 0)
+
+
+def test_patrones_de_usuario_con_grupo_con_nombre_o_sin_grupos():
+    extractor = extraccion_ci.ExtractorCI("CI al inicio", (r"EMP-x(?P<ci>\d{4})-(\d{2})", r"[A-Z]{3}\d{3}"))
+
+    assert extractor.extraer("EMP-x1234-56.pdf") == "1234"
+    assert extractor.extraer("expediente ABC123.pdf") == "ABC123"
+    # Los patrones del modo van primero
+    assert extractor.extraer("1712345675 EMP-x1234-56.pdf") == "1712345675"
+
+
+def test_patron_de_usuario_no_valido_lanza_re_error():
+    with pytest.raises(re.error):
+        extraccion_ci.ExtractorCI("CI al inicio", ("EMP(",))
+
+
+def test_validar_cedula_descarta_las_no_validas_y_sigue_buscando():
+    extractor = extraccion_ci.ExtractorCI("CI en cualquier parte", validar_cedula=True)
+
+    assert extractor.extraer_con_patron("1712345670 y 1712345675.pdf") == ("1712345675", 0, False)
+    assert extractor.extraer_con_patron("1712345670.pdf") == (None, None, True)
+
+
+def test_es_cedula_valida():
+    assert extraccion_ci.es_cedula_valida("1712345675")
+    assert not extraccion_ci.es_cedula_valida("1712345670")
+    # Provincia 25 y tercer dígito 6 no existen
+    assert not extraccion_ci.es_cedula_valida("2512345675")
+    assert not extraccion_ci.es_cedula_valida("1762345675")
+    assert not extraccion_ci.es_cedula_valida("171234567")
+
+
+def test_extraer_lote_devuelve_los_ci_y_las_estadisticas():
+    extractor = extraccion_ci.ExtractorCI("CI al inicio", validar_cedula=True)
+
+    cis, estadisticas = extractor.extraer_lote(["1712345675_a.pdf", "1712345675_b.pdf", "1712345670.pdf", "x.pdf"])
+
+    assert cis == {"1712345675_a.pdf": "1712345675", "1712345675_b.pdf": "1712345675"}
+    assert (estadisticas["total"], estadisticas["con_ci"], estadisticas["sin_ci"]) == (4, 2, 2)
+    assert estadisticas["descartados_por_verificador"] == 1
+    assert estadisticas["cis_distintos"] == 1
+    assert estadisticas["ejemplos_sin_ci"] == ["1712345670.pdf", "x.pdf"]
+
+
+def test_raiz_nombre():
+    assert extraccion_ci.raiz_nombre("a/b/1712345675.informe.pdf") == "1712345675.informe"
+    assert extraccion_ci.raiz_nombre(".oculto") == ".oculto"
+    assert extraccion_ci.raiz_nombre("sin_extension") == "sin_extension"
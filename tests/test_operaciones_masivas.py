@@ -0,0 +1,88 @@
+import io
+from datetime import date, datetime
+
+import pytest
+
+import almacenamiento
+import operaciones_masivas
+
+
+def cargar(db, almacen, cantidad, lote="lote1", contenido=None, **campos):
+    """Documentos del lote con su archivo subido (todos comparten `contenido` si se indica)"""
+    for i in range(cantidad):
+        datos = contenido or f"{lote} {i}".encode() * 100
+        guardado = almacenamiento.guardar_deduplicado(db, almacen, io.BytesIO(datos), f"{lote}_{i}.pdf")
+        db.documentos.insert_one({
+            "ci": "1712345675", "nombre_archivo": f"{lote}_{i}.pdf", "lote_carga": lote, "tipo": "pdf",
+            "categoria": "Personal", "tags": ["a"], "fecha_creacion": datetime(2024, 5, 10),
+            **{campo: guardado[campo] for campo in ("almacenamiento", "blob_id", "tamaño_bytes", "compresion", "sha256")},
+            **campos
+        })
+
+
+def test_construir_filtro_exige_algun_criterio():
+    with pytest.raises(ValueError):
+        operaciones_masivas.construir_filtro(lote_carga="", ci=None)
+
+
+def test_construir_filtro_incluye_el_dia_final_completo():
+    filtro = operaciones_masivas.construir_filtro(ci=" 1712345675 ", fecha_desde=date(2024, 5, 1), fecha_hasta=date(2024, 5, 10))
+
+    assert filtro["ci"] == "1712345675"
+    assert filtro["fecha_creacion"]["$gte"] == datetime(2024, 5, 1)
+    assert filtro["fecha_creacion"]["$lte"] == datetime(2024, 5, 10, 23, 59, 59, 999999)
+
+
+def test_vista_previa_cuenta_documentos_y_bytes(db, almacen):
+    cargar(db, almacen, 3)
+    cargar(db, almacen, 2, lote="lote2")
+
+    vista = operaciones_masivas.vista_previa(db, {"lote_carga": "lote1"}, muestra=2)
+
+    assert vista["documentos"] == 3
+    assert vista["bytes"] == sum(doc["tamaño_bytes"] for doc in db.documentos.find({"lote_carga": "lote1"}))
+    assert len(vista["ejemplos"]) == 2
+
+
+def test_eliminar_por_filtro_va_por_lotes_y_libera_los_archivos(db, almacen):
+    compartido = b"mismo contenido" * 100
+    cargar(db, almacen, 5, contenido=compartido)
+    cargar(db, almacen, 1, lote="lote2", contenido=compartido)
+    cargar(db, almacen, 1, lote="lote3")
+    avances = []
+
+    resultado = operaciones_masivas.eliminar_por_filtro(
+        db, {"lote_carga": "lote1"}, "ana", {"lote_carga": "lote1"}, tamaño_lote=2, progreso=avances.append
+    )
+
+    assert resultado["documentos_afectados"] == 5
+    assert resultado["errores"] == []
+    assert avances == [2, 4, 5]
+    assert db.documentos.count_documents({}) == 2
+    # El archivo compartido con lote2 sigue guardado con una sola referencia
+    sha256 = db.documentos.find_one({"lote_carga": "lote2"})["sha256"]
+    assert db.blobs.find_one({"_id": sha256})["referencias"] == 1
+    auditoria = db.auditoria.find_one()
+    assert (auditoria["operacion"], auditoria["usuario"], auditoria["documentos_afectados"]) == ("eliminar", "ana", 5)
+    assert auditoria["criterios"] == {"lote_carga": "lote1"}
+
+
+def test_actualizar_por_filtro_etiqueta_y_recategoriza(db, almacen):
+    cargar(db, almacen, 3)
+    cargar(db, almacen, 1, lote="lote2")
+
+    resultado = operaciones_masivas.actualizar_por_filtro(
+        db, {"categoria": "Personal", "lote_carga": "lote1"}, "ana",
+        agregar_tags=["b", ""], quitar_tags=["a"], categoria="Legal"
+    )
+
+    assert resultado["documentos_afectados"] == 3
+    for doc in db.documentos.find({"lote_carga": "lote1"}):
+        assert (doc["tags"], doc["categoria"], doc["usuario_actualizacion"]) == (["b"], "Legal", "ana")
+    assert db.documentos.find_one({"lote_carga": "lote2"})["tags"] == ["a"]
+    assert db.auditoria.find_one()["cambios"] == {"agregar_tags": ["b"], "quitar_tags": ["a"], "categoria": "Legal"}
+
+
+def test_actualizar_por_filtro_sin_cambios_lanza_value_error(db):
+    with pytest.raises(ValueError):
+        operaciones_masivas.actualizar_por_filtro(db, {"lote_carga": "lote1"}, "ana", agregar_tags=[""])
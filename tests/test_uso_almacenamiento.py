@@ -0,0 +1,57 @@
+from datetime import datetime
+
+import pytest
+
+import uso_almacenamiento
+
+
+@pytest.fixture(autouse=True)
+def sin_collstats(monkeypatch):
+    # mongomock no implementa $collStats
+    monkeypatch.setattr(uso_almacenamiento, "uso_colecciones", lambda db: [])
+
+
+def cargar(db, lotes):
+    """Un documento por lote, con el tamaño indicado"""
+    db.documentos.insert_many([
+        {
+            "nombre_archivo": f"doc{i}.pdf", "lote_carga": lote, "ci": f"17123456{i % 3}", "tipo": "pdf",
+            "categoria": "Personal", "usuario_creacion": "ana", "fecha_creacion": datetime(2024, 5, 1 + i % 28),
+            "tamaño_bytes": tamaño
+        }
+        for i, (lote, tamaño) in enumerate(lotes)
+    ])
+
+
+def test_informe_suma_por_dimension(db):
+    cargar(db, [("a", 300), ("a", 100), ("b", 600), (None, None)])
+
+    informe = uso_almacenamiento.informe_uso(db)
+
+    assert informe["total"] == {"documentos": 4, "bytes": 1000, "sin_tamaño": 1}
+    lotes = {fila["valor"]: fila for fila in informe["dimensiones"]["lote_carga"]}
+    assert (lotes["a"]["documentos"], lotes["a"]["bytes"], lotes["a"]["maximo"]) == (2, 400, 300)
+    assert lotes["b"]["porcentaje"] == 60.0
+    assert informe["dimensiones"]["mes"][0]["valor"] == "2024-05"
+
+
+def test_lote_anomalo_respecto_a_la_mediana_de_todos_los_lotes(db):
+    # Entre los 100 lotes mayores la mediana es 100 y 400 no llegaría a 5 veces;
+    # con todos los lotes la mediana es 10
+    lotes = [(f"pequeño{i}", 10) for i in range(150)] + [(f"mediano{i}", 100) for i in range(60)]
+    cargar(db, lotes + [("grande", 400)])
+
+    informe = uso_almacenamiento.informe_uso(db)
+
+    anomalos = [fila["valor"] for fila in informe["dimensiones"]["lote_carga"] if fila["anomalo"]]
+    assert informe["mediana_lotes"] == 10
+    assert len(informe["dimensiones"]["lote_carga"]) == uso_almacenamiento.LIMITE_GRUPOS
+    assert "grande" in anomalos
+
+
+def test_un_solo_lote_o_sin_lote_no_es_anomalo(db):
+    cargar(db, [("a", 10), (None, 5000)])
+
+    informe = uso_almacenamiento.informe_uso(db)
+
+    assert not any(fila["anomalo"] for fila in informe["dimensiones"]["lote_carga"])
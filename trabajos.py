@@ -0,0 +1,314 @@
+"""
+Registro persistente de las cargas desde ZIP: cola de trabajos y puntos de control.
+
+Cada carga (`lote_carga`) tiene un registro en `trabajos_carga` con sus
+parámetros, contadores y progreso, que sirve también de cola: los ejecutores
+(ver ejecutor_trabajos.py) reclaman los trabajos pendientes de forma atómica.
+Cada archivo del ZIP tiene un registro en `miembros_carga` con su estado. Los
+estados se guardan cuando el lote correspondiente ya está escrito en
+`documentos`, así que al reanudar basta con una consulta para saber qué
+archivos saltar.
+
+Además, en cuanto un archivo se sube al almacenamiento (y suma una referencia a
+su contenido), su registro guarda la `subida`: el archivo y la identidad del
+documento que lo va a usar. El punto de control del lote la borra; las que
+sigan ahí al reanudar son de lotes que no llegaron a confirmarse (ver
+carga_zip.conciliar_subidas).
+"""
+import os
+from collections import Counter
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument, UpdateOne
+
+PENDIENTE = "pendiente"
+EN_CURSO = "en_curso"
+COMPLETADO = "completado"
+FALLIDO = "fallido"
+
+# Un trabajo en curso sin actualizaciones durante este tiempo se da por
+# interrumpido (el proceso que lo ejecutaba murió) y se puede volver a reclamar
+INACTIVIDAD_TRABAJO = timedelta(seconds=int(os.environ.get("DOCS_INACTIVIDAD_TRABAJO", 10 * 60)))
+
+# Estados de cada archivo; los que están en TERMINADOS no se vuelven a procesar al reanudar
+INSERTADO = "insertado"
+REEMPLAZADO = "reemplazado"
+DUPLICADO = "duplicado"
+SIN_CI = "sin_ci"
+ERROR = "error"
+# Subido al almacenamiento, pendiente de escribir su documento
+SUBIDO = "subido"
+TERMINADOS = (INSERTADO, REEMPLAZADO, DUPLICADO, SIN_CI)
+
+# Lo que se anota de cada archivo subido: su contenido (para liberarlo) y la
+# identidad del documento (para saber si llegó a escribirse)
+CAMPOS_SUBIDA = ("ci", "nombre_archivo", "almacenamiento", "blob_id", "sha256", "fecha_actualizacion")
+
+# Contador del trabajo que se incrementa por cada estado de archivo
+CONTADOR_POR_ESTADO = {
+    INSERTADO: "insertados",
+    REEMPLAZADO: "reemplazados",
+    DUPLICADO: "duplicados",
+    SIN_CI: "sin_ci",
+    ERROR: "fallidos"
+}
+
+
+def crear_trabajo(db, lote_id, hash_zip, nombre_zip, parametros, usuario, archivos,
+                  estado=PENDIENTE, trabajador=None, temporales=True):
+    """
+    Encola una carga nueva en `trabajos_carga`. `archivos` tiene las rutas del
+    origen (ZIP o directorio) y del CSV de metadatos, donde los pueda leer el
+    ejecutor; si son `temporales` se borran cuando la carga termina bien.
+    Quien ejecuta la carga por su cuenta la crea directamente en curso
+    """
+    ahora = datetime.utcnow()
+    db.trabajos_carga.insert_one({
+        "_id": lote_id,
+        "estado": estado,
+        "trabajador": trabajador,
+        "hash_zip": hash_zip,
+        "nombre_zip": nombre_zip,
+        "parametros": parametros,
+        "archivos": archivos,
+        "archivos_temporales": temporales,
+        "total": None,
+        "contadores": {contador: 0 for contador in CONTADOR_POR_ESTADO.values()},
+        "progreso": {},
+        "usuario": usuario,
+        "fecha_inicio": ahora,
+        "fecha_actualizacion": ahora
+    })
+
+
+def obtener_trabajo(db, lote_id):
+    return db.trabajos_carga.find_one({"_id": lote_id})
+
+
+def trabajos_sin_terminar(db, hash_zip=None):
+    """Cargas que no llegaron a completarse, de la más reciente a la más antigua"""
+    filtro = {"estado": {"$ne": COMPLETADO}}
+    if hash_zip:
+        filtro["hash_zip"] = hash_zip
+    return list(db.trabajos_carga.find(filtro).sort("fecha_actualizacion", -1))
+
+
+def hay_trabajos_abiertos(db):
+    """Si queda algún trabajo pendiente o en curso (en curso incluye los interrumpidos)"""
+    return db.trabajos_carga.find_one({"estado": {"$in": [PENDIENTE, EN_CURSO]}}, {"_id": 1}) is not None
+
+
+def esta_interrumpido(trabajo):
+    """Si el trabajo figura en curso pero nadie lo actualiza desde hace INACTIVIDAD_TRABAJO"""
+    return (
+        trabajo["estado"] == EN_CURSO
+        and trabajo["fecha_actualizacion"] < datetime.utcnow() - INACTIVIDAD_TRABAJO
+    )
+
+
+def reclamar_trabajo(db, trabajador):
+    """
+    Toma el trabajo pendiente más antiguo (o uno en curso abandonado) y lo marca
+    en curso a nombre de `trabajador`. Es atómico, así que varios ejecutores
+    pueden compartir la cola. Devuelve el trabajo o None si no hay ninguno
+    """
+    ahora = datetime.utcnow()
+    return db.trabajos_carga.find_one_and_update(
+        {"$or": [
+            {"estado": PENDIENTE},
+            {"estado": EN_CURSO, "fecha_actualizacion": {"$lt": ahora - INACTIVIDAD_TRABAJO}}
+        ]},
+        {"$set": {"estado": EN_CURSO, "trabajador": trabajador, "fecha_actualizacion": ahora}},
+        sort=[("fecha_inicio", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+def tomar_trabajo(db, lote_id, trabajador):
+    """
+    Marca en curso un trabajo concreto que no esté completado, para reanudarlo
+    fuera de la cola. Devuelve el trabajo o None si no existe o ya terminó
+    """
+    return db.trabajos_carga.find_one_and_update(
+        {"_id": lote_id, "estado": {"$ne": COMPLETADO}},
+        {"$set": {"estado": EN_CURSO, "trabajador": trabajador, "error": None, "fecha_actualizacion": datetime.utcnow()}},
+        return_document=ReturnDocument.AFTER
+    )
+
+
+def reencolar_trabajo(db, lote_id):
+    """Vuelve a dejar pendiente un trabajo fallido o interrumpido"""
+    db.trabajos_carga.update_one(
+        {"_id": lote_id, "estado": {"$ne": COMPLETADO}},
+        {"$set": {"estado": PENDIENTE, "error": None, "fecha_actualizacion": datetime.utcnow()}}
+    )
+
+
+def actualizar_progreso(db, lote_id, **valores):
+    """Guarda el progreso de la ejecución en curso (también sirve de señal de vida)"""
+    db.trabajos_carga.update_one(
+        {"_id": lote_id},
+        {"$set": {
+            **{f"progreso.{campo}": valor for campo, valor in valores.items()},
+            "fecha_actualizacion": datetime.utcnow()
+        }}
+    )
+
+
+def miembros_terminados(db, lote_id):
+    """Nombres de los archivos del trabajo que no hay que volver a procesar (una sola consulta)"""
+    cursor = db.miembros_carga.find(
+        {"lote_carga": lote_id, "estado": {"$in": list(TERMINADOS)}},
+        {"_id": 0, "nombre": 1}
+    )
+    return {miembro["nombre"] for miembro in cursor}
+
+
+def registrar_subidas(db, lote_id, subidas):
+    """
+    Anota los archivos recién subidos al almacenamiento, antes de escribir sus
+    documentos. `subidas` es una lista de tuplas (nombre del archivo en el ZIP, documento)
+    """
+    if not subidas:
+        return
+
+    ahora = datetime.utcnow()
+    db.miembros_carga.bulk_write([
+        UpdateOne(
+            {"lote_carga": lote_id, "nombre": nombre},
+            {"$set": {
+                "estado": SUBIDO,
+                "subida": {campo: documento[campo] for campo in CAMPOS_SUBIDA},
+                "fecha_actualizacion": ahora
+            }},
+            upsert=True
+        )
+        for nombre, documento in subidas
+    ], ordered=False)
+
+
+def subidas_sin_confirmar(db, lote_id):
+    """Archivos subidos cuyo lote no llegó a su punto de control"""
+    return list(db.miembros_carga.find(
+        {"lote_carga": lote_id, "subida": {"$exists": True}},
+        {"nombre": 1, "estado": 1, "subida": 1}
+    ))
+
+
+def reclasificar_miembros(db, lote_id, miembros, estado, error=None):
+    """
+    Cambia el estado de archivos ya registrados (`miembros`, con su nombre y su
+    estado anterior) y borra su subida anotada. Cada uno pasa del contador de su
+    estado anterior al del nuevo, así que no se cuenta dos veces
+    """
+    if not miembros:
+        return
+
+    ahora = datetime.utcnow()
+    db.miembros_carga.update_many(
+        {"lote_carga": lote_id, "nombre": {"$in": [miembro["nombre"] for miembro in miembros]}},
+        {"$set": {"estado": estado, "error": error, "fecha_actualizacion": ahora}, "$unset": {"subida": ""}}
+    )
+    incrementos = Counter()
+    for miembro in miembros:
+        if miembro.get("estado") in CONTADOR_POR_ESTADO:
+            incrementos[f"contadores.{CONTADOR_POR_ESTADO[miembro['estado']]}"] -= 1
+        incrementos[f"contadores.{CONTADOR_POR_ESTADO[estado]}"] += 1
+    incrementos = {campo: valor for campo, valor in incrementos.items() if valor}
+    if incrementos:
+        db.trabajos_carga.update_one(
+            {"_id": lote_id},
+            {"$inc": incrementos, "$set": {"fecha_actualizacion": ahora}}
+        )
+
+
+def registrar_miembros(db, lote_id, resultados, conservar_subidas=False):
+    """
+    Guarda el estado de un grupo de archivos y actualiza los contadores del trabajo.
+    `resultados` es una lista de tuplas (nombre del archivo en el ZIP, estado, error o None).
+    Borra sus subidas anotadas, salvo con `conservar_subidas` (no se sabe si sus
+    documentos llegaron a escribirse y hay que conciliarlas al reanudar)
+    """
+    if not resultados:
+        return
+
+    ahora = datetime.utcnow()
+    db.miembros_carga.bulk_write([
+        UpdateOne(
+            {"lote_carga": lote_id, "nombre": nombre},
+            {
+                "$set": {"estado": estado, "error": error, "fecha_actualizacion": ahora},
+                **({} if conservar_subidas else {"$unset": {"subida": ""}})
+            },
+            upsert=True
+        )
+        for nombre, estado, error in resultados
+    ], ordered=False)
+
+    incrementos = {}
+    for _, estado, _ in resultados:
+        campo = f"contadores.{CONTADOR_POR_ESTADO[estado]}"
+        incrementos[campo] = incrementos.get(campo, 0) + 1
+    db.trabajos_carga.update_one(
+        {"_id": lote_id},
+        {"$inc": incrementos, "$set": {"fecha_actualizacion": ahora}}
+    )
+
+
+def recalcular_contadores(db, lote_id, reintentar_errores=False):
+    """
+    Rehace los contadores del trabajo a partir del estado de sus archivos (una
+    agregación sobre el índice lote_estado). Con `reintentar_errores` los que
+    fallaron no cuentan, porque la ejecución que empieza los va a reintentar.
+    Devuelve los contadores
+    """
+    contadores = {contador: 0 for contador in CONTADOR_POR_ESTADO.values()}
+    cursor = db.miembros_carga.aggregate([
+        {"$match": {"lote_carga": lote_id}},
+        {"$group": {"_id": "$estado", "total": {"$sum": 1}}}
+    ])
+    for fila in cursor:
+        if fila["_id"] in CONTADOR_POR_ESTADO and not (reintentar_errores and fila["_id"] == ERROR):
+            contadores[CONTADOR_POR_ESTADO[fila["_id"]]] = fila["total"]
+    db.trabajos_carga.update_one({"_id": lote_id}, {"$set": {"contadores": contadores}})
+    return contadores
+
+
+def preparar_reintento(db, lote_id):
+    """
+    Al empezar cada ejecución de un trabajo, los archivos que fallaron en una
+    ejecución anterior se reintentan, así que no cuentan como fallidos. Los
+    contadores se recalculan desde cero: si la ejecución se corta antes de
+    reintentarlos, la siguiente no los descuenta otra vez
+    """
+    return recalcular_contadores(db, lote_id, reintentar_errores=True)
+
+
+def descartar_trabajo(db, lote_id):
+    """
+    Borra un trabajo que nadie está ejecutando (pendiente, fallido o interrumpido);
+    los documentos ya cargados se conservan. Devuelve el trabajo borrado, o None
+    si no existe, ya terminó o está en curso. El estado de sus archivos se borra
+    aparte (borrar_miembros), después de conciliar sus subidas
+    """
+    return db.trabajos_carga.find_one_and_delete({
+        "_id": lote_id,
+        "$or": [
+            {"estado": {"$in": [PENDIENTE, FALLIDO]}},
+            {"estado": EN_CURSO, "fecha_actualizacion": {"$lt": datetime.utcnow() - INACTIVIDAD_TRABAJO}}
+        ]
+    })
+
+
+def borrar_miembros(db, lote_id):
+    db.miembros_carga.delete_many({"lote_carga": lote_id})
+
+
+def finalizar_trabajo(db, lote_id, estado=COMPLETADO, error=None, errores=None):
+    db.trabajos_carga.update_one(
+        {"_id": lote_id},
+        {"$set": {
+            "estado": estado, "error": error, "errores": errores or [],
+            "fecha_actualizacion": datetime.utcnow(), "fecha_fin": datetime.utcnow()
+        }}
+    )
@@ -0,0 +1,178 @@
+"""
+Informe de cómo se reparte el almacenamiento de los documentos.
+
+Suma `tamaño_bytes` (tamaño original de cada archivo) por tipo, categoría,
+lote de carga, CI, usuario y mes de creación en una sola agregación. Todos los
+campos que usa están en el índice `uso_almacenamiento` (ver base_datos.py) y la
+agregación lo fuerza con `hint`: MongoDB la resuelve recorriendo solo el
+índice, sin leer los documentos ni, por tanto, sus contenidos o textos.
+
+El tamaño real en disco es otro: los archivos se deduplican y se comprimen
+(ver almacenamiento.py), y las colecciones y sus índices ocupan lo suyo. El
+informe incluye ambas cosas para poder planificar la capacidad del clúster.
+"""
+from datetime import datetime
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+import almacenamiento
+import rendimiento
+
+INDICE = "uso_almacenamiento"
+
+# Grupos que se devuelven por dimensión, de mayor a menor tamaño
+LIMITE_GRUPOS = 100
+
+# Un lote es anómalo si ocupa más de FACTOR_LOTE_ANOMALO veces la mediana de los lotes
+FACTOR_LOTE_ANOMALO = 5
+
+DIMENSIONES = {
+    "tipo": "$tipo",
+    "categoria": "$categoria",
+    "lote_carga": "$lote_carga",
+    "ci": "$ci",
+    "usuario_creacion": "$usuario_creacion",
+    "mes": {"$dateToString": {"format": "%Y-%m", "date": "$fecha_creacion"}},
+}
+
+CAMPOS = ["lote_carga", "ci", "tipo", "categoria", "usuario_creacion", "fecha_creacion", "tamaño_bytes"]
+
+
+def _grupo(expresion):
+    return [
+        {"$group": {
+            "_id": expresion,
+            "documentos": {"$sum": 1},
+            "bytes": {"$sum": "$tamaño_bytes"},
+            "maximo": {"$max": "$tamaño_bytes"},
+            "desde": {"$min": "$fecha_creacion"},
+            "hasta": {"$max": "$fecha_creacion"}
+        }},
+        {"$sort": {"bytes": -1, "_id": 1}},
+        {"$limit": LIMITE_GRUPOS}
+    ]
+
+
+# Mediana del tamaño de todos los lotes, no solo de los LIMITE_GRUPOS mayores
+MEDIANA_LOTES = [
+    {"$match": {"lote_carga": {"$ne": None}}},
+    {"$group": {"_id": "$lote_carga", "bytes": {"$sum": "$tamaño_bytes"}}},
+    {"$sort": {"bytes": 1}},
+    {"$group": {"_id": None, "tamaños": {"$push": "$bytes"}}},
+    {"$project": {
+        "_id": 0,
+        "lotes": {"$size": "$tamaños"},
+        "mediana": {"$arrayElemAt": ["$tamaños", {"$floor": {"$divide": [{"$size": "$tamaños"}, 2]}}]}
+    }}
+]
+
+
+def pipeline_uso():
+    """Agregación de totales y grupos por dimensión; solo lee campos del índice"""
+    return [
+        # Sin _id: así la proyección queda cubierta por el índice
+        {"$project": {"_id": 0, **{campo: 1 for campo in CAMPOS}}},
+        {"$facet": {
+            "total": [{"$group": {
+                "_id": None,
+                "documentos": {"$sum": 1},
+                "bytes": {"$sum": "$tamaño_bytes"},
+                "sin_tamaño": {"$sum": {"$cond": [{"$gt": ["$tamaño_bytes", None]}, 0, 1]}}
+            }}],
+            **{dimension: _grupo(expresion) for dimension, expresion in DIMENSIONES.items()},
+            "mediana_lotes": MEDIANA_LOTES
+        }}
+    ]
+
+
+def _fecha(valor):
+    return valor.isoformat() if isinstance(valor, datetime) else valor
+
+
+def _marcar_lotes_anomalos(filas, mediana_lotes):
+    """
+    Marca los lotes muy por encima de la mediana de todos los lotes, calculada en
+    la agregación (los documentos sin lote no cuentan)
+    """
+    lotes = mediana_lotes.get("lotes", 0)
+    mediana = mediana_lotes.get("mediana") or 0
+    for fila in filas:
+        fila["anomalo"] = fila["valor"] is not None and lotes > 1 and fila["bytes"] > FACTOR_LOTE_ANOMALO * mediana
+
+
+def uso_por_dimension(db):
+    """
+    Totales y grupos por dimensión. Devuelve (resultado, cubierto); `cubierto`
+    es False si el índice no existe y la agregación tuvo que leer los documentos
+    """
+    try:
+        resultado = next(db.documentos.aggregate(pipeline_uso(), hint=INDICE, allowDiskUse=True), {})
+        cubierto = True
+    except OperationFailure:
+        # Índice todavía sin crear (p. ej. sin permisos en asegurar_indices)
+        resultado = next(db.documentos.aggregate(pipeline_uso(), allowDiskUse=True), {})
+        cubierto = False
+    return resultado, cubierto
+
+
+def uso_colecciones(db):
+    """
+    Tamaño de datos, en disco y de índices de cada colección ($collStats; en un
+    clúster fragmentado hay una fila por fragmento y se suman). Las colecciones
+    cuyas estadísticas no se pueden leer (falta de permisos) se omiten
+    """
+    colecciones = []
+    for nombre in sorted(db.list_collection_names()):
+        try:
+            fragmentos = list(db[nombre].aggregate([{"$collStats": {"storageStats": {}}}]))
+        except PyMongoError:
+            continue
+        estadisticas = [fragmento.get("storageStats", {}) for fragmento in fragmentos]
+        colecciones.append({
+            "coleccion": nombre,
+            "documentos": sum(e.get("count", 0) for e in estadisticas),
+            "bytes_datos": sum(e.get("size", 0) for e in estadisticas),
+            "bytes_disco": sum(e.get("storageSize", 0) for e in estadisticas),
+            "bytes_indices": sum(e.get("totalIndexSize", 0) for e in estadisticas)
+        })
+    return colecciones
+
+
+def informe_uso(db):
+    """
+    Informe completo, serializable como JSON: totales, grupos por dimensión
+    (con los lotes anómalos marcados), colecciones y deduplicación
+    """
+    with rendimiento.medir("uso_almacenamiento.informe"):
+        resultado, cubierto = uso_por_dimension(db)
+
+        total = (resultado.get("total") or [{"documentos": 0, "bytes": 0, "sin_tamaño": 0}])[0]
+        total.pop("_id", None)
+
+        dimensiones = {}
+        for dimension in DIMENSIONES:
+            dimensiones[dimension] = [
+                {
+                    "valor": grupo["_id"],
+                    "documentos": grupo["documentos"],
+                    "bytes": grupo["bytes"],
+                    "maximo": grupo["maximo"] or 0,
+                    "porcentaje": round(100 * grupo["bytes"] / total["bytes"], 2) if total["bytes"] else 0.0,
+                    "desde": _fecha(grupo["desde"]),
+                    "hasta": _fecha(grupo["hasta"])
+                }
+                for grupo in resultado.get(dimension, [])
+            ]
+        mediana_lotes = (resultado.get("mediana_lotes") or [{}])[0]
+        _marcar_lotes_anomalos(dimensiones["lote_carga"], mediana_lotes)
+
+        return {
+            "calculado": datetime.utcnow().isoformat(),
+            "cubierto_por_indice": cubierto,
+            "limite_grupos": LIMITE_GRUPOS,
+            "mediana_lotes": mediana_lotes.get("mediana") or 0,
+            "total": total,
+            "dimensiones": dimensiones,
+            "colecciones": uso_colecciones(db),
+            "deduplicacion": almacenamiento.reporte_deduplicacion(db)
+        }